@@ -9,6 +9,8 @@ import time
 from datetime import datetime
 from logger import log
 from database import db
+from leader_election import background_leader
+import metrics
 from transfer_executor import TransferExecutor
 
 
@@ -117,15 +119,19 @@ class AbnormalTransferChecker:
         def _worker():
             log.info(f"异常转移检测后台任务已启动（间隔: {interval // 60} 分钟）", icon="rocket")
 
-            # 启动后等待 30 秒让服务器完全启动
+            # 启动后等待 30 秒让服务器完全启动（只有后台任务主节点执行）
             time.sleep(30)
-            self.check_and_transfer_abnormal_leases()
+            if background_leader.is_leader():
+                with metrics.track_loop("abnormal_transfer"):
+                    self.check_and_transfer_abnormal_leases()
 
             # 定期检测
             while True:
                 try:
                     time.sleep(interval)
-                    self.check_and_transfer_abnormal_leases()
+                    if background_leader.is_leader():
+                        with metrics.track_loop("abnormal_transfer"):
+                            self.check_and_transfer_abnormal_leases()
                 except Exception as e:
                     log.error(f"异常转移检测循环出错: {e}")
                     time.sleep(60)  # 出错后等待 1 分钟再继续
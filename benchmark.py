@@ -0,0 +1,604 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+兑换接口基准测试（压测）脚本
+
+在合成数据库 + 假上游（可配置延迟/失败率）上并发驱动
+/api/redeem、/api/redeem/batch、/api/verify、/api/user/status，
+按场景统计 p50/p95/p99 延迟、吞吐、错误数和 SQLite 锁等待次数，结果可保存为 JSON，
+用于在不同提交之间对比性能回退。
+
+用法:
+    python benchmark.py                                # 进程内 Flask test client
+    python benchmark.py --gunicorn 4                   # 启动本地 gunicorn（4 个 worker）后走 HTTP
+    python benchmark.py -n 500 -c 32 --json bench.json
+    python benchmark.py --json new.json --compare old.json
+
+锁等待统计：单条 SQL（含 commit）耗时超过 --lock-wait-ms 即计为一次锁等待。
+合成库数据量很小，正常语句远低于该阈值，超时基本都是在等 SQLite 的库级锁。
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+SCENARIOS = ("redeem", "redeem_batch", "verify", "user_status")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (method, path, json_body, headers)
+RequestSpec = Tuple[str, str, Optional[Dict[str, Any]], Dict[str, str]]
+# (status_code, json_payload)；请求异常时 status_code 为 None
+CallResult = Tuple[Optional[int], Any]
+
+
+# ==================== 锁等待统计 ====================
+
+class LockWaitCounters:
+    """锁等待计数器（基于共享 mmap 文件，gunicorn 多 worker 的计数汇总到同一处）"""
+
+    WAITS = 1
+    WAIT_MS = 2
+    ERRORS = 3
+
+    def __init__(self, path: str):
+        from shared_state import SharedCounters
+
+        self._counters = SharedCounters(path, slots=4)
+
+    def wait(self, seconds: float):
+        self._counters.bump(self.WAITS)
+        self._counters.bump(self.WAIT_MS, int(seconds * 1000))
+
+    def error(self):
+        self._counters.bump(self.ERRORS)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "lock_waits": self._counters.get(self.WAITS),
+            "lock_wait_ms": self._counters.get(self.WAIT_MS),
+            "lock_errors": self._counters.get(self.ERRORS),
+        }
+
+
+def install_lock_wait_probe(counters: LockWaitCounters, threshold_ms: float):
+    """替换 Database 的连接类：给每条 SQL 和 commit 计时，超过阈值计为锁等待"""
+    from database import Database
+
+    threshold = max(0.0, threshold_ms) / 1000
+
+    def _timed(fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e).lower():
+                counters.error()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if elapsed >= threshold:
+                counters.wait(elapsed)
+
+    class _ProbeCursor(sqlite3.Cursor):
+        def execute(self, sql, parameters=()):
+            return _timed(sqlite3.Cursor.execute, self, sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            return _timed(sqlite3.Cursor.executemany, self, sql, seq_of_parameters)
+
+    class _ProbeConnection(sqlite3.Connection):
+        def cursor(self, factory=_ProbeCursor):
+            return sqlite3.Connection.cursor(self, factory)
+
+        def execute(self, sql, parameters=()):
+            return self.cursor().execute(sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            return self.cursor().executemany(sql, seq_of_parameters)
+
+        def commit(self):
+            return _timed(sqlite3.Connection.commit, self)
+
+    Database.connection_factory = _ProbeConnection
+
+
+# ==================== 假上游 ====================
+
+def install_fake_upstream(latency_ms: float, error_rate: float):
+    """用本地假实现替换 ChatGPT Team 上游调用（席位查询 / 批量邀请），并关闭加入状态同步"""
+    import redemption_service as rs
+
+    def _sleep():
+        if latency_ms > 0:
+            time.sleep(max(0.0, random.gauss(latency_ms, latency_ms * 0.2)) / 1000)
+
+    def get_team_stats(team_config):
+        _sleep()
+        return {"seats_entitled": 1_000_000, "seats_in_use": 0, "pending_invites": 0}
+
+    def batch_invite_to_team(emails, team_config):
+        _sleep()
+        result = {"success": [], "failed": []}
+        for email in emails:
+            if error_rate > 0 and random.random() < error_rate:
+                result["failed"].append({"email": email, "error": "bench: upstream error"})
+            else:
+                result["success"].append(email)
+        return result
+
+    rs.get_team_stats = get_team_stats
+    rs.batch_invite_to_team = batch_invite_to_team
+    rs.RedemptionService._schedule_join_sync = staticmethod(lambda email: None)
+
+
+def bench_app():
+    """
+    应用入口（进程内模式直接调用；gunicorn 模式为 `benchmark:bench_app()`）
+    在导入 web_server 之前安装锁等待统计和假上游
+    """
+    counters = LockWaitCounters(os.path.join(os.environ["DATA_DIR"], "bench.lockwaits"))
+    install_lock_wait_probe(counters, float(os.getenv("BENCH_LOCK_WAIT_MS", "20")))
+    install_fake_upstream(
+        float(os.getenv("BENCH_UPSTREAM_LATENCY_MS", "50")),
+        float(os.getenv("BENCH_UPSTREAM_ERROR_RATE", "0")),
+    )
+    from web_server import app
+
+    return app
+
+
+# ==================== 合成数据 ====================
+
+def prepare_env(data_dir: str, args: argparse.Namespace):
+    """基准测试环境变量（必须在导入 config/database 之前设置）"""
+    teams = [
+        {
+            "user": {"email": f"bench{i}@example.com"},
+            "account": {"id": f"bench-account-{i}", "organizationId": "bench-org"},
+            "accessToken": "bench-token",
+        }
+        for i in range(args.teams)
+    ]
+    os.environ.update(
+        DATA_DIR=data_dir,
+        TEAM_JSON=json.dumps(teams),
+        TRUST_PROXY="true",
+        AUTO_TRANSFER_ENABLED="false",
+        MONITOR_ENABLED="false",
+        TEAM_STATUS_CHECK_ENABLED="false",
+        ABNORMAL_TRANSFER_CHECK_ENABLED="false",
+        LOG_LEVEL=args.log_level,
+        BENCH_UPSTREAM_LATENCY_MS=str(args.upstream_latency_ms),
+        BENCH_UPSTREAM_ERROR_RATE=str(args.upstream_error_rate),
+        BENCH_LOCK_WAIT_MS=str(args.lock_wait_ms),
+    )
+    os.environ.setdefault("SECRET_KEY", "team-dh-benchmark")
+
+
+def seed(args: argparse.Namespace) -> Dict[str, Any]:
+    """生成合成数据：各场景所需的兑换码、已兑换邮箱和租约"""
+    import config
+    import code_format
+    from database import db
+
+    team_names = [t["name"] for t in config.TEAMS]
+    if not team_names:
+        raise SystemExit("合成 Team 配置加载失败")
+
+    generated: set = set()
+
+    def new_codes(count: int) -> List[str]:
+        codes = []
+        while len(codes) < count:
+            code = code_format.generate_code("BENCH")
+            if code not in generated:
+                generated.add(code)
+                codes.append(code)
+        return codes
+
+    n = args.requests
+    fixtures = {
+        "redeem": new_codes(n if "redeem" in args.scenarios else 0),
+        "redeem_batch": new_codes(n * args.batch_size if "redeem_batch" in args.scenarios else 0),
+        # 可多次使用的码只用于验证，保持 active
+        "verify": new_codes(min(n, 200)),
+        "status_emails": [f"status-{i}@example.com" for i in range(min(n, 500))],
+    }
+
+    rows = []
+    for i, code in enumerate(fixtures["redeem"] + fixtures["redeem_batch"]):
+        rows.append((code, team_names[i % len(team_names)], 1))
+    for i, code in enumerate(fixtures["verify"]):
+        rows.append((code, team_names[i % len(team_names)], 1_000_000))
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO redemption_codes (code, team_name, max_uses) VALUES (?, ?, ?)",
+            rows,
+        )
+
+    # 已兑换用户：每个邮箱一条兑换记录，一半带租约
+    owner = db.get_code(fixtures["verify"][0])
+    db.create_redemptions(
+        [
+            {"code_id": owner["id"], "email": email, "team_name": owner["team_name"], "ip_address": "127.0.0.1"}
+            for email in fixtures["status_emails"]
+        ],
+        status="success",
+    )
+    now = datetime.now()
+    for email in fixtures["status_emails"][::2]:
+        db.upsert_member_lease(
+            email=email,
+            team_name=owner["team_name"],
+            team_account_id=None,
+            created_at=now,
+            invited_at=now,
+            expires_at=now + timedelta(days=30),
+            status="awaiting_join",
+        )
+    return fixtures
+
+
+# ==================== 场景 ====================
+
+_ip_counter = itertools.count(1)
+
+
+def _client_headers() -> Dict[str, str]:
+    """每个请求使用不同的客户端 IP，避免触发按 IP 限流"""
+    i = next(_ip_counter)
+    return {"X-Forwarded-For": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"}
+
+
+def build_scenarios(fixtures: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Callable[[int], RequestSpec]]:
+    batch_size = args.batch_size
+    verify_codes = fixtures["verify"]
+    status_emails = fixtures["status_emails"]
+
+    def redeem(i: int) -> RequestSpec:
+        body = {"email": f"redeem-{i}@example.com", "code": fixtures["redeem"][i]}
+        return "POST", "/api/redeem", body, _client_headers()
+
+    def redeem_batch(i: int) -> RequestSpec:
+        codes = fixtures["redeem_batch"][i * batch_size : (i + 1) * batch_size]
+        items = [{"email": f"batch-{i}-{j}@example.com", "code": code} for j, code in enumerate(codes)]
+        return "POST", "/api/redeem/batch", {"items": items}, _client_headers()
+
+    def verify(i: int) -> RequestSpec:
+        # 约 10% 的请求为不存在的兑换码
+        code = verify_codes[i % len(verify_codes)] if i % 10 else f"BENCH-NONE-{i:04d}"
+        return "GET", f"/api/verify?code={code}", None, _client_headers()
+
+    def user_status(i: int) -> RequestSpec:
+        email = status_emails[i % len(status_emails)] if i % 10 else f"nobody-{i}@example.com"
+        return "POST", "/api/user/status", {"email": email}, _client_headers()
+
+    scenarios = {
+        "redeem": redeem,
+        "redeem_batch": redeem_batch,
+        "verify": verify,
+        "user_status": user_status,
+    }
+    return {name: scenarios[name] for name in args.scenarios}
+
+
+# ==================== 客户端 ====================
+
+def test_client_caller(app) -> Callable[..., CallResult]:
+    """进程内调用（每个线程一个 Flask test client）"""
+    local = threading.local()
+
+    def call(method: str, path: str, body: Optional[Dict[str, Any]], headers: Dict[str, str]) -> CallResult:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+    return call
+
+
+def http_caller(base_url: str) -> Callable[..., CallResult]:
+    """HTTP 调用（每个线程一个 requests.Session）"""
+    import requests
+
+    local = threading.local()
+
+    def call(method: str, path: str, body: Optional[Dict[str, Any]], headers: Dict[str, str]) -> CallResult:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        response = session.request(method, base_url + path, json=body, headers=headers, timeout=120)
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return response.status_code, payload
+
+    return call
+
+
+def start_gunicorn(workers: int, log_level: str, worker_class: str = "sync") -> Tuple[subprocess.Popen, str]:
+    """启动本地 gunicorn，等待 /health 可用"""
+    import requests
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    cmd = [
+        sys.executable, "-m", "gunicorn",
+        "-w", str(workers),
+        "-b", f"127.0.0.1:{port}",
+        "-k", worker_class,
+        "--timeout", "120",
+        "--log-level", log_level.lower(),
+        "benchmark:bench_app()",
+    ]
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR, env=os.environ.copy())
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"gunicorn 启动失败（退出码 {proc.returncode}）")
+        try:
+            if requests.get(base_url + "/health", timeout=2).status_code == 200:
+                return proc, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    proc.terminate()
+    raise SystemExit("等待 gunicorn 启动超时")
+
+
+# ==================== 执行与统计 ====================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_scenario(
+    name: str,
+    build: Callable[[int], RequestSpec],
+    call: Callable[..., CallResult],
+    *,
+    requests_count: int,
+    concurrency: int,
+    counters: LockWaitCounters,
+) -> Dict[str, Any]:
+    latencies: List[float] = [0.0] * requests_count
+    statuses: Counter = Counter()
+    errors = 0
+    item_failures = 0
+    samples: List[str] = []
+    lock = threading.Lock()
+
+    def one(i: int):
+        nonlocal errors, item_failures
+        method, path, body, headers = build(i)
+        start = time.perf_counter()
+        try:
+            status, payload = call(method, path, body, headers)
+        except Exception as e:
+            status, payload = None, {"error": str(e)}
+        latencies[i] = (time.perf_counter() - start) * 1000
+
+        with lock:
+            statuses[str(status)] += 1
+            failed = status is None or status >= 400
+            if isinstance(payload, dict) and name == "redeem_batch":
+                item_failures += int(payload.get("fail_count") or 0)
+            if failed:
+                errors += 1
+                if len(samples) < 5:
+                    message = payload.get("error") if isinstance(payload, dict) else payload
+                    samples.append(f"{status}: {message}")
+
+    before = counters.snapshot()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests_count)))
+    duration = time.perf_counter() - started
+    after = counters.snapshot()
+
+    ordered = sorted(latencies)
+    result = {
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(requests_count / duration, 2) if duration > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 50), 2),
+            "p95": round(percentile(ordered, 95), 2),
+            "p99": round(percentile(ordered, 99), 2),
+            "max": round(ordered[-1], 2) if ordered else 0.0,
+            "mean": round(sum(ordered) / len(ordered), 2) if ordered else 0.0,
+        },
+        "errors": errors,
+        "status_counts": dict(statuses),
+        "error_samples": samples,
+    }
+    if name == "redeem_batch":
+        result["item_failures"] = item_failures
+    result.update({key: after[key] - before[key] for key in after})
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_report(results: Dict[str, Dict[str, Any]]):
+    header = f"{'scenario':<14}{'req':>6}{'conc':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err':>6}{'locks':>7}{'lock_ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        lat = r["latency_ms"]
+        print(
+            f"{name:<14}{r['requests']:>6}{r['concurrency']:>6}{r['throughput_rps']:>9.1f}"
+            f"{lat['p50']:>9.1f}{lat['p95']:>9.1f}{lat['p99']:>9.1f}{lat['max']:>9.1f}"
+            f"{r['errors']:>6}{r['lock_waits']:>7}{r['lock_wait_ms']:>9}"
+        )
+        for sample in r["error_samples"]:
+            print(f"    ! {sample}")
+    print("(延迟单位 ms；locks = 锁等待次数)")
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline_path: str, threshold_pct: float) -> bool:
+    """与历史结果对比，返回是否存在回退（p95/p99 变慢或吞吐下降超过阈值）"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n对比基线: {baseline_path} (commit {baseline.get('meta', {}).get('git_commit')})")
+
+    def delta(new: float, old: float) -> float:
+        return (new - old) / old * 100 if old else 0.0
+
+    regressed = False
+    for name, r in results.items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        changes = {
+            "p50": delta(r["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            "p95": delta(r["latency_ms"]["p95"], old["latency_ms"]["p95"]),
+            "p99": delta(r["latency_ms"]["p99"], old["latency_ms"]["p99"]),
+            "rps": delta(r["throughput_rps"], old["throughput_rps"]),
+        }
+        bad = changes["p95"] > threshold_pct or changes["p99"] > threshold_pct or changes["rps"] < -threshold_pct
+        regressed = regressed or bad
+        text = "  ".join(f"{k} {v:+.1f}%" for k, v in changes.items())
+        print(f"  {name:<14}{text}{'  <-- 回退' if bad else ''}")
+    return regressed
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="兑换接口基准测试")
+    parser.add_argument("-s", "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="要运行的场景")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="每个场景的请求数（默认 200）")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="并发客户端数（默认 16）")
+    parser.add_argument("--batch-size", type=int, default=5, help="批量兑换每个请求的条数（1-20，默认 5）")
+    parser.add_argument("--teams", type=int, default=4, help="合成 Team 数量（默认 4）")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50, help="假上游平均延迟（默认 50ms）")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="假上游邀请失败率（0-1）")
+    parser.add_argument("--lock-wait-ms", type=float, default=20, help="单条 SQL 超过该耗时计为锁等待（默认 20ms）")
+    parser.add_argument("--gunicorn", type=int, default=0, metavar="WORKERS", help="启动本地 gunicorn 的 worker 数（默认进程内运行）")
+    parser.add_argument("--worker-class", default="sync", choices=["sync", "gthread", "gevent"], help="gunicorn worker 类型（默认 sync）")
+    parser.add_argument("--data-dir", help="合成数据目录（默认临时目录，结束后删除）")
+    parser.add_argument("--json", dest="json_path", help="结果保存为 JSON")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    parser.add_argument("--regress-threshold", type=float, default=20, help="判定回退的变化百分比（默认 20）")
+    parser.add_argument("--log-level", default="WARNING", help="应用日志级别（默认 WARNING）")
+    args = parser.parse_args(argv)
+    if not 1 <= args.batch_size <= 20:
+        parser.error("--batch-size 取值范围 1-20")
+    args.requests = max(1, args.requests)
+    args.concurrency = max(1, args.concurrency)
+    args.teams = max(1, args.teams)
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    started_at = datetime.now().isoformat(timespec="seconds")
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="team-dh-bench-")
+    os.makedirs(data_dir, exist_ok=True)
+    prepare_env(data_dir, args)
+    sys.path.insert(0, BASE_DIR)
+
+    proc = None
+    try:
+        fixtures = seed(args)
+        counters = LockWaitCounters(os.path.join(data_dir, "bench.lockwaits"))
+        if args.gunicorn:
+            proc, base_url = start_gunicorn(args.gunicorn, args.log_level, args.worker_class)
+            call = http_caller(base_url)
+            mode = f"gunicorn {args.worker_class} x{args.gunicorn}"
+        else:
+            call = test_client_caller(bench_app())
+            mode = "test_client"
+
+        print(f"模式: {mode}，数据目录: {data_dir}")
+        results: Dict[str, Dict[str, Any]] = {}
+        for name, build in build_scenarios(fixtures, args).items():
+            print(f"运行场景 {name} ...", flush=True)
+            results[name] = run_scenario(
+                name,
+                build,
+                call,
+                requests_count=args.requests,
+                concurrency=args.concurrency,
+                counters=counters,
+            )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print()
+    print_report(results)
+
+    if args.json_path:
+        report = {
+            "meta": {
+                "started_at": started_at,
+                "git_commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "mode": mode,
+                "params": {
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "batch_size": args.batch_size,
+                    "teams": args.teams,
+                    "upstream_latency_ms": args.upstream_latency_ms,
+                    "upstream_error_rate": args.upstream_error_rate,
+                    "lock_wait_ms": args.lock_wait_ms,
+                },
+            },
+            "scenarios": results,
+        }
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.json_path}")
+
+    if args.compare and compare(results, args.compare, args.regress_threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
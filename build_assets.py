@@ -0,0 +1,288 @@
+"""
+静态页面构建工具
+把 static/ 下页面的内联 <style>/<script> 拆分为带内容指纹的独立资源，做保守压缩（去注释/缩进），
+并为每个文件生成 gzip / brotli 预压缩版本，输出到 static/dist/ 并写入 manifest.json:
+
+    python build_assets.py
+
+Web 服务检测到 manifest 后直接返回构建产物：资源文件长期缓存，页面 HTML 通过 ETag 协商缓存。
+未构建时回退到 static/ 源文件，行为与之前一致。brotli 为可选依赖（pip install brotli），未安装时只生成 gzip。
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import shutil
+import sys
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只生成 gzip
+    brotli = None
+
+
+BASE_DIR = Path(__file__).parent
+SOURCE_DIR = BASE_DIR / "static"
+DIST_DIR = SOURCE_DIR / "dist"
+ASSET_URL_PREFIX = "/assets/"
+
+# 参与构建的页面（debug 页面保持原样）
+PAGES = ("index", "batch", "user", "admin")
+
+# 小于该大小的文件不生成压缩版本
+MIN_COMPRESS_SIZE = 512
+
+_STYLE_RE = re.compile(r"<style>(.*?)</style>", re.S | re.I)
+_SCRIPT_RE = re.compile(r"<script>(.*?)</script>", re.S | re.I)
+_PRESERVE_RE = re.compile(r"(<textarea\b.*?</textarea>|<pre\b.*?</pre>)", re.S | re.I)
+
+
+def minify_css(css: str) -> str:
+    """保守压缩 CSS：去注释、合并空白"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};])\s*", r"\1", css)
+    return css.strip()
+
+
+def _strip_js_lines(js: str) -> list[tuple[str, bool]]:
+    """
+    逐字符扫描 JS，返回 [(行内容, 行首是否处于代码上下文)]。
+    只有行首处于代码上下文（不在模板字符串/多行注释中）时才能安全去掉缩进。
+    """
+    lines: list[tuple[str, bool]] = []
+    state = "code"  # code / sq / dq / tpl / line_comment / block_comment / regex
+    tpl_depth: list[int] = []  # 模板字符串 ${ } 嵌套时的花括号计数
+    prev_significant = ""
+    line_start_safe = True
+    buf: list[str] = []
+    i = 0
+    n = len(js)
+    while i < n:
+        ch = js[i]
+        nxt = js[i + 1] if i + 1 < n else ""
+        if ch == "\n":
+            lines.append(("".join(buf), line_start_safe))
+            buf = []
+            if state == "line_comment":
+                state = "code"
+            line_start_safe = state == "code"
+            i += 1
+            continue
+        buf.append(ch)
+        if state == "code":
+            if ch == "/" and nxt == "/":
+                state = "line_comment"
+            elif ch == "/" and nxt == "*":
+                state = "block_comment"
+                buf.append(nxt)
+                i += 1
+            elif ch == "/" and (prev_significant == "" or prev_significant in "(,=:[!&|?{};+-*%<>~^"):
+                state = "regex"
+            elif ch == "'":
+                state = "sq"
+            elif ch == '"':
+                state = "dq"
+            elif ch == "`":
+                state = "tpl"
+            elif ch == "{" and tpl_depth:
+                tpl_depth[-1] += 1
+            elif ch == "}" and tpl_depth:
+                if tpl_depth[-1] == 0:
+                    tpl_depth.pop()
+                    state = "tpl"
+                else:
+                    tpl_depth[-1] -= 1
+            if not ch.isspace() and state == "code":
+                prev_significant = ch
+        elif state in ("sq", "dq", "regex"):
+            if ch == "\\":
+                if nxt and nxt != "\n":
+                    buf.append(nxt)
+                    i += 1
+            elif (state == "sq" and ch == "'") or (state == "dq" and ch == '"'):
+                state = "code"
+                prev_significant = ch
+            elif state == "regex" and ch == "[":
+                # 字符类中的 / 不结束正则
+                j = i + 1
+                while j < n and js[j] not in "]\n":
+                    if js[j] == "\\":
+                        j += 1
+                    j += 1
+                buf.append(js[i + 1:j + 1])
+                i = j
+            elif state == "regex" and ch == "/":
+                state = "code"
+                prev_significant = "a"  # 正则字面量之后按标识符处理
+        elif state == "tpl":
+            if ch == "\\":
+                if nxt:
+                    buf.append(nxt)
+                    i += 1
+                    if nxt == "\n":
+                        lines.append(("".join(buf[:-1]), line_start_safe))
+                        buf = []
+                        line_start_safe = False
+            elif ch == "`":
+                state = "code"
+                prev_significant = "`"
+            elif ch == "$" and nxt == "{":
+                buf.append(nxt)
+                i += 1
+                tpl_depth.append(0)
+                state = "code"
+                prev_significant = "{"
+        elif state == "block_comment":
+            if ch == "*" and nxt == "/":
+                buf.append(nxt)
+                i += 1
+                state = "code"
+        i += 1
+    lines.append(("".join(buf), line_start_safe))
+    return lines
+
+
+def minify_js(js: str) -> str:
+    """保守压缩 JS：只去掉代码行的缩进和空行，不改写任何语句（模板字符串内容保持原样）"""
+    out: list[str] = []
+    for line, safe in _strip_js_lines(js):
+        if safe:
+            line = line.strip()
+            if not line:
+                continue
+        else:
+            line = line.rstrip()
+        out.append(line)
+    return "\n".join(out).strip() + "\n"
+
+
+def minify_html(html: str) -> str:
+    """保守压缩 HTML：去注释，标签之间的换行+缩进折叠为单个换行（textarea/pre 保持原样）"""
+    parts = _PRESERVE_RE.split(html)
+    for idx in range(0, len(parts), 2):
+        part = re.sub(r"<!--(?!\[if).*?-->", "", parts[idx], flags=re.S)
+        part = re.sub(r">\s*\n\s*<", ">\n<", part)
+        parts[idx] = part
+    return "".join(parts).strip() + "\n"
+
+
+def _fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _write_with_variants(path: Path, data: bytes) -> dict:
+    """写入文件及其 .gz / .br 预压缩版本，返回 manifest 条目"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    entry = {"size": len(data), "etag": _fingerprint(data), "encodings": {}}
+    if len(data) >= MIN_COMPRESS_SIZE:
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz) < len(data):
+            path.with_name(path.name + ".gz").write_bytes(gz)
+            entry["encodings"]["gzip"] = {"file": path.name + ".gz", "size": len(gz)}
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            if len(br) < len(data):
+                path.with_name(path.name + ".br").write_bytes(br)
+                entry["encodings"]["br"] = {"file": path.name + ".br", "size": len(br)}
+    return entry
+
+
+def build_page(name: str, assets: dict, files: dict) -> dict:
+    source = SOURCE_DIR / f"{name}.html"
+    raw = source.read_bytes()
+    html = raw.decode("utf-8")
+
+    # 内联 CSS / JS 各合并为一个文件（按出现顺序），原位置替换为外链
+    styles = _STYLE_RE.findall(html)
+    scripts = _SCRIPT_RE.findall(html)
+    refs: list[str] = []
+
+    if styles:
+        css = minify_css("\n".join(styles)).encode("utf-8")
+        css_name = f"{name}.{_fingerprint(css)}.css"
+        files[f"assets/{css_name}"] = _write_with_variants(DIST_DIR / "assets" / css_name, css)
+        refs.append(css_name)
+        first = [True]
+
+        def _style_sub(_m):
+            if first[0]:
+                first[0] = False
+                return f'<link rel="stylesheet" href="{ASSET_URL_PREFIX}{css_name}">'
+            return ""
+
+        html = _STYLE_RE.sub(_style_sub, html)
+
+    if scripts:
+        js = minify_js(";\n".join(scripts)).encode("utf-8")
+        js_name = f"{name}.{_fingerprint(js)}.js"
+        files[f"assets/{js_name}"] = _write_with_variants(DIST_DIR / "assets" / js_name, js)
+        refs.append(js_name)
+        first_js = [True]
+
+        def _script_sub(_m):
+            # 保持原位置同步执行（页面里的 onclick 依赖这些全局函数）
+            if first_js[0]:
+                first_js[0] = False
+                return f'<script src="{ASSET_URL_PREFIX}{js_name}"></script>'
+            return ""
+
+        html = _SCRIPT_RE.sub(_script_sub, html)
+
+    page_data = minify_html(html).encode("utf-8")
+    files[f"{name}.html"] = _write_with_variants(DIST_DIR / f"{name}.html", page_data)
+    for ref in refs:
+        assets[ref] = name
+    return {
+        "html": f"{name}.html",
+        "source_sha256": hashlib.sha256(raw).hexdigest(),
+        "source_size": len(raw),
+        "assets": refs,
+    }
+
+
+def build(verbose: bool = True) -> dict:
+    """重新生成 static/dist 并返回 manifest"""
+    if DIST_DIR.exists():
+        shutil.rmtree(DIST_DIR)
+    DIST_DIR.mkdir(parents=True)
+
+    pages: dict[str, dict] = {}
+    assets: dict[str, str] = {}  # 资源文件名 -> 所属页面
+    files: dict[str, dict] = {}
+    for name in PAGES:
+        pages[name] = build_page(name, assets, files)
+
+    manifest = {"version": 1, "pages": pages, "assets": assets, "files": files}
+    (DIST_DIR / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if verbose:
+        for name, page in pages.items():
+            total = sum(files[p]["size"] for p in [page["html"]] + [f"assets/{a}" for a in page["assets"]])
+            compressed = sum(
+                (files[p]["encodings"].get("br") or files[p]["encodings"].get("gzip") or files[p])["size"]
+                for p in [page["html"]] + [f"assets/{a}" for a in page["assets"]]
+            )
+            print(f"{name:<8} 源文件 {page['source_size']:>8} B -> 构建 {total:>8} B -> 压缩 {compressed:>8} B")
+        if brotli is None:
+            print("⚠️ 未安装 brotli，只生成了 gzip 版本（pip install brotli）")
+        print(f"✅ 已输出到 {DIST_DIR}")
+    return manifest
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="构建带指纹和预压缩的静态页面")
+    parser.add_argument("--quiet", "-q", action="store_true", help="不输出构建统计")
+    args = parser.parse_args(argv)
+    build(verbose=not args.quiet)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+进程内缓存模块
+带容量上限（LRU 淘汰）和过期时间的线程安全缓存
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Tuple
+
+
+class TTLCache:
+    """LRU + TTL 缓存，每条记录附带版本号，版本不一致视为未命中"""
+
+    def __init__(self, *, maxsize: int = 2048, ttl: float = 30.0):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, *, version: Any = None) -> Tuple[bool, Any]:
+        """读取缓存，返回 (是否命中, 值)；过期或版本不一致视为未命中"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, item_version, value = item
+                if expires > now and item_version == version:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+            self.misses += 1
+        return False, None
+
+    def set(self, key: Hashable, value: Any, *, version: Any = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
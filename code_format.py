@@ -0,0 +1,135 @@
+"""
+兑换码格式模块
+带校验段的兑换码格式，用于在访问数据库之前拒绝格式错误或伪造的兑换码
+
+格式 (v1): PREFIX-XXXX-XXXX-XXXX-1CCCC
+  - XXXX: 随机段，字符集为大写字母+数字（排除易混淆的 0, O, I, 1）
+  - 1: 版本标记（字符集中不含 1，因此不会与旧格式混淆）
+  - CCCC: 以 CODE_SIGNING_SECRET 计算的 HMAC-SHA256 截断校验值
+
+签名密钥只使用专用的 CODE_SIGNING_SECRET（不复用 session 密钥，轮换 SECRET_KEY 不影响兑换码），
+且一旦生成过新格式兑换码就不能再更换，否则已发放的兑换码会在本地校验阶段全部被拒绝。
+
+旧格式 PREFIX-XXXX-XXXX-XXXX 通过 ACCEPT_LEGACY_CODES 继续兼容（默认开启），
+只接受旧生成器实际产生的形状（前缀 + 4 位一组的随机段，最后一段可能不足 4 位）。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import string
+
+from config import env_bool
+from logger import log
+
+
+# 随机段字符集（32 个字符，每个字符 5 bit）
+CODE_ALPHABET = string.ascii_uppercase.replace("O", "").replace("I", "") + "23456789"
+
+# 当前签名格式版本标记
+SIGNED_VERSION = "1"
+
+# 校验段长度（字符数），4 个字符 = 20 bit
+CHECK_LENGTH = 4
+
+_SIGNED_PATTERN = re.compile(
+    rf"^(?P<prefix>[A-Z0-9]{{1,16}})-(?P<body>[{CODE_ALPHABET}]{{4}}(?:-[{CODE_ALPHABET}]{{4}})+)"
+    rf"-{SIGNED_VERSION}(?P<check>[{CODE_ALPHABET}]{{{CHECK_LENGTH}}})$"
+)
+_PREFIX_PATTERN = re.compile(r"^[A-Z0-9]{1,16}$")
+_LEGACY_PATTERN = re.compile(rf"^[A-Z0-9]{{1,16}}(?:-[{CODE_ALPHABET}]{{4}})*-[{CODE_ALPHABET}]{{1,4}}$")
+
+
+def _signing_secret() -> str:
+    """兑换码签名密钥（只读取 CODE_SIGNING_SECRET，未设置时不签名）"""
+    return (os.getenv("CODE_SIGNING_SECRET") or "").strip()
+
+
+def signing_enabled() -> bool:
+    """是否配置了签名密钥（未配置时只能生成旧格式兑换码）"""
+    return bool(_signing_secret())
+
+
+def _check_segment(prefix: str, body: str, secret: str) -> str:
+    """计算校验段"""
+    message = f"{SIGNED_VERSION}:{prefix}:{body.replace('-', '')}".encode("utf-8")
+    digest = hmac.new(secret.encode("utf-8"), message, hashlib.sha256).digest()
+    value = int.from_bytes(digest[:4], "big") >> (32 - 5 * CHECK_LENGTH)
+    chars = []
+    for _ in range(CHECK_LENGTH):
+        chars.append(CODE_ALPHABET[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def generate_code(prefix: str = "TEAM", length: int = 12, *, signed: bool | None = None) -> str:
+    """
+    生成随机兑换码
+
+    Args:
+        prefix: 兑换码前缀
+        length: 随机部分长度（按 4 个字符一段分组）
+        signed: 是否生成带校验段的新格式；None 表示有签名密钥且长度可分组时生成新格式
+
+    Raises:
+        ValueError: 前缀不合法，或 signed=True 但无法生成新格式（未配置密钥 / 长度不是 4 的倍数）
+    """
+    if not _PREFIX_PATTERN.match(prefix or ""):
+        raise ValueError(f"兑换码前缀只能包含大写字母和数字（1-16 位）: {prefix!r}")
+    if length < 1:
+        raise ValueError(f"兑换码随机部分长度必须大于 0: {length}")
+
+    random_str = "".join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+    parts = [prefix]
+    for i in range(0, length, 4):
+        parts.append(random_str[i : i + 4])
+    code = "-".join(parts)
+
+    secret = _signing_secret()
+    signable = length >= 8 and length % 4 == 0
+    if signed is None:
+        if secret and not signable:
+            log.warning(f"兑换码长度 {length} 不是 4 的倍数（至少 8），生成不带校验段的旧格式", dedupe_key="code_format_unsigned")
+        signed = bool(secret) and signable
+    if not signed:
+        return code
+    if not secret:
+        raise ValueError("未配置 CODE_SIGNING_SECRET，无法生成带校验段的兑换码")
+    if not signable:
+        raise ValueError(f"带校验段的兑换码随机部分长度必须是 4 的倍数且至少为 8: {length}")
+
+    body = "-".join(parts[1:])
+    return f"{code}-{SIGNED_VERSION}{_check_segment(prefix, body, secret)}"
+
+
+def precheck_code(code: str) -> tuple[bool, str]:
+    """
+    纯本地校验兑换码格式（不访问数据库）
+
+    Returns:
+        (是否可能有效, 错误信息)
+    """
+    code = (code or "").strip().upper()
+    if not code or len(code) > 64:
+        return False, "兑换码格式无效"
+
+    match = _SIGNED_PATTERN.match(code)
+    if match:
+        secret = _signing_secret()
+        if not secret:
+            # 没有密钥无法验签，交给数据库判断
+            return True, "OK"
+        expected = _check_segment(match.group("prefix"), match.group("body"), secret)
+        if not hmac.compare_digest(expected, match.group("check")):
+            return False, "兑换码无效"
+        return True, "OK"
+
+    if not env_bool("ACCEPT_LEGACY_CODES", True):
+        return False, "兑换码格式无效"
+    if not _LEGACY_PATTERN.match(code):
+        return False, "兑换码格式无效"
+    return True, "OK"
@@ -5,10 +5,9 @@
 
 import argparse
 import csv
-import secrets
-import string
 from datetime import datetime, timedelta
 from typing import List, Optional
+import code_format
 from database import db
 from logger import log
 
@@ -17,23 +16,13 @@ class CodeGenerator:
     """兑换码生成器"""
 
     @staticmethod
-    def generate_code(prefix: str = "TEAM", length: int = 12) -> str:
+    def generate_code(prefix: str = "TEAM", length: int = 12, signed: Optional[bool] = None) -> str:
         """
         生成随机兑换码
-        格式: PREFIX-XXXX-XXXX-XXXX
+        格式: PREFIX-XXXX-XXXX-XXXX-1CCCC（配置了签名密钥时带校验段，见 code_format）
+        旧格式: PREFIX-XXXX-XXXX-XXXX
         """
-        # 使用大写字母和数字 (排除易混淆的字符: 0, O, I, 1)
-        chars = string.ascii_uppercase.replace("O", "").replace("I", "") + "23456789"
-
-        # 生成随机字符串
-        random_str = "".join(secrets.choice(chars) for _ in range(length))
-
-        # 分段格式化
-        parts = [prefix]
-        for i in range(0, length, 4):
-            parts.append(random_str[i : i + 4])
-
-        return "-".join(parts)
+        return code_format.generate_code(prefix=prefix, length=length, signed=signed)
 
     @staticmethod
     def generate_codes(
@@ -138,8 +127,10 @@ class CodeGenerator:
             writer = csv.writer(f)
             writer.writerow(["兑换码", "Team", "最大使用次数", "过期时间", "创建时间", "状态"])
 
+            # 一次批量查询，避免逐个兑换码查库
+            code_infos = db.get_codes_by_list(codes)
             for code in codes:
-                code_info = db.get_code(code)
+                code_info = code_infos.get(code)
                 if code_info:
                     writer.writerow(
                         [
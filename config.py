@@ -189,21 +189,27 @@ def _load_teams() -> list:
 _cfg = _load_toml()
 _raw_teams = _load_teams()
 
-# 转换 team.json 格式为 team_service.py 期望的格式
-TEAMS = []
-_team_names = (_cfg.get("files", {}) or {}).get("team_names", []) or []
-for i, t in enumerate(_raw_teams):
-    default_name = t.get("user", {}).get("email", f"Team{i+1}").split("@")[0]
-    name = _team_names[i] if i < len(_team_names) and _team_names[i] else default_name
-    TEAMS.append(
-        {
-            "name": name,
-            "account_id": t.get("account", {}).get("id", ""),
-            "org_id": t.get("account", {}).get("organizationId", ""),
-            "auth_token": t.get("accessToken", ""),
-            "raw": t,  # 保留原始数据
-        }
-    )
+def _build_teams(raw_teams: list, cfg: dict) -> tuple:
+    """转换 team.json 格式为 team_service.py 期望的格式（优先使用 team_names 配置，否则使用邮箱前缀）"""
+    team_names = (cfg.get("files", {}) or {}).get("team_names", []) or []
+    teams = []
+    for i, t in enumerate(raw_teams):
+        default_name = t.get("user", {}).get("email", f"Team{i+1}").split("@")[0]
+        name = team_names[i] if i < len(team_names) and team_names[i] else default_name
+        teams.append(
+            {
+                "name": name,
+                "account_id": t.get("account", {}).get("id", ""),
+                "org_id": t.get("account", {}).get("organizationId", ""),
+                "auth_token": t.get("accessToken", ""),
+                "raw": t,  # 保留原始数据
+            }
+        )
+    return tuple(teams)
+
+
+# Team 快照：只读元组，reload_teams 整体替换（不要原地修改）
+TEAMS = _build_teams(_raw_teams, _cfg)
 
 # 邮箱
 _email = _cfg.get("email", {})
@@ -390,29 +396,18 @@ def resolve_team(team_name: str) -> dict:
 
 
 def reload_teams():
-    """重新加载 team.json 和 team_names 配置"""
-    global TEAMS, _raw_teams, _cfg
-
-    # 重新加载 team.json
-    _raw_teams = _load_teams()
-
-    # 重新加载 config.toml
-    _cfg = _load_toml()
-
-    # 重新构建 TEAMS
-    TEAMS.clear()
-    team_names = _cfg.get("files", {}).get("team_names", [])
+    """
+    重新加载 team.json 和 config.toml（team_names 等）
 
-    for i, t in enumerate(_raw_teams):
-        # 优先使用 team_names 配置,否则使用邮箱前缀
-        team_name = team_names[i] if i < len(team_names) else t.get("user", {}).get("email", f"Team{i+1}").split("@")[0]
+    先完整构建新的 Team 快照，再一次性替换模块变量；
+    正在遍历旧快照的请求不受影响，也不会读到半空的列表。
+    通常由 config_watcher 在后台线程中调用，不要在请求路径上调用。
+    """
+    global TEAMS, _raw_teams, _cfg
 
-        TEAMS.append({
-            "name": team_name,
-            "account_id": t.get("account", {}).get("id", ""),
-            "org_id": t.get("account", {}).get("organizationId", ""),
-            "auth_token": t.get("accessToken", ""),
-            "raw": t  # 保留原始数据
-        })
+    raw_teams = _load_teams()
+    cfg = _load_toml()
+    teams = _build_teams(raw_teams, cfg)
 
-    return len(TEAMS)
+    _raw_teams, _cfg, TEAMS = raw_teams, cfg, teams
+    return len(teams)
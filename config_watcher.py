@@ -0,0 +1,111 @@
+"""
+配置热加载模块
+每个进程一个后台线程，检测到配置变化后在请求路径之外重新加载 Team 配置：
+  - 文件变化：定期 stat config.toml / team.json（手动修改文件的情况）
+  - 版本号变化：管理后台保存 Team 时递增 SQLite 中的 "config" 版本号，通知其他 worker 重新加载
+请求处理过程中不再做任何配置文件 I/O，只读取 config.TEAMS 当前快照。
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+
+import config
+from database import db
+from logger import log
+
+
+CONFIG_GENERATION = "config"
+
+
+def _config_files_signature() -> tuple[float, float, int, int]:
+    cfg_path = config.CONFIG_FILE if config.CONFIG_FILE.exists() else config.FALLBACK_CONFIG_FILE
+    team_path = config.TEAM_JSON_FILE if config.TEAM_JSON_FILE.exists() else config.FALLBACK_TEAM_JSON_FILE
+    try:
+        cfg_stat = cfg_path.stat()
+        cfg_mtime = cfg_stat.st_mtime
+        cfg_size = cfg_stat.st_size
+    except Exception:
+        cfg_mtime = 0.0
+        cfg_size = 0
+    try:
+        team_stat = team_path.stat()
+        team_mtime = team_stat.st_mtime
+        team_size = team_stat.st_size
+    except Exception:
+        team_mtime = 0.0
+        team_size = 0
+    return (cfg_mtime, team_mtime, cfg_size, team_size)
+
+
+class ConfigWatcher:
+    """配置变化检测（每个进程一个实例）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature: tuple[float, float, int, int] | None = None
+        self._generation: int | None = None
+        self._worker_started = False
+
+    def _reload(self, signature: tuple[float, float, int, int], generation: int, reason: str):
+        count = config.reload_teams()
+        self._signature = signature
+        self._generation = generation
+        log.info(f"配置已重新加载（{reason}），当前有 {count} 个Team", icon="success")
+
+    def check(self) -> bool:
+        """检查一次配置是否变化，变化则重新加载；返回是否重新加载"""
+        signature = _config_files_signature()
+        generation = db.get_generation(CONFIG_GENERATION)
+        with self._lock:
+            if self._signature is None:
+                # 首次检查：配置在导入 config 时已加载，只记录基线
+                self._signature = signature
+                self._generation = generation
+                return False
+            if generation != self._generation:
+                self._reload(signature, generation, f"版本号 {generation}")
+                return True
+            if signature != self._signature:
+                self._reload(signature, generation, "配置文件变化")
+                return True
+        return False
+
+    def publish(self):
+        """本进程修改了配置文件：立即重新加载，并递增版本号通知其他 worker"""
+        generation = db.bump_generation(CONFIG_GENERATION)
+        with self._lock:
+            self._reload(_config_files_signature(), generation, f"版本号 {generation}")
+
+    def start_worker(self, *, interval: float = 5):
+        """启动后台检测线程"""
+        with self._lock:
+            if self._worker_started:
+                return
+            self._worker_started = True
+
+        def _loop():
+            while True:
+                try:
+                    self.check()
+                except Exception as e:
+                    log.warning(f"检查配置变化失败: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=_loop, daemon=True, name="ConfigWatcher")
+        thread.start()
+
+
+# 全局实例
+config_watcher = ConfigWatcher()
+
+
+def start_config_watcher():
+    """启动配置检测线程（间隔通过 CONFIG_WATCH_INTERVAL 配置，默认 5 秒）"""
+    try:
+        interval = float(os.getenv("CONFIG_WATCH_INTERVAL", "5") or 5)
+    except ValueError:
+        interval = 5
+    config_watcher.start_worker(interval=max(0.5, interval))
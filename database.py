@@ -3,17 +3,25 @@ SQLite数据库管理模块
 管理兑换码、兑换记录和Team统计
 """
 
+import json
+import os
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Dict, Any
 from contextlib import contextmanager
 from pathlib import Path
+from cache import TTLCache
 from logger import log
+from metrics import connection_factory as _metrics_connection_factory
+from shared_state import SharedCounters
 
 
 class Database:
     """数据库管理类"""
 
+    # sqlite3 连接类（默认带 SQL 耗时统计，见 metrics.py；基准测试等场景可替换为其他子类）
+    connection_factory = _metrics_connection_factory()
+
     def __init__(self, db_file: str | None = None):
         if db_file is None:
             import config
@@ -34,12 +42,33 @@ class Database:
                 pass
 
         self.db_file = db_file
+
+        # 兑换码元数据缓存：各 worker 进程内缓存，通过共享版本计数器跨进程失效
+        self._code_versions = SharedCounters(None if db_file == ":memory:" else f"{db_file}.versions")
+        self._code_cache = TTLCache(
+            maxsize=int(os.getenv("CODE_CACHE_SIZE", "2048") or 2048),
+            ttl=float(os.getenv("CODE_CACHE_TTL", "30") or 30),
+        )
+        # Team 统计版本号：teams_stats 写入后递增，管理后台统计缓存据此失效
+        self._team_stats_versions = SharedCounters(
+            None if db_file == ":memory:" else f"{db_file}.teams", slots=2
+        )
+        # 邮箱版本号：该邮箱的租约、租约事件、兑换记录写入后递增，用户状态查询缓存据此失效
+        self._email_versions = SharedCounters(
+            None if db_file == ":memory:" else f"{db_file}.emails",
+            slots=int(os.getenv("USER_STATUS_VERSION_SLOTS", "4096") or 4096),
+        )
+        # 变更事件版本号：写入 app_events 后递增，事件推送线程据此跳过无变化的轮询
+        self._event_versions = SharedCounters(
+            None if db_file == ":memory:" else f"{db_file}.events", slots=2
+        )
+
         self.init_database()
 
     @contextmanager
     def get_connection(self):
         """获取数据库连接的上下文管理器"""
-        conn = sqlite3.connect(self.db_file, timeout=30.0)  # 增加超时到30秒
+        conn = sqlite3.connect(self.db_file, timeout=30.0, factory=self.connection_factory)  # 增加超时到30秒
         conn.row_factory = sqlite3.Row  # 允许通过列名访问
         try:
             yield conn
@@ -199,6 +228,93 @@ class Database:
                 )
             """)
 
+            # 全局版本号（配置变更等跨 worker 通知：写入方递增，其他 worker 轮询发现变化）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS app_generations (
+                    name VARCHAR(64) PRIMARY KEY,
+                    generation INTEGER NOT NULL DEFAULT 0,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 异步兑换任务（/api/redeem 异步模式，跨 worker 查询状态）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS redemption_jobs (
+                    id VARCHAR(32) PRIMARY KEY,
+                    code VARCHAR(32) NOT NULL,
+                    email VARCHAR(255) NOT NULL,
+                    ip_address VARCHAR(45),
+                    code_id INTEGER NOT NULL,
+                    team_name VARCHAR(100) NOT NULL,
+                    lock_id TEXT NOT NULL,
+                    status VARCHAR(20) DEFAULT 'queued',
+                    result TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    started_at DATETIME,
+                    finished_at DATETIME
+                )
+            """)
+
+            # 延迟任务队列（兑换后的 joined_at 同步等后续任务，同一 kind+task_key 只保留一条）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS delayed_tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind VARCHAR(50) NOT NULL,
+                    task_key VARCHAR(255) NOT NULL,
+                    payload TEXT,
+                    run_at DATETIME NOT NULL,
+                    retry_interval INTEGER DEFAULT 180,
+                    max_attempts INTEGER DEFAULT 1,
+                    attempts INTEGER DEFAULT 0,
+                    status VARCHAR(20) DEFAULT 'pending',
+                    locked_by TEXT,
+                    locked_until DATETIME,
+                    last_error TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(kind, task_key)
+                )
+            """)
+
+            # 兑换码名额预占（多次使用的兑换码可并发兑换，每个进行中的兑换占一个名额）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS code_reservations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    code VARCHAR(50) NOT NULL,
+                    lock_id TEXT NOT NULL,
+                    reserved_until DATETIME NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 变更事件（管理后台 SSE 推送：兑换完成、租约变化、告警、Team 状态切换）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS app_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind VARCHAR(32) NOT NULL,
+                    payload TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_app_events_created ON app_events(created_at)")
+
+            # 幂等键（Idempotency-Key：重试请求复用进行中/已完成的结果）
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    scope VARCHAR(50) NOT NULL,
+                    idem_key VARCHAR(255) NOT NULL,
+                    request_hash VARCHAR(64) NOT NULL,
+                    status VARCHAR(20) DEFAULT 'in_flight',
+                    locked_until DATETIME,
+                    response_status INTEGER,
+                    response_body TEXT,
+                    response_mimetype VARCHAR(100),
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    completed_at DATETIME,
+                    PRIMARY KEY (scope, idem_key)
+                )
+            """)
+
             # 兼容旧库：补齐 member_leases 新字段 + 迁移旧数据
             cursor.execute("PRAGMA table_info(member_leases)")
             lease_cols = {row["name"] for row in cursor.fetchall()}
@@ -244,6 +360,14 @@ class Database:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_member_leases_next_attempt ON member_leases(next_attempt_at)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_member_events_email ON member_lease_events(email)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_member_leases_status ON member_leases(status)")
+            # 到期预测按状态 + 到期时间范围聚合（覆盖索引，不回表）
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_member_leases_status_expires ON member_leases(status, expires_at, team_name)"
+            )
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_redemption_jobs_status ON redemption_jobs(status, created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_delayed_tasks_due ON delayed_tasks(status, run_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_code_reservations_code ON code_reservations(code, lock_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_code_reservations_until ON code_reservations(reserved_until)")
 
             log.info("数据库初始化完成", icon="success")
 
@@ -273,6 +397,21 @@ class Database:
             )
             return cursor.rowcount == 1
 
+    def renew_lock(self, name: str, *, lock_by: str, lock_seconds: int = 90) -> bool:
+        """续约自己持有的全局锁，返回是否仍持有。"""
+        if not name:
+            return False
+        until_str = (datetime.now() + timedelta(seconds=max(5, int(lock_seconds or 90)))).isoformat(
+            sep=" ", timespec="seconds"
+        )
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE app_locks SET locked_until = ? WHERE name = ? AND locked_by = ?",
+                (until_str, name, lock_by),
+            )
+            return cursor.rowcount == 1
+
     def release_lock(self, name: str, *, lock_by: str):
         """释放锁（仅释放自己持有的锁）。"""
         if not name:
@@ -284,6 +423,284 @@ class Database:
                 (name, lock_by),
             )
 
+    def get_lock(self, name: str) -> Optional[Dict[str, Any]]:
+        """读取全局锁当前持有者（健康检查用）"""
+        with self.get_connection() as conn:
+            row = conn.execute("SELECT name, locked_by, locked_until FROM app_locks WHERE name = ?", (name,)).fetchone()
+            return dict(row) if row else None
+
+    # ==================== 全局版本号 ====================
+
+    def get_generation(self, name: str) -> int:
+        """读取全局版本号（不存在时为 0）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT generation FROM app_generations WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            return int(row["generation"]) if row else 0
+
+    def bump_generation(self, name: str) -> int:
+        """递增全局版本号，返回新版本号"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO app_generations (name, generation, updated_at)
+                VALUES (?, 1, CURRENT_TIMESTAMP)
+                ON CONFLICT(name) DO UPDATE SET
+                    generation = app_generations.generation + 1,
+                    updated_at = CURRENT_TIMESTAMP
+            """,
+                (name,),
+            )
+            cursor.execute("SELECT generation FROM app_generations WHERE name = ?", (name,))
+            return int(cursor.fetchone()["generation"])
+
+    # ==================== 幂等键 ====================
+
+    def begin_idempotent_request(
+        self, *, scope: str, idem_key: str, request_hash: str, lock_seconds: int = 300
+    ) -> tuple[str, Optional[Dict[str, Any]]]:
+        """
+        登记一次幂等请求
+
+        Returns:
+            ("started", None): 本次请求负责执行（新键，或上次执行者已超时）
+            ("in_flight", row): 相同请求正在执行
+            ("completed", row): 已有结果，直接复用
+            ("mismatch", row): 同一个键被用于不同的请求内容
+        """
+        now = datetime.now()
+        now_str = now.isoformat(sep=" ", timespec="seconds")
+        until_str = (now + timedelta(seconds=max(5, int(lock_seconds)))).isoformat(sep=" ", timespec="seconds")
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR IGNORE INTO idempotency_keys (scope, idem_key, request_hash, status, locked_until)
+                VALUES (?, ?, ?, 'in_flight', ?)
+            """,
+                (scope, idem_key, request_hash, until_str),
+            )
+            if cursor.rowcount == 1:
+                return "started", None
+
+            cursor.execute(
+                "SELECT * FROM idempotency_keys WHERE scope = ? AND idem_key = ?",
+                (scope, idem_key),
+            )
+            row = dict(cursor.fetchone())
+            if row["request_hash"] != request_hash:
+                return "mismatch", row
+            if row["status"] == "completed":
+                return "completed", row
+
+            # 上次执行者已超时（进程崩溃/被杀），接管执行
+            cursor.execute(
+                """
+                UPDATE idempotency_keys SET locked_until = ?
+                WHERE scope = ? AND idem_key = ? AND status = 'in_flight' AND locked_until <= ?
+            """,
+                (until_str, scope, idem_key, now_str),
+            )
+            if cursor.rowcount == 1:
+                return "started", None
+            return "in_flight", row
+
+    def get_idempotent_request(self, *, scope: str, idem_key: str) -> Optional[Dict[str, Any]]:
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM idempotency_keys WHERE scope = ? AND idem_key = ?",
+                (scope, idem_key),
+            )
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def complete_idempotent_request(
+        self, *, scope: str, idem_key: str, status_code: int, body: str, mimetype: str | None = None
+    ):
+        """保存幂等请求的响应"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE idempotency_keys
+                SET status = 'completed', locked_until = NULL,
+                    response_status = ?, response_body = ?, response_mimetype = ?,
+                    completed_at = CURRENT_TIMESTAMP
+                WHERE scope = ? AND idem_key = ?
+            """,
+                (int(status_code), body, mimetype, scope, idem_key),
+            )
+
+    def release_idempotent_request(self, *, scope: str, idem_key: str):
+        """放弃进行中的幂等请求（执行异常/结果不应缓存时），允许重试重新执行"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM idempotency_keys WHERE scope = ? AND idem_key = ? AND status = 'in_flight'",
+                (scope, idem_key),
+            )
+
+    def purge_idempotency_keys(self, *, older_than_hours: int = 24) -> int:
+        """清理过期的幂等键"""
+        threshold = (datetime.now(timezone.utc) - timedelta(hours=max(1, int(older_than_hours)))).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (threshold,))
+            return cursor.rowcount
+
+    # ==================== 延迟任务队列 ====================
+
+    def schedule_delayed_task(
+        self,
+        *,
+        kind: str,
+        task_key: str,
+        run_at: datetime,
+        payload: str | None = None,
+        retry_interval: int = 180,
+        max_attempts: int = 1,
+    ) -> bool:
+        """
+        登记延迟任务。同一 kind+task_key 已有待执行任务时合并为一条（保留更早的执行时间），
+        已结束的任务会被重置为新的一轮。
+
+        Returns:
+            是否新建/重置了任务（False 表示与已有待执行任务合并）
+        """
+        run_at_str = run_at.isoformat(sep=" ", timespec="seconds")
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT status FROM delayed_tasks WHERE kind = ? AND task_key = ?",
+                (kind, task_key),
+            )
+            row = cursor.fetchone()
+            pending_before = bool(row) and row["status"] in ("pending", "running")
+            cursor.execute(
+                """
+                INSERT INTO delayed_tasks (kind, task_key, payload, run_at, retry_interval, max_attempts)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(kind, task_key) DO UPDATE SET
+                    payload = excluded.payload,
+                    run_at = CASE
+                        WHEN delayed_tasks.status = 'pending' AND delayed_tasks.run_at < excluded.run_at
+                            THEN delayed_tasks.run_at
+                        ELSE excluded.run_at
+                    END,
+                    retry_interval = excluded.retry_interval,
+                    max_attempts = excluded.max_attempts,
+                    attempts = CASE WHEN delayed_tasks.status IN ('pending', 'running') THEN delayed_tasks.attempts ELSE 0 END,
+                    status = CASE WHEN delayed_tasks.status = 'running' THEN 'running' ELSE 'pending' END,
+                    last_error = CASE WHEN delayed_tasks.status IN ('pending', 'running') THEN delayed_tasks.last_error ELSE NULL END,
+                    updated_at = CURRENT_TIMESTAMP
+            """,
+                (kind, task_key, payload, run_at_str, int(retry_interval), max(1, int(max_attempts))),
+            )
+            return not pending_before
+
+    def claim_due_delayed_tasks(self, *, lock_by: str, limit: int = 10, lock_seconds: int = 300) -> List[Dict[str, Any]]:
+        """
+        领取到期的延迟任务（pending 且 run_at 已到，或 running 但锁已过期的遗留任务），
+        领取时 attempts + 1。多进程并发领取时每条任务只会被一个进程拿到。
+        """
+        if limit <= 0:
+            return []
+        now = datetime.now()
+        now_str = now.isoformat(sep=" ", timespec="seconds")
+        until_str = (now + timedelta(seconds=max(30, int(lock_seconds)))).isoformat(sep=" ", timespec="seconds")
+        claimed: List[Dict[str, Any]] = []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id FROM delayed_tasks
+                WHERE (status = 'pending' AND run_at <= ?)
+                   OR (status = 'running' AND locked_until <= ?)
+                ORDER BY run_at ASC
+                LIMIT ?
+            """,
+                (now_str, now_str, int(limit)),
+            )
+            for row in cursor.fetchall():
+                cursor.execute(
+                    """
+                    UPDATE delayed_tasks
+                    SET status = 'running', locked_by = ?, locked_until = ?,
+                        attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                      AND ((status = 'pending' AND run_at <= ?) OR (status = 'running' AND locked_until <= ?))
+                """,
+                    (lock_by, until_str, row["id"], now_str, now_str),
+                )
+                if cursor.rowcount == 1:
+                    cursor.execute("SELECT * FROM delayed_tasks WHERE id = ?", (row["id"],))
+                    claimed.append(dict(cursor.fetchone()))
+        return claimed
+
+    def finish_delayed_task(self, task_id: int, *, lock_by: str, success: bool, error: str | None = None):
+        """
+        结束一次执行：成功则标记 done；失败且未达最大次数时按 retry_interval 重新排期，否则标记 failed。
+        """
+        now = datetime.now()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT attempts, max_attempts, retry_interval FROM delayed_tasks WHERE id = ? AND locked_by = ? AND status = 'running'",
+                (task_id, lock_by),
+            )
+            row = cursor.fetchone()
+            if not row:
+                return
+            if success:
+                status, run_at = "done", None
+            elif int(row["attempts"] or 0) < int(row["max_attempts"] or 1):
+                status = "pending"
+                run_at = (now + timedelta(seconds=max(1, int(row["retry_interval"] or 180)))).isoformat(
+                    sep=" ", timespec="seconds"
+                )
+            else:
+                status, run_at = "failed", None
+            cursor.execute(
+                """
+                UPDATE delayed_tasks
+                SET status = ?, run_at = COALESCE(?, run_at), locked_by = NULL, locked_until = NULL,
+                    last_error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND locked_by = ?
+            """,
+                (status, run_at, error, task_id, lock_by),
+            )
+
+    def next_delayed_task_run_at(self) -> Optional[datetime]:
+        """最早一条待执行任务的执行时间（没有则返回 None）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(run_at) AS run_at FROM delayed_tasks WHERE status = 'pending'")
+            row = cursor.fetchone()
+            if not row or not row["run_at"]:
+                return None
+            try:
+                return datetime.fromisoformat(row["run_at"])
+            except Exception:
+                return None
+
+    def purge_delayed_tasks(self, *, older_than_days: int = 7) -> int:
+        """清理已结束（done/failed）的历史任务"""
+        threshold = (datetime.now(timezone.utc) - timedelta(days=max(1, int(older_than_days)))).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM delayed_tasks WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (threshold,),
+            )
+            return cursor.rowcount
+
     # ==================== 成员租约（按月转移） ====================
 
     def upsert_member_lease(
@@ -330,6 +747,7 @@ class Database:
                     status,
                 ),
             )
+        self._invalidate_emails([email])
 
     def add_member_lease_event(
         self,
@@ -349,6 +767,13 @@ class Database:
             """,
                 (email, from_team, to_team, action, message),
             )
+            self._insert_event(
+                cursor,
+                "lease",
+                {"email": email, "action": action, "from_team": from_team, "to_team": to_team},
+            )
+        self._invalidate_emails([email])
+        self._notify_events()
 
     def list_due_member_leases(self, *, limit: int = 20) -> List[Dict[str, Any]]:
         """获取已到期的租约(只包含 active 状态且 joined_at 不为 NULL 的)"""
@@ -406,6 +831,56 @@ class Database:
                 )
             return [dict(row) for row in cursor.fetchall()]
 
+    def get_backlog_counts(self) -> Dict[str, int]:
+        """积压数量（/metrics 抓取时调用，一次查询）"""
+        now = datetime.now().isoformat(sep=" ", timespec="seconds")
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM member_leases
+                     WHERE status = 'active' AND joined_at IS NOT NULL AND expires_at <= ?) AS due_leases,
+                    (SELECT COUNT(*) FROM member_leases
+                     WHERE status = 'pending' AND joined_at IS NULL) AS pending_join_leases,
+                    (SELECT COUNT(*) FROM delayed_tasks WHERE status = 'pending') AS delayed_tasks_pending,
+                    (SELECT COUNT(*) FROM delayed_tasks
+                     WHERE status = 'pending' AND run_at <= ?) AS delayed_tasks_due,
+                    (SELECT COUNT(*) FROM redemption_jobs WHERE status = 'queued') AS redemption_jobs_queued,
+                    (SELECT COUNT(*) FROM redemption_jobs WHERE status = 'running') AS redemption_jobs_running
+            """,
+                (now, now),
+            )
+            row = cursor.fetchone()
+            return {key: int(row[key] or 0) for key in row.keys()}
+
+    def aggregate_lease_expiries(self, *, until: datetime, bucket: str = "day") -> List[Dict[str, Any]]:
+        """
+        按到期时间分桶统计待转移的租约（active / pending，含已过期未处理的），聚合在 SQLite 中完成
+
+        Args:
+            until: 统计截止时间（含）
+            bucket: day（YYYY-MM-DD）或 hour（YYYY-MM-DD HH）
+
+        Returns:
+            [{"bucket", "team_name", "status", "leases"}]，按 bucket 排序
+        """
+        width = 13 if bucket == "hour" else 10
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT substr(expires_at, 1, {width}) AS bucket, team_name, status, COUNT(*) AS leases
+                FROM member_leases
+                WHERE status IN ('active', 'pending')
+                  AND expires_at <= ?
+                GROUP BY bucket, team_name, status
+                ORDER BY bucket
+            """,
+                (until.isoformat(sep=" ", timespec="seconds"),),
+            )
+            return [dict(row) for row in cursor.fetchall()]
+
     def defer_member_lease_join_sync(self, *, email: str, next_attempt_at: datetime, last_error: str | None = None) -> bool:
         """延迟下次同步尝试(用于 pending 状态)"""
         email = (email or "").strip().lower()
@@ -429,7 +904,10 @@ class Database:
                     email,
                 ),
             )
-            return cursor.rowcount == 1
+            ok = cursor.rowcount == 1
+        if ok:
+            self._invalidate_emails([email])
+        return ok
 
     def update_member_lease_joined(
         self,
@@ -466,6 +944,7 @@ class Database:
                     email,
                 ),
             )
+        self._invalidate_emails([email])
 
         self.add_member_lease_event(
             email=email,
@@ -475,6 +954,98 @@ class Database:
             message=event_message or f"检测到加入时间：{joined_at.isoformat(sep=' ', timespec='seconds')}",
         )
 
+    def apply_member_lease_join_sync(
+        self,
+        *,
+        joined: List[Dict[str, Any]] | None = None,
+        deferred: List[Dict[str, Any]] | None = None,
+        events: List[Dict[str, Any]] | None = None,
+    ):
+        """批量写回 joined_at 同步结果（同一事务）
+
+        Args:
+            joined: [{"email", "joined_at": datetime, "expires_at": datetime}]，写法同 update_member_lease_joined
+            deferred: [{"email", "next_attempt_at": datetime, "last_error"}]，写法同 defer_member_lease_join_sync
+            events: [{"email", "action", "from_team", "to_team", "message"}]，按顺序写入租约事件
+        """
+        joined = joined or []
+        deferred = deferred or []
+        events = events or []
+        if not joined and not deferred and not events:
+            return
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if deferred:
+                cursor.executemany(
+                    """
+                    UPDATE member_leases
+                    SET next_attempt_at = ?,
+                        last_error = ?,
+                        last_synced_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE email = ?
+                      AND status = 'pending'
+                """,
+                    [
+                        (
+                            item["next_attempt_at"].isoformat(sep=" ", timespec="seconds"),
+                            item.get("last_error"),
+                            item["email"],
+                        )
+                        for item in deferred
+                    ],
+                )
+            if joined:
+                cursor.executemany(
+                    """
+                    UPDATE member_leases
+                    SET joined_at = ?,
+                        expires_at = ?,
+                        status = 'active',
+                        attempts = 0,
+                        next_attempt_at = NULL,
+                        last_error = NULL,
+                        last_synced_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE email = ?
+                """,
+                    [
+                        (
+                            item["joined_at"].isoformat(sep=" ", timespec="seconds"),
+                            item["expires_at"].isoformat(sep=" ", timespec="seconds"),
+                            item["email"],
+                        )
+                        for item in joined
+                    ],
+                )
+            if events:
+                cursor.executemany(
+                    """
+                    INSERT INTO member_lease_events (email, from_team, to_team, action, message)
+                    VALUES (?, ?, ?, ?, ?)
+                """,
+                    [
+                        (item["email"], item.get("from_team"), item.get("to_team"), item["action"], item.get("message"))
+                        for item in events
+                    ],
+                )
+                # 与 add_member_lease_event 相同的变更事件（同一事务提交）
+                for item in events:
+                    self._insert_event(
+                        cursor,
+                        "lease",
+                        {
+                            "email": item["email"],
+                            "action": item["action"],
+                            "from_team": item.get("from_team"),
+                            "to_team": item.get("to_team"),
+                        },
+                    )
+        self._invalidate_emails(item["email"] for item in (*joined, *deferred, *events))
+        if events:
+            self._notify_events()
+
     def get_member_lease(self, email: str) -> Optional[Dict[str, Any]]:
         email = (email or "").strip().lower()
         if not email:
@@ -499,7 +1070,10 @@ class Database:
             """,
                 (email,),
             )
-            return cursor.rowcount == 1
+            ok = cursor.rowcount == 1
+        if ok:
+            self._invalidate_emails([email])
+        return ok
 
     def update_member_lease_transfer_success(
         self,
@@ -538,6 +1112,7 @@ class Database:
                     email,
                 ),
             )
+        self._invalidate_emails([email])
 
     def update_member_lease_transfer_failure(
         self,
@@ -561,6 +1136,7 @@ class Database:
             """,
                 (next_attempt_at.isoformat(sep=" ", timespec="seconds"), message, email),
             )
+        self._invalidate_emails([email])
 
     def update_member_lease_status(self, email: str, status: str):
         """更新租约状态"""
@@ -578,6 +1154,7 @@ class Database:
             """,
                 (status, email),
             )
+        self._invalidate_emails([email])
 
     def list_member_leases(self, *, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
         with self.get_connection() as conn:
@@ -673,6 +1250,7 @@ class Database:
                     status,
                 ),
             )
+        self._invalidate_emails([email])
 
     def delete_member_lease(self, *, email: str, delete_events: bool = True) -> bool:
         """删除某邮箱的租约（可选同时删除其事件记录）。"""
@@ -685,6 +1263,7 @@ class Database:
             ok = cursor.rowcount == 1
             if delete_events:
                 cursor.execute("DELETE FROM member_lease_events WHERE email = ?", (email,))
+        self._invalidate_emails([email])
         return ok
 
     def force_expire_member_lease(self, *, email: str):
@@ -711,16 +1290,7 @@ class Database:
             )
             if cursor.rowcount != 1:
                 raise ValueError("租约不存在")
-
-    def _ensure_code_lock_columns(self):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("PRAGMA table_info(redemption_codes)")
-            cols = {row["name"] for row in cursor.fetchall()}
-            if "locked_by" not in cols:
-                cursor.execute("ALTER TABLE redemption_codes ADD COLUMN locked_by TEXT")
-            if "locked_until" not in cols:
-                cursor.execute("ALTER TABLE redemption_codes ADD COLUMN locked_until DATETIME")
+        self._invalidate_emails([email])
 
     # ==================== 兑换码管理 ====================
 
@@ -743,7 +1313,9 @@ class Database:
             """,
                 (code, team_name, max_uses, expires_at, notes, 1 if auto_transfer_enabled else 0),
             )
-            return cursor.lastrowid
+            code_id = cursor.lastrowid
+        self._invalidate_code(code)
+        return code_id
 
     def get_code(self, code: str) -> Optional[Dict[str, Any]]:
         """获取兑换码信息"""
@@ -758,12 +1330,37 @@ class Database:
             row = cursor.fetchone()
             return dict(row) if row else None
 
-    def verify_code(self, code: str) -> tuple[bool, str]:
+    def get_code_cached(self, code: str) -> Optional[Dict[str, Any]]:
+        """
+        带缓存的兑换码查询（用于校验/展示）。
+        兑换码状态或使用次数变化时通过共享版本号失效；预占名额不触发失效，不能用于并发控制。
+        """
+        version = self._code_versions.version(code)
+        hit, value = self._code_cache.get(code, version=version)
+        if not hit:
+            value = self.get_code(code)
+            self._code_cache.set(code, value, version=version)
+        return dict(value) if value else None
+
+    def _invalidate_code(self, code: Optional[str] = None):
+        """兑换码状态/使用次数变化后调用（需在事务提交之后）；code 为空时全部失效"""
+        try:
+            self._code_versions.invalidate(code)
+            if code:
+                self._code_cache.pop(code)
+            else:
+                self._code_cache.clear()
+        except Exception as e:
+            log.warning(f"兑换码缓存失效失败: {e}")
+
+    def verify_code(self, code: str, *, cached: bool = False) -> tuple[bool, str]:
         """
         验证兑换码是否有效
         返回: (是否有效, 错误信息)
+
+        cached=True 时读取兑换码缓存（见 get_code_cached）
         """
-        code_info = self.get_code(code)
+        code_info = self.get_code_cached(code) if cached else self.get_code(code)
 
         if not code_info:
             return False, "兑换码不存在"
@@ -799,129 +1396,176 @@ class Database:
 
     def reserve_code(self, code: str, *, lock_by: str, lock_seconds: int = 120) -> tuple[bool, str, Optional[Dict[str, Any]]]:
         """
-        以数据库级锁的方式预占兑换码，避免并发兑换造成超发。
+        预占兑换码的一个使用名额（code_reservations），避免并发兑换造成超发。
+        多次使用的兑换码可同时被多个请求预占，最多 max_uses - used_count 个名额。
 
         - 成功: 返回 (True, "OK", code_info)
         - 失败: 返回 (False, message, None)
 
-        注意：该预占仅用于短时间内串行化兑换流程，需要在兑换结束后调用
-        consume_reserved_code/release_reserved_code 清理锁。
+        注意：预占名额有有效期（lock_seconds），需要在兑换结束后调用
+        consume_reserved_code/release_reserved_code 消费或释放名额。
         """
         if not code:
             return False, "兑换码不能为空", None
+        return self.reserve_codes([code], lock_by=lock_by, lock_seconds=lock_seconds)[0]
 
-        self._ensure_code_lock_columns()
+    def reserve_codes(
+        self, codes: List[str], *, lock_by: str, lock_seconds: int = 120
+    ) -> List[tuple[bool, str, Optional[Dict[str, Any]]]]:
+        """
+        在同一个事务内批量预占兑换码名额（批量兑换使用）。
 
+        返回与 codes 顺序一致的 [(ok, message, code_info)]，单个码的语义与 reserve_code 相同；
+        同一兑换码出现多次时每次各占一个名额。
+        """
         now = datetime.now()
         now_str = now.isoformat(sep=" ", timespec="seconds")
         lock_until = (now + timedelta(seconds=max(5, int(lock_seconds or 120)))).isoformat(
             sep=" ", timespec="seconds"
         )
 
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-
-            cursor.execute(
-                """
-                UPDATE redemption_codes
-                SET locked_by = ?, locked_until = ?
-                WHERE code = ?
-                  AND status = 'active'
-                  AND (expires_at IS NULL OR expires_at > ?)
-                  AND used_count < max_uses
-                  AND (locked_until IS NULL OR locked_until <= ?)
-            """,
-                (lock_by, lock_until, code, now_str, now_str),
-            )
+        results: List[tuple[bool, str, Optional[Dict[str, Any]]]] = []
+        changed: List[str] = []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # 先清理过期名额（同时取得写锁，保证下面的"统计 + 插入"不会与其他进程交错）
+            cursor.execute("DELETE FROM code_reservations WHERE reserved_until <= ?", (now_str,))
+            for code in codes:
+                if not code:
+                    results.append((False, "兑换码不能为空", None))
+                    continue
+                results.append(
+                    self._reserve_code_with_cursor(
+                        cursor, code, lock_by=lock_by, lock_until=lock_until, now_str=now_str, status_changed=changed
+                    )
+                )
+        for changed_code in changed:
+            self._invalidate_code(changed_code)
+        return results
 
-            if cursor.rowcount == 1:
-                cursor.execute("SELECT * FROM redemption_codes WHERE code = ?", (code,))
-                row = cursor.fetchone()
-                return True, "OK", dict(row) if row else None
+    def _reserve_code_with_cursor(
+        self,
+        cursor,
+        code: str,
+        *,
+        lock_by: str,
+        lock_until: str,
+        now_str: str,
+        status_changed: Optional[List[str]] = None,
+    ) -> tuple[bool, str, Optional[Dict[str, Any]]]:
+        """在给定游标（事务）内预占单个兑换码名额；自动改写了状态的兑换码会追加到 status_changed"""
+        cursor.execute(
+            """
+            INSERT INTO code_reservations (code, lock_id, reserved_until)
+            SELECT rc.code, ?, ?
+            FROM redemption_codes rc
+            WHERE rc.code = ?
+              AND rc.status = 'active'
+              AND (rc.expires_at IS NULL OR rc.expires_at > ?)
+              AND rc.used_count + (
+                  SELECT COUNT(*) FROM code_reservations r WHERE r.code = rc.code
+              ) < rc.max_uses
+        """,
+            (lock_by, lock_until, code, now_str),
+        )
 
+        if cursor.rowcount == 1:
             cursor.execute("SELECT * FROM redemption_codes WHERE code = ?", (code,))
             row = cursor.fetchone()
-            if not row:
-                return False, "兑换码不存在", None
+            return True, "OK", dict(row) if row else None
 
-            code_info = dict(row)
-            status = code_info.get("status")
-            if status != "active":
-                return False, f"兑换码状态异常: {status}", None
+        cursor.execute("SELECT * FROM redemption_codes WHERE code = ?", (code,))
+        row = cursor.fetchone()
+        if not row:
+            return False, "兑换码不存在", None
 
-            if code_info.get("expires_at"):
-                try:
-                    expires_at = datetime.fromisoformat(code_info["expires_at"])
-                    if datetime.now() > expires_at:
-                        cursor.execute(
-                            "UPDATE redemption_codes SET status = 'expired' WHERE code = ?",
-                            (code,),
-                        )
-                        return False, "兑换码已过期", None
-                except Exception:
-                    pass
+        code_info = dict(row)
+        status = code_info.get("status")
+        if status != "active":
+            return False, f"兑换码状态异常: {status}", None
 
-            used_count = int(code_info.get("used_count") or 0)
-            max_uses = int(code_info.get("max_uses") or 0)
-            if used_count >= max_uses:
-                cursor.execute(
-                    "UPDATE redemption_codes SET status = 'used_up' WHERE code = ? AND status = 'active'",
-                    (code,),
-                )
-                return False, "兑换码已用完", None
+        if code_info.get("expires_at"):
+            try:
+                expires_at = datetime.fromisoformat(code_info["expires_at"])
+                if datetime.now() > expires_at:
+                    cursor.execute(
+                        "UPDATE redemption_codes SET status = 'expired' WHERE code = ?",
+                        (code,),
+                    )
+                    if status_changed is not None:
+                        status_changed.append(code)
+                    return False, "兑换码已过期", None
+            except Exception:
+                pass
 
-            locked_until_val = code_info.get("locked_until")
-            if locked_until_val:
-                try:
-                    locked_until_dt = datetime.fromisoformat(locked_until_val)
-                    if locked_until_dt > datetime.now():
-                        return False, "兑换码正在被使用，请稍后再试", None
-                except Exception:
-                    return False, "兑换码正在被使用，请稍后再试", None
+        used_count = int(code_info.get("used_count") or 0)
+        max_uses = int(code_info.get("max_uses") or 0)
+        if used_count >= max_uses:
+            cursor.execute(
+                "UPDATE redemption_codes SET status = 'used_up' WHERE code = ? AND status = 'active'",
+                (code,),
+            )
+            if status_changed is not None:
+                status_changed.append(code)
+            return False, "兑换码已用完", None
 
-            return False, "兑换码暂不可用，请稍后重试", None
+        # 剩余名额都已被其他进行中的兑换预占
+        return False, "兑换码正在被使用，请稍后再试", None
 
-    def release_reserved_code(self, code: str, *, lock_by: str):
-        """释放预占的兑换码锁"""
-        if not code:
+    def release_reserved_codes(self, codes: List[str], *, lock_by: str):
+        """批量释放预占的兑换码名额（同一兑换码出现几次释放几个）"""
+        codes = [c for c in codes if c]
+        if not codes:
             return
-        self._ensure_code_lock_columns()
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
+            cursor.executemany(
                 """
-                UPDATE redemption_codes
-                SET locked_by = NULL, locked_until = NULL
-                WHERE code = ? AND locked_by = ?
+                DELETE FROM code_reservations
+                WHERE id = (SELECT id FROM code_reservations WHERE code = ? AND lock_id = ? LIMIT 1)
             """,
-                (code, lock_by),
+                [(code, lock_by) for code in codes],
             )
 
+    def release_reserved_code(self, code: str, *, lock_by: str):
+        """释放预占的兑换码名额"""
+        if not code:
+            return
+        self.release_reserved_codes([code], lock_by=lock_by)
+
     def consume_reserved_code(self, code: str, *, lock_by: str) -> bool:
         """
-        消费已预占的兑换码：增加 used_count 并释放锁。
-        仅当 locked_by 匹配时生效，返回是否成功。
+        消费已预占的兑换码名额：删除名额并增加 used_count（同一事务）。
+        仅当名额仍存在（未过期被清理）时生效，返回是否成功。
         """
         if not code:
             return False
-        self._ensure_code_lock_columns()
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
-                UPDATE redemption_codes
-                SET used_count = used_count + 1,
-                    status = CASE
-                        WHEN (used_count + 1) >= max_uses THEN 'used_up'
-                        ELSE status
-                    END,
-                    locked_by = NULL,
-                    locked_until = NULL
-                WHERE code = ? AND locked_by = ?
+                DELETE FROM code_reservations
+                WHERE id = (SELECT id FROM code_reservations WHERE code = ? AND lock_id = ? LIMIT 1)
             """,
                 (code, lock_by),
             )
-            return cursor.rowcount == 1
+            consumed = cursor.rowcount == 1
+            if consumed:
+                cursor.execute(
+                    """
+                    UPDATE redemption_codes
+                    SET used_count = used_count + 1,
+                        status = CASE
+                            WHEN (used_count + 1) >= max_uses THEN 'used_up'
+                            ELSE status
+                        END
+                    WHERE code = ?
+                """,
+                    (code,),
+                )
+        if consumed:
+            self._invalidate_code(code)
+        return consumed
 
     def update_code_status(self, code: str, status: str):
         """更新兑换码状态"""
@@ -933,9 +1577,10 @@ class Database:
             """,
                 (status, code),
             )
+        self._invalidate_code(code)
 
-    def increment_code_usage(self, code: str):
-        """增加兑换码使用次数"""
+    def increment_code_usage(self, code: str) -> bool:
+        """增加兑换码使用次数（不超过 max_uses），返回是否计入"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
@@ -943,9 +1588,11 @@ class Database:
                 UPDATE redemption_codes
                 SET used_count = used_count + 1
                 WHERE code = ?
+                  AND used_count < max_uses
             """,
                 (code,),
             )
+            counted = cursor.rowcount == 1
 
             # 达到上限后自动标记为已用完（仅影响展示与后续校验）
             cursor.execute(
@@ -962,6 +1609,8 @@ class Database:
                         "UPDATE redemption_codes SET status = 'used_up' WHERE code = ?",
                         (code,),
                     )
+        self._invalidate_code(code)
+        return counted
 
     def list_codes(
         self,
@@ -1008,13 +1657,17 @@ class Database:
 
             code_id = row["id"] if isinstance(row, sqlite3.Row) else row[0]
 
+            emails = []
             if hard:
+                emails = self._redemption_emails(cursor, code_id=code_id)
                 cursor.execute("DELETE FROM redemptions WHERE code_id = ?", (code_id,))
                 cursor.execute("DELETE FROM redemption_codes WHERE id = ?", (code_id,))
             else:
                 cursor.execute("UPDATE redemption_codes SET status = 'deleted' WHERE id = ?", (code_id,))
 
-            return True
+        self._invalidate_code(code)
+        self._invalidate_emails(emails)
+        return True
 
     def soft_delete_codes_by_team_names(self, team_names: List[str]) -> int:
         """按 team_name 批量软删除兑换码（status=deleted），返回影响行数。"""
@@ -1032,7 +1685,9 @@ class Database:
             """,
                 names,
             )
-            return cursor.rowcount or 0
+            affected = cursor.rowcount or 0
+        self._invalidate_code()
+        return affected
 
     def delete_team_stats_by_names(self, team_names: List[str]) -> int:
         """按 team_name 批量删除 Team 统计行，返回影响行数。"""
@@ -1043,7 +1698,9 @@ class Database:
             cursor = conn.cursor()
             placeholders = ",".join(["?"] * len(names))
             cursor.execute(f"DELETE FROM teams_stats WHERE team_name IN ({placeholders})", names)
-            return cursor.rowcount or 0
+            affected = cursor.rowcount or 0
+        self._invalidate_team_stats()
+        return affected
 
     # ==================== 兑换记录管理 ====================
 
@@ -1064,7 +1721,106 @@ class Database:
             """,
                 (code_id, email, team_name, ip_address),
             )
-            return cursor.lastrowid
+            redemption_id = cursor.lastrowid
+        self._invalidate_emails([email])
+        return redemption_id
+
+    def create_redemptions(self, rows: List[Dict[str, Any]], *, status: str = "pending") -> List[int]:
+        """
+        批量创建兑换记录（同一事务）
+
+        Args:
+            rows: [{"code_id", "email", "team_name", "ip_address"}]
+            status: 初始状态
+
+        Returns:
+            与 rows 顺序一致的兑换记录 ID 列表
+        """
+        ids: List[int] = []
+        if not rows:
+            return ids
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for row in rows:
+                cursor.execute(
+                    """
+                    INSERT INTO redemptions (code_id, email, team_name, ip_address, invite_status)
+                    VALUES (?, ?, ?, ?, ?)
+                """,
+                    (row["code_id"], row["email"], row["team_name"], row.get("ip_address"), status),
+                )
+                ids.append(cursor.lastrowid)
+        self._invalidate_emails(row["email"] for row in rows)
+        return ids
+
+    def finalize_redemption_batch(
+        self,
+        *,
+        lock_by: str,
+        succeeded: List[Dict[str, Any]],
+        failed: List[Dict[str, Any]],
+    ):
+        """
+        批量写回邀请结果（同一事务）：成功的记录标记 success 并消费兑换码，
+        失败的记录写入错误信息并释放兑换码名额
+
+        Args:
+            lock_by: 预占兑换码时使用的锁标识
+            succeeded: [{"redemption_id", "code"}]
+            failed: [{"redemption_id", "code", "error"}]
+        """
+        if not succeeded and not failed:
+            return
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            emails = self._redemption_emails(
+                cursor, ids=[item["redemption_id"] for item in succeeded] + [item["redemption_id"] for item in failed]
+            )
+            if succeeded:
+                cursor.executemany(
+                    "UPDATE redemptions SET invite_status = 'success', error_message = NULL WHERE id = ?",
+                    [(item["redemption_id"],) for item in succeeded],
+                )
+                # 邀请已发出：无论名额是否已过期被清理，都计入使用次数（不超过 max_uses）
+                cursor.executemany(
+                    """
+                    DELETE FROM code_reservations
+                    WHERE id = (SELECT id FROM code_reservations WHERE code = ? AND lock_id = ? LIMIT 1)
+                """,
+                    [(item["code"], lock_by) for item in succeeded],
+                )
+                cursor.executemany(
+                    """
+                    UPDATE redemption_codes
+                    SET used_count = used_count + 1,
+                        status = CASE
+                            WHEN (used_count + 1) >= max_uses THEN 'used_up'
+                            ELSE status
+                        END
+                    WHERE code = ?
+                      AND used_count < max_uses
+                """,
+                    [(item["code"],) for item in succeeded],
+                )
+            if failed:
+                cursor.executemany(
+                    "UPDATE redemptions SET invite_status = 'failed', error_message = ? WHERE id = ?",
+                    [(item.get("error"), item["redemption_id"]) for item in failed],
+                )
+                cursor.executemany(
+                    """
+                    DELETE FROM code_reservations
+                    WHERE id = (SELECT id FROM code_reservations WHERE code = ? AND lock_id = ? LIMIT 1)
+                """,
+                    [(item["code"], lock_by) for item in failed],
+                )
+            self._insert_redemption_events(
+                cursor, [item["redemption_id"] for item in succeeded] + [item["redemption_id"] for item in failed]
+            )
+        for item in succeeded:
+            self._invalidate_code(item["code"])
+        self._invalidate_emails(emails)
+        self._notify_events()
 
     def update_redemption_status(
         self,
@@ -1083,6 +1839,12 @@ class Database:
             """,
                 (status, error_message, redemption_id),
             )
+            emails = self._redemption_emails(cursor, ids=[redemption_id])
+            if status in ("success", "failed"):
+                self._insert_redemption_events(cursor, [redemption_id])
+        self._invalidate_emails(emails)
+        if status in ("success", "failed"):
+            self._notify_events()
 
     def check_email_redeemed(self, email: str) -> bool:
         """检查邮箱是否已兑换过"""
@@ -1098,20 +1860,22 @@ class Database:
             result = cursor.fetchone()
             return result["count"] > 0
 
-    def count_ip_redemptions(self, ip_address: str, hours: int = 1) -> int:
-        """统计IP在指定小时内的兑换次数"""
+    def list_redeemed_emails(self, emails: List[str]) -> set[str]:
+        """批量检查邮箱是否已兑换过，返回已成功兑换的邮箱集合"""
+        emails = [e for e in emails if e]
+        if not emails:
+            return set()
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            time_threshold = datetime.now() - timedelta(hours=hours)
+            placeholders = ",".join(["?"] * len(emails))
             cursor.execute(
-                """
-                SELECT COUNT(*) as count FROM redemptions
-                WHERE ip_address = ? AND redeemed_at > ?
+                f"""
+                SELECT DISTINCT email FROM redemptions
+                WHERE email IN ({placeholders}) AND invite_status = 'success'
             """,
-                (ip_address, time_threshold),
+                emails,
             )
-            result = cursor.fetchone()
-            return result["count"]
+            return {row["email"] for row in cursor.fetchall()}
 
     def list_redemptions(
         self, limit: int = 100, offset: int = 0
@@ -1167,14 +1931,201 @@ class Database:
                 cursor.execute(f"DELETE FROM redemptions WHERE team_name IN ({placeholders})", names)
             else:
                 cursor.execute("DELETE FROM redemptions")
-            return cursor.rowcount or 0
+            deleted = cursor.rowcount or 0
+        # 按 Team 批量删除涉及的邮箱较多，直接全部失效
+        self._invalidate_emails(None)
+        return deleted
 
     def delete_redemption(self, redemption_id: int) -> bool:
         """删除单条兑换记录"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            emails = self._redemption_emails(cursor, ids=[int(redemption_id)])
             cursor.execute("DELETE FROM redemptions WHERE id = ?", (int(redemption_id),))
-            return (cursor.rowcount or 0) > 0
+            ok = (cursor.rowcount or 0) > 0
+        self._invalidate_emails(emails)
+        return ok
+
+    # ==================== 邮箱版本号 ====================
+
+    def email_version(self, email: str) -> tuple[int, int]:
+        """邮箱版本号（同一主机上的进程共享），租约/租约事件/兑换记录变化后改变"""
+        return self._email_versions.version((email or "").strip().lower())
+
+    @staticmethod
+    def _redemption_emails(cursor, *, ids: Optional[List[int]] = None, code_id: Optional[int] = None) -> List[str]:
+        """在调用方事务中查询兑换记录对应的邮箱（用于写入后失效用户状态缓存）"""
+        if code_id is not None:
+            cursor.execute("SELECT DISTINCT email FROM redemptions WHERE code_id = ?", (code_id,))
+        elif ids:
+            placeholders = ",".join(["?"] * len(ids))
+            cursor.execute(f"SELECT DISTINCT email FROM redemptions WHERE id IN ({placeholders})", list(ids))
+        else:
+            return []
+        return [row["email"] for row in cursor.fetchall()]
+
+    def _invalidate_emails(self, emails):
+        """邮箱相关数据写入后调用（需在事务提交之后）；emails 为 None 时全部失效"""
+        try:
+            if emails is None:
+                self._email_versions.invalidate()
+                return
+            for email in {(e or "").strip().lower() for e in emails}:
+                if email:
+                    self._email_versions.invalidate(email)
+        except Exception as e:
+            log.warning(f"邮箱版本号更新失败: {e}")
+
+    # ==================== 异步兑换任务 ====================
+
+    def create_redemption_job(
+        self,
+        *,
+        job_id: str,
+        code: str,
+        email: str,
+        ip_address: Optional[str],
+        code_id: int,
+        team_name: str,
+        lock_id: str,
+    ):
+        """创建排队中的兑换任务（兑换码已由 lock_id 预占）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO redemption_jobs (id, code, email, ip_address, code_id, team_name, lock_id, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'queued')
+            """,
+                (job_id, code, email, ip_address, code_id, team_name, lock_id),
+            )
+
+    def get_redemption_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取兑换任务"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM redemption_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def claim_redemption_job(self, job_id: str, *, lock_seconds: int = 120) -> Optional[Dict[str, Any]]:
+        """
+        领取兑换任务：queued -> running，同时为任务预占的兑换码名额续期 lock_seconds。
+        多个 worker 同时领取时只有一个能成功，返回任务信息；否则返回 None。
+
+        任务可能排队很久才被领取（积压 / 提交进程没有执行线程 / 重启），此时名额可能已过期被清理：
+        先尝试重新预占，兑换码已无剩余名额时任务直接失败（返回 None），不再发送邀请。
+        """
+        now = datetime.now()
+        now_str = now.isoformat(sep=" ", timespec="seconds")
+        lock_until = (now + timedelta(seconds=max(5, int(lock_seconds or 120)))).isoformat(
+            sep=" ", timespec="seconds"
+        )
+        changed: List[str] = []
+        job = None
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE redemption_jobs
+                SET status = 'running', started_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'queued'
+            """,
+                (job_id,),
+            )
+            if cursor.rowcount != 1:
+                return None
+            cursor.execute("SELECT * FROM redemption_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            job = dict(row)
+
+            cursor.execute("DELETE FROM code_reservations WHERE reserved_until <= ?", (now_str,))
+            cursor.execute(
+                """
+                UPDATE code_reservations
+                SET reserved_until = ?
+                WHERE id = (SELECT id FROM code_reservations WHERE code = ? AND lock_id = ? LIMIT 1)
+            """,
+                (lock_until, job["code"], job["lock_id"]),
+            )
+            if cursor.rowcount != 1:
+                ok, message, _ = self._reserve_code_with_cursor(
+                    cursor,
+                    job["code"],
+                    lock_by=job["lock_id"],
+                    lock_until=lock_until,
+                    now_str=now_str,
+                    status_changed=changed,
+                )
+                if not ok:
+                    result = {
+                        "success": False,
+                        "error": f"兑换排队超时，兑换码名额已释放（{message}）",
+                        "code": "INVALID_CODE",
+                    }
+                    cursor.execute(
+                        """
+                        UPDATE redemption_jobs
+                        SET status = 'failed', result = ?, finished_at = CURRENT_TIMESTAMP
+                        WHERE id = ?
+                    """,
+                        (json.dumps(result, ensure_ascii=False), job_id),
+                    )
+                    log.warning(f"兑换任务 {job_id} 的兑换码名额已过期且无法重新预占: {message}")
+                    job = None
+        for changed_code in changed:
+            self._invalidate_code(changed_code)
+        return job
+
+    def finish_redemption_job(self, job_id: str, *, status: str, result: Dict[str, Any]):
+        """写入兑换任务结果"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE redemption_jobs
+                SET status = ?, result = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """,
+                (status, json.dumps(result, ensure_ascii=False), job_id),
+            )
+
+    def list_queued_redemption_jobs(self, *, older_than_seconds: int = 0, limit: int = 20) -> List[str]:
+        """列出排队中的任务 ID（用于兜底调度其他 worker/重启前遗留的任务）"""
+        threshold = datetime.now(timezone.utc) - timedelta(seconds=max(0, int(older_than_seconds)))
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id FROM redemption_jobs
+                WHERE status = 'queued' AND created_at <= ?
+                ORDER BY created_at ASC
+                LIMIT ?
+            """,
+                (threshold.strftime("%Y-%m-%d %H:%M:%S"), int(limit)),
+            )
+            return [row["id"] for row in cursor.fetchall()]
+
+    def fail_stale_redemption_jobs(self, *, timeout_seconds: int) -> int:
+        """将运行超时的任务标记为失败（worker 崩溃/重启后遗留），返回影响行数"""
+        threshold = datetime.now(timezone.utc) - timedelta(seconds=max(60, int(timeout_seconds)))
+        result = json.dumps(
+            {"success": False, "error": "兑换任务超时，请稍后重试", "code": "SYSTEM_ERROR"},
+            ensure_ascii=False,
+        )
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE redemption_jobs
+                SET status = 'failed', result = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND started_at <= ?
+            """,
+                (result, threshold.strftime("%Y-%m-%d %H:%M:%S")),
+            )
+            return cursor.rowcount or 0
 
     # ==================== Team统计管理 ====================
 
@@ -1213,6 +2164,7 @@ class Database:
                     available_seats,
                 ),
             )
+        self._invalidate_team_stats()
 
     def get_team_stats(self, team_name: str) -> Optional[Dict[str, Any]]:
         """获取Team统计信息"""
@@ -1238,6 +2190,137 @@ class Database:
             )
             return [dict(row) for row in cursor.fetchall()]
 
+    def list_team_table(self) -> List[Dict[str, Any]]:
+        """
+        管理后台 Team 表格数据（一次查询）：teams_stats 全部字段 + 每个 team_name 最早生成兑换码的时间。
+        只有兑换码、没有统计行的 team_name 也会返回（统计字段为 NULL）。
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                WITH first_codes AS (
+                    SELECT team_name, MIN(created_at) AS first_code_at
+                    FROM redemption_codes
+                    GROUP BY team_name
+                ),
+                names AS (
+                    SELECT team_name FROM teams_stats
+                    UNION
+                    SELECT team_name FROM first_codes
+                )
+                SELECT n.team_name AS row_team_name, ts.*, fc.first_code_at
+                FROM names n
+                LEFT JOIN teams_stats ts ON ts.team_name = n.team_name
+                LEFT JOIN first_codes fc ON fc.team_name = n.team_name
+                ORDER BY n.team_name
+            """
+            )
+            rows = []
+            for row in cursor.fetchall():
+                item = dict(row)
+                item["team_name"] = item.pop("row_team_name")
+                rows.append(item)
+            return rows
+
+    def list_team_health(self) -> List[Dict[str, Any]]:
+        """各 Team 的 Token 检测状态（team_status_checker 写入）"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT team_name, is_active, status_error, last_checked_at FROM teams_stats")
+            return [dict(row) for row in cursor.fetchall()]
+
+    def team_stats_version(self) -> int:
+        """Team 统计版本号（跨 worker 共享）"""
+        return self._team_stats_versions.get(1)
+
+    def _invalidate_team_stats(self):
+        """teams_stats 写入后调用（需在事务提交之后）"""
+        try:
+            self._team_stats_versions.bump(1)
+        except Exception as e:
+            log.warning(f"Team 统计缓存失效失败: {e}")
+
+    # ==================== 变更事件 ====================
+
+    @staticmethod
+    def _insert_event(cursor, kind: str, payload: Dict[str, Any]):
+        """在调用方事务中写入一条变更事件（与业务数据同时提交）"""
+        cursor.execute(
+            "INSERT INTO app_events (kind, payload) VALUES (?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False, default=str)),
+        )
+
+    @staticmethod
+    def _insert_redemption_events(cursor, redemption_ids: List[int]):
+        """兑换记录进入最终状态（success/failed）时写入事件"""
+        if not redemption_ids:
+            return
+        cursor.executemany(
+            """
+            INSERT INTO app_events (kind, payload)
+            SELECT 'redemption', json_object(
+                'id', r.id, 'email', r.email, 'team_name', r.team_name,
+                'status', r.invite_status, 'code', rc.code
+            )
+            FROM redemptions r
+            LEFT JOIN redemption_codes rc ON rc.id = r.code_id
+            WHERE r.id = ?
+        """,
+            [(rid,) for rid in redemption_ids],
+        )
+
+    def _notify_events(self):
+        """事件写入后调用（需在事务提交之后），通知各进程的推送线程"""
+        try:
+            self._event_versions.bump(1)
+        except Exception as e:
+            log.warning(f"事件版本号更新失败: {e}")
+
+    def append_event(self, kind: str, payload: Dict[str, Any]) -> int:
+        """单独写入一条变更事件，返回事件 ID"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._insert_event(cursor, kind, payload)
+            event_id = cursor.lastrowid
+        self._notify_events()
+        return event_id
+
+    def events_version(self) -> int:
+        """事件版本号（同一主机上的进程共享）"""
+        return self._event_versions.get(1)
+
+    def get_last_event_id(self) -> int:
+        with self.get_connection() as conn:
+            row = conn.execute("SELECT MAX(id) AS max_id FROM app_events").fetchone()
+            return int(row["max_id"] or 0)
+
+    def list_events_after(self, last_id: int, *, limit: int = 200) -> List[Dict[str, Any]]:
+        """按 ID 顺序返回 last_id 之后的事件（payload 已解析）"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "SELECT id, kind, payload, created_at FROM app_events WHERE id > ? ORDER BY id LIMIT ?",
+                (int(last_id), int(limit)),
+            )
+            events = []
+            for row in cursor.fetchall():
+                item = dict(row)
+                try:
+                    item["payload"] = json.loads(item["payload"]) if item["payload"] else {}
+                except ValueError:
+                    item["payload"] = {}
+                events.append(item)
+            return events
+
+    def prune_events(self, *, keep_seconds: int = 86400) -> int:
+        """清理过期事件，返回删除数量"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM app_events WHERE created_at < datetime('now', ?)",
+                (f"-{int(keep_seconds)} seconds",),
+            )
+            return cursor.rowcount
+
     # ==================== 统计查询 ====================
 
     def get_dashboard_stats(self) -> Dict[str, Any]:
@@ -1336,6 +2419,7 @@ class Database:
                 SET created_at = ?, created_at_source = ?
                 WHERE team_name = ?
             """, (created_at, source, team_name))
+        self._invalidate_team_stats()
 
     def get_team_created_at(self, team_name: str) -> Optional[Dict[str, Any]]:
         """获取 Team 创建时间"""
@@ -1386,6 +2470,8 @@ class Database:
             last_checked_at = datetime.now()
 
         with self.get_connection() as conn:
+            row = conn.execute("SELECT is_active FROM teams_stats WHERE team_name = ?", (team_name,)).fetchone()
+            previous = None if row is None or row["is_active"] is None else bool(row["is_active"])
             conn.execute("""
                 INSERT INTO teams_stats (team_name, is_active, status_error, last_checked_at)
                 VALUES (?, ?, ?, ?)
@@ -1402,6 +2488,17 @@ class Database:
                 status_error,
                 last_checked_at.isoformat() if isinstance(last_checked_at, datetime) else last_checked_at
             ))
+            # 状态切换时才推送事件（定期检测结果不变不产生事件）
+            changed = previous is None or previous != bool(is_active)
+            if changed:
+                self._insert_event(
+                    conn.cursor(),
+                    "team_status",
+                    {"team_name": team_name, "is_active": bool(is_active), "status_error": status_error},
+                )
+        self._invalidate_team_stats()
+        if changed:
+            self._notify_events()
 
     def get_team_status(self, team_name: str) -> Optional[Dict[str, Any]]:
         """获取 Team 状态"""
@@ -1612,6 +2709,196 @@ class Database:
             cursor.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
 
+    # ==================== 流式导出 ====================
+
+    @staticmethod
+    def _export_filters(
+        *,
+        team_column: str | None = None,
+        team_names: Optional[List[str]] = None,
+        status_column: str | None = None,
+        status: Optional[str] = None,
+        date_column: str | None = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> tuple[list[str], list[Any]]:
+        """构建导出通用筛选条件（Team / 状态 / 日期范围）"""
+        where: list[str] = []
+        params: list[Any] = []
+        names = [n for n in (team_names or []) if n]
+        if team_column and names:
+            where.append(f"{team_column} IN ({','.join('?' * len(names))})")
+            params.extend(names)
+        if status_column and status:
+            where.append(f"{status_column} = ?")
+            params.append(status)
+        if date_column and since:
+            # 库中同时存在 "YYYY-MM-DD HH:MM:SS" 和 ISO "T" 分隔两种格式，统一为空格后比较
+            where.append(f"replace({date_column}, 'T', ' ') >= ?")
+            params.append(since.replace("T", " "))
+        if date_column and until:
+            if len(until) == 10:
+                # 只给日期时包含当天
+                where.append(f"replace({date_column}, 'T', ' ') < date(?, '+1 day')")
+                params.append(until)
+            else:
+                where.append(f"replace({date_column}, 'T', ' ') <= ?")
+                params.append(until.replace("T", " "))
+        return where, params
+
+    def _iter_by_id(
+        self,
+        select_sql: str,
+        where: list[str],
+        params: list[Any],
+        *,
+        id_column: str = "id",
+        batch_size: int = 500,
+    ):
+        """按主键分页迭代：每页一条短查询（fetchmany 取一页），导出期间不长时间持有读锁，内存只占一页"""
+        batch_size = max(1, int(batch_size))
+        last_id = 0
+        while True:
+            conditions = where + [f"{id_column} > ?"]
+            with self.get_connection() as conn:
+                cursor = conn.execute(
+                    f"{select_sql} WHERE {' AND '.join(conditions)} ORDER BY {id_column} LIMIT ?",
+                    [*params, last_id, batch_size],
+                )
+                rows = [dict(row) for row in cursor.fetchmany(batch_size)]
+            if not rows:
+                return
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]["id"]
+
+    def iter_codes_for_export(
+        self,
+        *,
+        team_names: Optional[List[str]] = None,
+        group_name: Optional[str] = None,
+        status: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        batch_size: int = 500,
+    ):
+        """流式迭代兑换码（group_name 为 "" 表示未分组；未指定状态时不含已删除）"""
+        where, params = self._export_filters(
+            team_column="team_name",
+            team_names=team_names,
+            status_column="status",
+            status=status,
+            date_column="created_at",
+            since=since,
+            until=until,
+        )
+        if not status:
+            where.append("status != 'deleted'")
+        if group_name is not None:
+            if group_name == "":
+                where.append("(group_name IS NULL OR group_name = '')")
+            else:
+                where.append("group_name = ?")
+                params.append(group_name)
+        return self._iter_by_id("SELECT * FROM redemption_codes", where, params, batch_size=batch_size)
+
+    def iter_redemptions_for_export(
+        self,
+        *,
+        team_names: Optional[List[str]] = None,
+        group_name: Optional[str] = None,
+        status: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        batch_size: int = 500,
+    ):
+        """流式迭代兑换记录（status 对应 invite_status，日期按 redeemed_at 筛选）"""
+        where, params = self._export_filters(
+            team_column="r.team_name",
+            team_names=team_names,
+            status_column="r.invite_status",
+            status=status,
+            date_column="r.redeemed_at",
+            since=since,
+            until=until,
+        )
+        if group_name is not None:
+            if group_name == "":
+                where.append("(rc.group_name IS NULL OR rc.group_name = '')")
+            else:
+                where.append("rc.group_name = ?")
+                params.append(group_name)
+        return self._iter_by_id(
+            """
+            SELECT r.*, rc.code, rc.group_name
+            FROM redemptions r
+            LEFT JOIN redemption_codes rc ON r.code_id = rc.id
+            """,
+            where,
+            params,
+            id_column="r.id",
+            batch_size=batch_size,
+        )
+
+    def iter_member_leases_for_export(
+        self,
+        *,
+        team_names: Optional[List[str]] = None,
+        status: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        batch_size: int = 500,
+    ):
+        """流式迭代成员租约（日期按 created_at 筛选）"""
+        where, params = self._export_filters(
+            team_column="team_name",
+            team_names=team_names,
+            status_column="status",
+            status=status,
+            date_column="created_at",
+            since=since,
+            until=until,
+        )
+        return self._iter_by_id("SELECT * FROM member_leases", where, params, batch_size=batch_size)
+
+    def iter_member_lease_events_for_export(
+        self,
+        *,
+        team_names: Optional[List[str]] = None,
+        status: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        batch_size: int = 500,
+    ):
+        """流式迭代租约事件（Team 匹配转出或转入方，status 对应 action）"""
+        where, params = self._export_filters(
+            status_column="action",
+            status=status,
+            date_column="created_at",
+            since=since,
+            until=until,
+        )
+        names = [n for n in (team_names or []) if n]
+        if names:
+            placeholders = ",".join("?" * len(names))
+            where.append(f"(from_team IN ({placeholders}) OR to_team IN ({placeholders}))")
+            params.extend(names + names)
+        return self._iter_by_id("SELECT * FROM member_lease_events", where, params, batch_size=batch_size)
+
+    def get_codes_by_list(self, codes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量查询兑换码，返回 {code: 记录}（按 500 个一批查询，避免超出 SQLite 参数上限）"""
+        result: Dict[str, Dict[str, Any]] = {}
+        codes = [c for c in codes if c]
+        with self.get_connection() as conn:
+            for start in range(0, len(codes), 500):
+                chunk = codes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor = conn.execute(f"SELECT * FROM redemption_codes WHERE code IN ({placeholders})", chunk)
+                for row in cursor.fetchall():
+                    result[row["code"]] = dict(row)
+        return result
+
 
 # 单例实例
 db = Database()
@@ -0,0 +1,191 @@
+"""
+延迟任务队列模块
+替代"每个任务一个 sleep 线程"的做法：任务持久化在 SQLite（delayed_tasks 表），
+每个进程只有一个调度线程（最小堆 + 条件变量按最近到期时间唤醒），到期任务交给有界线程池执行
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from database import db
+from logger import log
+import metrics
+
+
+# handler(payload) -> bool：返回 True 表示完成，False 表示稍后重试
+TaskHandler = Callable[[Dict[str, Any]], bool]
+
+
+class DelayQueue:
+    """延迟任务调度器（每个进程一个实例，多进程通过数据库领取任务互不重复）"""
+
+    def __init__(self):
+        self._handlers: Dict[str, TaskHandler] = {}
+        self._heap: List[float] = []
+        self._cond = threading.Condition()
+        self._executor: ThreadPoolExecutor | None = None
+        self._slots: threading.Semaphore | None = None
+        self._worker_started = False
+        self._lock_by = uuid.uuid4().hex
+
+    def register(self, kind: str, handler: TaskHandler):
+        """注册任务处理函数"""
+        self._handlers[kind] = handler
+
+    def schedule(
+        self,
+        kind: str,
+        key: str,
+        *,
+        delay_seconds: int = 0,
+        payload: Optional[Dict[str, Any]] = None,
+        retry_interval: int = 180,
+        max_attempts: int = 1,
+    ) -> bool:
+        """
+        登记延迟任务（同一 kind+key 的待执行任务会合并）
+
+        Args:
+            kind: 任务类型（对应 register 的处理函数）
+            key: 去重键（如邮箱）
+            delay_seconds: 首次执行延迟（秒）
+            payload: 传给处理函数的参数
+            retry_interval: 失败后重试间隔（秒）
+            max_attempts: 最多执行次数
+
+        Returns:
+            是否新建了任务（False 表示与已有任务合并）
+        """
+        run_at = datetime.now() + timedelta(seconds=max(0, int(delay_seconds)))
+        created = db.schedule_delayed_task(
+            kind=kind,
+            task_key=key,
+            run_at=run_at,
+            payload=json.dumps(payload or {}, ensure_ascii=False),
+            retry_interval=retry_interval,
+            max_attempts=max_attempts,
+        )
+        self._wake_at(time.time() + max(0, int(delay_seconds)))
+        return created
+
+    def _wake_at(self, ts: float):
+        """记录本进程内的最近唤醒时间（其他进程登记的任务靠轮询发现）"""
+        with self._cond:
+            heapq.heappush(self._heap, ts)
+            self._cond.notify()
+
+    def _run(self, task: Dict[str, Any]):
+        """执行单个任务并写回结果"""
+        success, error = False, None
+        try:
+            handler = self._handlers.get(task["kind"])
+            if handler is None:
+                error = f"未注册的任务类型: {task['kind']}"
+            else:
+                payload = json.loads(task.get("payload") or "{}")
+                success = bool(handler(payload))
+                if not success:
+                    error = "任务未完成，等待重试"
+        except Exception as e:
+            error = str(e)
+            log.warning(f"延迟任务 {task['kind']}:{task['task_key']} 执行出错: {e}")
+        finally:
+            try:
+                db.finish_delayed_task(task["id"], lock_by=self._lock_by, success=success, error=error)
+            except Exception as e:
+                log.warning(f"写回延迟任务结果失败: {e}")
+            # 释放线程后立即唤醒调度线程领取排队中的任务（重试时间由数据库排期决定）
+            self._slots.release()
+            self._wake_at(time.time())
+
+    def _dispatch_due(self):
+        """按空闲线程数领取到期任务并提交到线程池"""
+        free = 0
+        while self._slots.acquire(blocking=False):
+            free += 1
+        if free == 0:
+            return
+        try:
+            tasks = db.claim_due_delayed_tasks(lock_by=self._lock_by, limit=free)
+        except Exception:
+            for _ in range(free):
+                self._slots.release()
+            raise
+        for _ in range(free - len(tasks)):
+            self._slots.release()
+        for task in tasks:
+            self._executor.submit(self._run, task)
+
+    def start_worker(self, *, max_workers: int = 4, poll_interval: int = 30):
+        """启动调度线程
+
+        Args:
+            max_workers: 同时执行的任务数
+            poll_interval: 兜底轮询间隔（秒），用于发现其他进程登记或遗留的任务
+        """
+        with self._cond:
+            if self._worker_started:
+                return
+            self._worker_started = True
+            max_workers = max(1, int(max_workers))
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="delay-task")
+            self._slots = threading.Semaphore(max_workers)
+
+        def _scheduler():
+            log.info(f"延迟任务队列已启动（并发 {max_workers}）", icon="start")
+            last_purge = 0.0
+            while True:
+                try:
+                    with metrics.track_loop("delay_queue"):
+                        self._dispatch_due()
+
+                    if time.time() - last_purge > 3600:
+                        db.purge_delayed_tasks(older_than_days=7)
+                        last_purge = time.time()
+
+                    # 下一次唤醒：本进程堆顶 / 数据库中最早的待执行任务 / 兜底轮询，取最早者
+                    now = time.time()
+                    wake = now + poll_interval
+                    next_run = db.next_delayed_task_run_at()
+                    if next_run is not None:
+                        # 已到期但暂未领取（线程已满/被其他进程领取）时至少间隔 1 秒再查
+                        wake = min(wake, max(next_run.timestamp(), now + 1))
+                except Exception as e:
+                    log.warning(f"延迟任务调度出错: {e}")
+                    wake = time.time() + poll_interval
+
+                with self._cond:
+                    # 堆中已到期的唤醒点说明期间有新任务/空出线程，直接进入下一轮
+                    woken = False
+                    while self._heap and self._heap[0] <= time.time():
+                        heapq.heappop(self._heap)
+                        woken = True
+                    if woken:
+                        continue
+                    if self._heap:
+                        wake = min(wake, self._heap[0])
+                    timeout = wake - time.time()
+                    if timeout > 0:
+                        self._cond.wait(timeout=timeout)
+
+        thread = threading.Thread(target=_scheduler, daemon=True, name="DelayQueueScheduler")
+        thread.start()
+
+
+# 全局实例
+delay_queue = DelayQueue()
+
+
+def start_delay_queue():
+    """启动延迟任务调度线程（并发数通过 DELAY_QUEUE_WORKERS 配置）"""
+    max_workers = int(os.getenv("DELAY_QUEUE_WORKERS", "4") or 4)
+    delay_queue.start_worker(max_workers=max_workers)
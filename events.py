@@ -0,0 +1,207 @@
+"""
+管理后台变更事件推送（Server-Sent Events）
+写路径在同一事务中把事件写入 app_events 表（兑换完成、租约变化、告警、Team 状态切换），
+每个进程一个轮询线程按 ID 顺序读取新事件并分发给本进程的 SSE 连接；
+共享版本号未变化时跳过数据库查询，浏览器断线重连时通过 Last-Event-ID 补齐。
+
+gunicorn sync worker 每个请求独占一个 worker：此时 SSE 连接只返回积压事件后立即结束，
+由浏览器按 retry 间隔重连（一次主键范围查询）；gthread / gevent 等支持并发的 worker 保持长连接。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Iterator, Optional
+
+from database import db
+from logger import log
+
+
+# 单次最多补发的积压事件数
+BACKLOG_LIMIT = 500
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+def format_event(event: dict) -> str:
+    """格式化为 SSE 消息"""
+    data = json.dumps(event.get("payload") or {}, ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event['kind']}\ndata: {data}\n\n"
+
+
+def concurrent_worker(environ: dict) -> bool:
+    """当前 worker 能否同时处理多个请求（gthread / gevent）；sync worker 下长时间占用请求会阻塞整个进程"""
+    if environ.get("wsgi.multithread"):
+        return True
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("socket")
+
+
+def stream_hold_seconds(environ: dict, *, env: str = "ADMIN_EVENTS_HOLD_SECONDS", default: int = 300) -> int:
+    """SSE 长连接保持时间：环境变量 env 优先，否则按 worker 类型判断（sync worker 为 0，否则为 default）"""
+    raw = (os.getenv(env) or "").strip()
+    if raw:
+        try:
+            return max(0, int(raw))
+        except ValueError:
+            pass
+    return default if concurrent_worker(environ) else 0
+
+
+class EventBroker:
+    """进程内事件分发（每个进程一个实例，有订阅者时才启动轮询线程）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: set[queue.Queue] = set()
+        self._last_id: Optional[int] = None
+        self._version: Optional[int] = None
+        self._last_query = 0.0
+        self._last_prune = 0.0
+        self._worker_started = False
+
+    def subscribe(self) -> queue.Queue:
+        """订阅之后写入的事件（订阅前的事件由调用方按 ID 补查）"""
+        self._start_worker()
+        q: queue.Queue = queue.Queue(maxsize=1000)
+        with self._lock:
+            if self._last_id is None:
+                self._last_id = db.get_last_event_id()
+                self._version = db.events_version()
+                self._last_query = time.monotonic()
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def poll_once(self, *, force: bool = False) -> int:
+        """读取新事件并分发，返回分发数量"""
+        # 先读版本号再查询：查询之后提交的事件一定会让下一轮看到新版本号
+        version = db.events_version()
+        now = time.monotonic()
+        if self._last_id is None:
+            return 0
+        # 版本号只在同一主机的进程间共享，定期兜底查询一次
+        if not force and version == self._version and now - self._last_query < 30:
+            return 0
+        self._version = version
+        self._last_query = now
+
+        dispatched = 0
+        while True:
+            events = db.list_events_after(self._last_id, limit=200)
+            if not events:
+                break
+            self._last_id = events[-1]["id"]
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for event in events:
+                for q in subscribers:
+                    try:
+                        q.put_nowait(event)
+                    except queue.Full:
+                        pass  # 客户端太慢：丢弃，重连后按 Last-Event-ID 补齐
+            dispatched += len(events)
+            if len(events) < 200:
+                break
+        return dispatched
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < 600:
+            return
+        self._last_prune = now
+        deleted = db.prune_events(keep_seconds=_env_int("ADMIN_EVENTS_RETENTION_SECONDS", 86400))
+        if deleted:
+            log.debug(f"已清理 {deleted} 条过期事件")
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker_started:
+                return
+            self._worker_started = True
+        interval = max(0.2, _env_int("ADMIN_EVENTS_POLL_MS", 1000) / 1000)
+
+        def _loop():
+            while True:
+                try:
+                    with self._lock:
+                        idle = not self._subscribers
+                        if idle:
+                            # 无订阅者时不查询，下次订阅时从当时的位置开始
+                            self._last_id = None
+                    if not idle:
+                        self.poll_once()
+                        self._prune()
+                except Exception as e:
+                    log.warning(f"事件推送轮询失败: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=_loop, daemon=True, name="EventBroker")
+        thread.start()
+
+
+# 全局实例
+event_broker = EventBroker()
+
+
+def iter_event_stream(last_event_id: Optional[int], *, hold_seconds: int) -> Iterator[str]:
+    """
+    生成 SSE 响应内容
+
+    Args:
+        last_event_id: 浏览器重连时的 Last-Event-ID（None 表示新连接，从当前位置开始）
+        hold_seconds: 长连接保持时间，0 表示只补发积压事件后结束
+    """
+    retry_ms = _env_int("ADMIN_EVENTS_RETRY_MS", 5000 if hold_seconds <= 0 else 3000)
+    yield f"retry: {retry_ms}\n\n"
+
+    # 先订阅再补查积压，两者之间写入的事件按 ID 去重
+    q = event_broker.subscribe() if hold_seconds > 0 else None
+    try:
+        if last_event_id is None:
+            # 新连接：下发当前位置作为游标，之后的重连只补发新事件
+            cursor = db.get_last_event_id()
+            yield format_event({"id": cursor, "kind": "ready", "payload": {}})
+        else:
+            cursor = last_event_id
+        backlog = db.list_events_after(cursor, limit=BACKLOG_LIMIT)
+        for event in backlog:
+            yield format_event(event)
+        if backlog:
+            cursor = backlog[-1]["id"]
+        if len(backlog) >= BACKLOG_LIMIT:
+            # 积压过多：通知前端整体刷新
+            yield format_event({"id": cursor, "kind": "resync", "payload": {}})
+        if q is None:
+            return
+
+        deadline = time.monotonic() + hold_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = q.get(timeout=min(15, remaining))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if event["id"] <= cursor:
+                continue  # 已在积压中发送过
+            cursor = event["id"]
+            yield format_event(event)
+    finally:
+        if q is not None:
+            event_broker.unsubscribe(q)
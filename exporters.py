@@ -0,0 +1,170 @@
+"""
+流式数据导出
+按主键分页读取数据库，逐块生成 CSV / NDJSON，内存占用与导出行数无关。
+
+支持的数据类型：codes（兑换码）、redemptions（兑换记录）、leases（成员租约）、events（租约事件）
+
+命令行用法:
+    python -m exporters codes --format csv --team TeamA --since 2026-01-01 -o codes.csv
+    python -m exporters redemptions --format ndjson --status success > redemptions.ndjson
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+if __name__ == "__main__":
+    # 命令行模式：stdout 只输出导出数据，日志写到 stderr（需在导入 database / logger 之前设置）
+    os.environ.setdefault("LOG_STREAM", "stderr")
+
+from database import db
+
+
+# 每个数据类型：(导出列, 迭代函数, 是否支持分组筛选)
+EXPORT_KINDS: dict[str, tuple[list[str], Callable[..., Iterable[dict]], bool]] = {
+    "codes": (
+        [
+            "id", "code", "team_name", "group_name", "max_uses", "used_count", "status",
+            "expires_at", "created_at", "auto_transfer_enabled", "notes",
+        ],
+        lambda **kw: db.iter_codes_for_export(**kw),
+        True,
+    ),
+    "redemptions": (
+        [
+            "id", "code", "email", "team_name", "group_name", "invite_status",
+            "redeemed_at", "ip_address", "error_message",
+        ],
+        lambda **kw: db.iter_redemptions_for_export(**kw),
+        True,
+    ),
+    "leases": (
+        [
+            "id", "email", "team_name", "team_account_id", "status", "created_at", "invited_at",
+            "joined_at", "expires_at", "transfer_count", "attempts", "next_attempt_at",
+            "last_error", "last_synced_at", "updated_at",
+        ],
+        lambda **kw: db.iter_member_leases_for_export(**kw),
+        False,
+    ),
+    "events": (
+        ["id", "email", "from_team", "to_team", "action", "message", "created_at"],
+        lambda **kw: db.iter_member_lease_events_for_export(**kw),
+        False,
+    ),
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+# 每累计多少行输出一个数据块
+CHUNK_ROWS = 200
+
+
+def export_rows(
+    kind: str,
+    *,
+    team_names: Optional[list[str]] = None,
+    group_name: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+) -> tuple[list[str], Iterable[dict]]:
+    """返回 (导出列, 行迭代器)；参数不合法时抛出 ValueError"""
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"不支持的导出类型: {kind}（可选: {', '.join(EXPORT_KINDS)}）")
+    columns, fetch, supports_group = EXPORT_KINDS[kind]
+    kwargs: dict[str, Any] = {"team_names": team_names, "status": status, "since": since, "until": until}
+    if group_name is not None:
+        if not supports_group:
+            raise ValueError(f"{kind} 不支持按分组筛选")
+        kwargs["group_name"] = group_name
+    return columns, fetch(**kwargs)
+
+
+def iter_csv(columns: list[str], rows: Iterable[dict]) -> Iterator[str]:
+    """逐块生成 CSV 文本（首块为表头）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow(["" if row.get(col) is None else row.get(col) for col in columns])
+        pending += 1
+        if pending >= CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    tail = buffer.getvalue()
+    if tail:
+        yield tail
+
+
+def iter_ndjson(columns: list[str], rows: Iterable[dict]) -> Iterator[str]:
+    """逐块生成 NDJSON 文本（每行一个 JSON 对象）"""
+    lines: list[str] = []
+    for row in rows:
+        lines.append(json.dumps({col: row.get(col) for col in columns}, ensure_ascii=False, default=str))
+        if len(lines) >= CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def iter_export(kind: str, fmt: str, **filters) -> Iterator[str]:
+    """按格式生成导出内容；参数在调用时立即校验（ValueError），数据在迭代时才读取"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}（可选: {', '.join(EXPORT_FORMATS)}）")
+    columns, rows = export_rows(kind, **filters)
+    return iter_csv(columns, rows) if fmt == "csv" else iter_ndjson(columns, rows)
+
+
+def write_export(fp, kind: str, fmt: str, **filters) -> None:
+    """导出到文件对象"""
+    for chunk in iter_export(kind, fmt, **filters):
+        fp.write(chunk)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="流式导出兑换码 / 兑换记录 / 成员租约 / 租约事件")
+    parser.add_argument("kind", choices=list(EXPORT_KINDS), help="导出数据类型")
+    parser.add_argument("--format", "-f", dest="fmt", choices=list(EXPORT_FORMATS), default="csv", help="导出格式 (默认: csv)")
+    parser.add_argument("--team", "-t", action="append", help="按 Team 名称筛选（可重复）")
+    parser.add_argument("--group", "-g", help="按分组筛选（传空字符串表示未分组，仅 codes/redemptions）")
+    parser.add_argument("--status", "-s", help="按状态筛选（redemptions 为 invite_status，events 为 action）")
+    parser.add_argument("--since", help="起始时间（含），如 2026-01-01 或 2026-01-01T08:00:00")
+    parser.add_argument("--until", help="结束时间（含，只给日期时包含当天）")
+    parser.add_argument("--output", "-o", help="输出文件路径（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    filters = {
+        "team_names": args.team,
+        "group_name": args.group,
+        "status": args.status,
+        "since": args.since,
+        "until": args.until,
+    }
+    try:
+        if args.output:
+            with open(args.output, "w", newline="", encoding="utf-8") as f:
+                write_export(f, args.kind, args.fmt, **filters)
+            print(f"✅ 已导出到: {args.output}", file=sys.stderr)
+        else:
+            write_export(sys.stdout, args.kind, args.fmt, **filters)
+    except ValueError as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
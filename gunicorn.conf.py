@@ -0,0 +1,52 @@
+"""
+Gunicorn 配置（环境变量控制，适配 Docker / Zeabur 等平台）:
+
+    gunicorn -c gunicorn.conf.py web_server:app
+
+GUNICORN_WORKER_CLASS:
+  - sync（默认）：每个请求独占一个 worker，请求 chatgpt.com 期间 worker 无法处理其他请求
+  - gthread：每个 worker GUNICORN_THREADS 个线程
+  - gevent：协作式 worker，上游请求等待期间让出，一个进程可同时挂起数百个上游请求
+    （GUNICORN_WORKER_CONNECTIONS 控制单进程并发连接数，需安装 gevent）
+
+注意：gevent 模式下 SQLite 调用仍是阻塞的（一般为毫秒级），锁等待会短暂阻塞整个 worker。
+"""
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = max(1, _env_int("GUNICORN_WORKERS", 2))
+timeout = _env_int("GUNICORN_TIMEOUT", 120)
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 0)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", 0)
+accesslog = "-"
+errorlog = "-"
+
+worker_class = (os.getenv("GUNICORN_WORKER_CLASS") or "sync").strip().lower()
+threads = max(1, _env_int("GUNICORN_THREADS", 1))
+worker_connections = max(10, _env_int("GUNICORN_WORKER_CONNECTIONS", 500))
+
+if worker_class == "gevent":
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        # 未安装 gevent：退回线程模式，仍可并发处理上游请求
+        print("⚠️ GUNICORN_WORKER_CLASS=gevent 但未安装 gevent（pip install gevent），改用 gthread", flush=True)
+        worker_class = "gthread"
+        threads = max(threads, 16)
+
+# 上游连接池大小与单进程并发上限对齐（team_service 读取），避免并发请求时连接池被反复丢弃重建
+if worker_class == "gevent":
+    os.environ.setdefault("UPSTREAM_POOL_MAXSIZE", str(worker_connections))
+elif worker_class == "gthread":
+    os.environ.setdefault("UPSTREAM_POOL_MAXSIZE", str(max(10, threads)))
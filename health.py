@@ -0,0 +1,286 @@
+"""
+深度健康检查
+后台探测线程定期检查各组件并把结果写入快照文件（DATA_DIR/health.json，原子替换），
+/health/deep 只读取快照（按 mtime 缓存），请求本身不访问数据库和上游，开销与 /health 相同。
+
+同一主机上的多个进程通过文件锁选出一个探测者，其余进程只读快照；探测进程退出后由其他进程接替。
+
+检查项:
+  - database：一次写事务的耗时（锁等待、磁盘慢都会体现在这里）
+  - background：各后台任务最近一次成功时间（来自 metrics 快照）和后台任务主节点租约
+  - teams：各 Team 的 Token 检测状态（相当于每个 Team 的熔断状态：不可用的 Team 不再分配兑换）
+  - upstream：chatgpt.com 是否可达（任何 HTTP 响应都视为可达）
+
+总体状态：ok / degraded / down，down 时 /health/deep 返回 503。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 等平台没有 fcntl：每个进程各自探测
+    fcntl = None
+
+import requests
+
+import config
+import metrics
+from config import env_bool
+from database import db
+from logger import log
+
+
+SNAPSHOT_FILE = Path(config.DATA_DIR) / "health.json"
+LOCK_FILE = Path(config.DATA_DIR) / "health.lock"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+def _background_loops() -> Dict[str, float]:
+    """已启用的后台任务及其执行间隔（秒），与 worker.start_background_jobs 保持一致"""
+    loops = {
+        "delay_queue": 30.0,
+        "redemption_jobs": 5.0,
+    }
+    if env_bool("AUTO_TRANSFER_ENABLED", False):
+        loops["auto_transfer"] = max(30.0, _env_float("AUTO_TRANSFER_POLL_SECONDS", 300))
+    if env_bool("MONITOR_ENABLED", True):
+        loops["monitor"] = _env_float("MONITOR_INTERVAL", 300)
+    if env_bool("TEAM_STATUS_CHECK_ENABLED", True):
+        loops["team_status"] = _env_float("TEAM_STATUS_CHECK_INTERVAL", 10800)
+    if env_bool("ABNORMAL_TRANSFER_CHECK_ENABLED", True):
+        loops["abnormal_transfer"] = _env_float("ABNORMAL_TRANSFER_CHECK_INTERVAL", 1800)
+    return loops
+
+
+def _worst(*statuses: str) -> str:
+    order = {"ok": 0, "unknown": 0, "degraded": 1, "down": 2}
+    return max(statuses, key=lambda s: order.get(s, 0)) if statuses else "ok"
+
+
+class HealthProber:
+    """组件探测（每个进程一个实例，同一主机只有持有文件锁的进程执行探测）"""
+
+    def __init__(self):
+        self.interval = max(5.0, _env_float("HEALTH_PROBE_INTERVAL", 15))
+        self.upstream_interval = max(self.interval, _env_float("HEALTH_UPSTREAM_INTERVAL", 60))
+        self.upstream_url = os.getenv("HEALTH_UPSTREAM_URL", "https://chatgpt.com/")
+        self.db_slow_ms = _env_float("HEALTH_DB_SLOW_MS", 500)
+        self._lock = threading.Lock()
+        self._worker_started = False
+        self._lock_fd: Optional[int] = None
+        self._upstream: Dict[str, Any] = {"status": "unknown"}
+        self._upstream_checked = 0.0
+        # 快照缓存：(mtime, 内容)
+        self._cached: tuple[float, Optional[dict]] = (0.0, None)
+        self._local: Optional[dict] = None
+
+    # ==================== 探测 ====================
+
+    def probe_database(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            db.bump_generation("health_probe")
+        except Exception as e:
+            return {"status": "down", "error": str(e), "write_ms": round((time.perf_counter() - start) * 1000, 1)}
+        write_ms = round((time.perf_counter() - start) * 1000, 1)
+        return {"status": "degraded" if write_ms > self.db_slow_ms else "ok", "write_ms": write_ms}
+
+    def probe_background(self) -> Dict[str, Any]:
+        now = time.time()
+        try:
+            last_success = metrics.loop_last_success()
+        except Exception as e:
+            log.debug(f"读取后台任务指标失败: {e}")
+            last_success = {}
+
+        loops = {}
+        for name, interval in _background_loops().items():
+            last = last_success.get(name)
+            if last is None:
+                # 尚未完成过一轮（刚启动 / 首轮延迟执行 / 未开启指标）
+                loops[name] = {"status": "unknown", "interval": interval}
+                continue
+            age = now - last
+            # 超过 3 个周期（至少 5 分钟）没有成功视为卡住
+            stuck = age > max(3 * interval, 300)
+            loops[name] = {
+                "status": "degraded" if stuck else "ok",
+                "interval": interval,
+                "last_success_at": datetime.fromtimestamp(last).isoformat(timespec="seconds"),
+                "age_seconds": round(age),
+            }
+
+        leader = None
+        try:
+            from leader_election import background_leader
+
+            row = db.get_lock(background_leader.name)
+            until = row.get("locked_until") if row else None
+            if until and until > datetime.now().isoformat(sep=" ", timespec="seconds"):
+                leader = {"holder": row.get("locked_by"), "lease_until": until}
+        except Exception as e:
+            log.debug(f"读取后台任务主节点失败: {e}")
+
+        statuses = [item["status"] for item in loops.values()]
+        if leader is None:
+            statuses.append("degraded")
+        return {"status": _worst(*statuses), "leader": leader, "loops": loops}
+
+    def probe_teams(self) -> Dict[str, Any]:
+        configured = {t.get("name") for t in config.TEAMS if t.get("name")}
+        rows = {row["team_name"]: row for row in db.list_team_health() if row.get("team_name") in configured}
+        teams = {}
+        for name in sorted(configured):
+            row = rows.get(name) or {}
+            active = row.get("is_active")
+            teams[name] = {
+                "state": "unknown" if active is None else ("closed" if active else "open"),
+                "error": row.get("status_error"),
+                "last_checked_at": row.get("last_checked_at"),
+            }
+        available = sum(1 for t in teams.values() if t["state"] != "open")
+        if not teams:
+            status = "degraded"
+        elif available == 0:
+            status = "down"  # 所有 Team 都不可用，无法兑换
+        elif available < len(teams):
+            status = "degraded"
+        else:
+            status = "ok"
+        return {"status": status, "available": available, "total": len(teams), "teams": teams}
+
+    def probe_upstream(self) -> Dict[str, Any]:
+        """上游可达性（按 HEALTH_UPSTREAM_INTERVAL 单独限频，结果复用）"""
+        now = time.monotonic()
+        if self._upstream_checked and now - self._upstream_checked < self.upstream_interval:
+            return self._upstream
+        self._upstream_checked = now
+        start = time.perf_counter()
+        try:
+            response = requests.head(self.upstream_url, timeout=5, allow_redirects=False)
+            self._upstream = {
+                "status": "ok",
+                "http_status": response.status_code,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            }
+        except Exception as e:
+            self._upstream = {"status": "degraded", "error": str(e)[:200]}
+        self._upstream["checked_at"] = datetime.now().isoformat(timespec="seconds")
+        return self._upstream
+
+    def run_once(self) -> dict:
+        """执行一轮探测并写入快照"""
+        components = {}
+        for name, probe in (
+            ("database", self.probe_database),
+            ("background", self.probe_background),
+            ("teams", self.probe_teams),
+            ("upstream", self.probe_upstream),
+        ):
+            try:
+                components[name] = probe()
+            except Exception as e:
+                components[name] = {"status": "down" if name == "database" else "degraded", "error": str(e)}
+        snapshot = {
+            "status": _worst(*(c["status"] for c in components.values())),
+            "checked_at": time.time(),
+            "interval": self.interval,
+            "pid": os.getpid(),
+            "components": components,
+        }
+        self._local = snapshot
+        try:
+            tmp = SNAPSHOT_FILE.with_name(f".{SNAPSHOT_FILE.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(snapshot, ensure_ascii=False, default=str), encoding="utf-8")
+            os.replace(tmp, SNAPSHOT_FILE)
+        except OSError as e:
+            log.debug(f"写入健康检查快照失败: {e}")
+        return snapshot
+
+    # ==================== 后台线程 ====================
+
+    def _try_become_prober(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_fd is not None:
+            return True
+        try:
+            fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return True  # 无法创建锁文件：各进程各自探测
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 持有到进程退出，退出后其他进程接替
+        self._lock_fd = fd
+        log.info("当前进程负责健康检查探测", icon="start")
+        return True
+
+    def start_worker(self):
+        with self._lock:
+            if self._worker_started:
+                return
+            self._worker_started = True
+
+        def _loop():
+            while True:
+                try:
+                    if self._try_become_prober():
+                        self.run_once()
+                except Exception as e:
+                    log.warning(f"健康检查探测出错: {e}")
+                time.sleep(self.interval)
+
+        thread = threading.Thread(target=_loop, daemon=True, name="HealthProber")
+        thread.start()
+
+    # ==================== 读取 ====================
+
+    def snapshot(self) -> dict:
+        """读取最新快照（按文件 mtime 缓存），附带快照年龄；快照过旧视为探测线程卡住"""
+        data = None
+        try:
+            mtime = SNAPSHOT_FILE.stat().st_mtime
+            if mtime != self._cached[0]:
+                self._cached = (mtime, json.loads(SNAPSHOT_FILE.read_text(encoding="utf-8")))
+            data = self._cached[1]
+        except (OSError, ValueError):
+            data = self._local
+
+        if not data:
+            return {"status": "starting", "components": {}}
+        result = dict(data)
+        age = time.time() - float(data.get("checked_at") or 0)
+        result["checked_at"] = datetime.fromtimestamp(float(data.get("checked_at") or 0)).isoformat(timespec="seconds")
+        result["age_seconds"] = round(age, 1)
+        if age > max(3 * float(data.get("interval") or self.interval), 60):
+            # 探测线程本身卡住（通常是数据库长时间锁住）
+            result["status"] = "down"
+            result["stale"] = True
+        return result
+
+
+# 全局实例
+health_prober = HealthProber()
+
+
+def start_health_prober():
+    """启动健康检查探测线程（HEALTH_PROBE_ENABLED=false 时不启动，/health/deep 返回 starting）"""
+    if env_bool("HEALTH_PROBE_ENABLED", True):
+        health_prober.start_worker()
@@ -0,0 +1,202 @@
+"""
+幂等请求模块
+客户端通过 Idempotency-Key 请求头重试 /api/redeem 等慢接口时：
+  - 相同请求正在执行：等待并复用本次执行的结果（跨 worker 通过 SQLite 轮询）；
+    sync worker 下只短暂等待，仍未完成时返回 409 + Retry-After，不长时间占用 worker
+  - 已执行完成：直接返回保存的响应
+  - 同一个键用于不同的请求内容：返回 422
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, jsonify, make_response, request
+
+from database import db
+from events import concurrent_worker
+from logger import log
+
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+# 这些状态码代表"当前不可执行"而非请求结果，不缓存，允许用同一个键重试
+_UNCACHED_STATUS = {429, 503}
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+def _wait_seconds(environ: dict) -> int:
+    """重试请求等待进行中请求的时间：IDEMPOTENCY_WAIT_SECONDS 优先，否则 sync worker 为 3 秒，gthread / gevent 为 60 秒"""
+    return max(0, _int_env("IDEMPOTENCY_WAIT_SECONDS", 60 if concurrent_worker(environ) else 3))
+
+
+class IdempotencyGuard:
+    """幂等请求协调器（每个进程一个实例）"""
+
+    def __init__(self):
+        self._events: dict[tuple[str, str], threading.Event] = {}
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    @staticmethod
+    def request_hash() -> str:
+        """请求指纹：方法 + 路径 + 规范化后的 JSON 请求体"""
+        body = request.get_json(silent=True)
+        if body is None:
+            canonical = request.get_data(as_text=True) or ""
+        else:
+            canonical = json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        raw = f"{request.method} {request.path}\n{canonical}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _replay(row: dict) -> Response:
+        response = Response(
+            row.get("response_body") or "",
+            status=int(row.get("response_status") or 200),
+            mimetype=row.get("response_mimetype") or "application/json",
+        )
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    def _start(self, key: tuple[str, str]):
+        with self._lock:
+            self._events[key] = threading.Event()
+
+    def _finish(self, key: tuple[str, str]):
+        with self._lock:
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _wait(self, scope: str, idem_key: str, timeout: float) -> dict | None:
+        """等待进行中的请求完成；同进程内由事件唤醒，跨进程按间隔轮询数据库"""
+        with self._lock:
+            event = self._events.get((scope, idem_key))
+        deadline = time.monotonic() + timeout
+        while True:
+            row = db.get_idempotent_request(scope=scope, idem_key=idem_key)
+            if row is None or row["status"] == "completed":
+                return row
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return row
+            if event is not None:
+                event.wait(timeout=min(0.5, remaining))
+            else:
+                time.sleep(min(0.5, remaining))
+
+    def is_replay(self, scope: str) -> bool:
+        """当前请求是否会直接返回已保存的响应（相同幂等键、相同请求内容且已完成），供限流前判断"""
+        idem_key = (request.headers.get(IDEMPOTENCY_HEADER) or "").strip()
+        if not idem_key or len(idem_key) > 255:
+            return False
+        row = db.get_idempotent_request(scope=scope, idem_key=idem_key)
+        return bool(row and row["status"] == "completed" and row["request_hash"] == self.request_hash())
+
+    def _maybe_purge(self):
+        if time.time() - self._last_purge < 3600:
+            return
+        self._last_purge = time.time()
+        try:
+            db.purge_idempotency_keys(older_than_hours=_int_env("IDEMPOTENCY_TTL_HOURS", 24))
+        except Exception as e:
+            log.warning(f"清理幂等键失败: {e}")
+
+    def handle(self, scope: str, view, *args, **kwargs):
+        idem_key = (request.headers.get(IDEMPOTENCY_HEADER) or "").strip()
+        if not idem_key:
+            return view(*args, **kwargs)
+        if len(idem_key) > 255:
+            return jsonify({"success": False, "error": f"{IDEMPOTENCY_HEADER} 过长（最多 255 个字符）"}), 400
+
+        self._maybe_purge()
+        request_hash = self.request_hash()
+        lock_seconds = _int_env("IDEMPOTENCY_LOCK_SECONDS", 300)
+        wait_seconds = _wait_seconds(request.environ)
+
+        for _ in range(3):
+            state, row = db.begin_idempotent_request(
+                scope=scope, idem_key=idem_key, request_hash=request_hash, lock_seconds=lock_seconds
+            )
+            if state == "started":
+                return self._execute(scope, idem_key, view, *args, **kwargs)
+            if state == "mismatch":
+                return jsonify({
+                    "success": False,
+                    "error": f"{IDEMPOTENCY_HEADER} 已被用于不同的请求内容",
+                    "code": "IDEMPOTENCY_KEY_REUSED",
+                }), 422
+            if state == "completed":
+                return self._replay(row)
+
+            # 相同请求正在执行：挂靠等待其结果
+            row = self._wait(scope, idem_key, wait_seconds)
+            if row is None:
+                # 执行者放弃了（异常/不缓存的结果），重新竞争执行权
+                continue
+            if row["status"] == "completed":
+                return self._replay(row)
+            break
+
+        response = jsonify({
+            "success": False,
+            "error": "相同请求正在处理中，请稍后使用相同的幂等键重试",
+            "code": "IDEMPOTENCY_IN_PROGRESS",
+        })
+        response.headers["Retry-After"] = "5"
+        return response, 409
+
+    def _execute(self, scope: str, idem_key: str, view, *args, **kwargs):
+        key = (scope, idem_key)
+        self._start(key)
+        stored = False
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code not in _UNCACHED_STATUS and not response.is_streamed:
+                db.complete_idempotent_request(
+                    scope=scope,
+                    idem_key=idem_key,
+                    status_code=response.status_code,
+                    body=response.get_data(as_text=True),
+                    mimetype=response.mimetype,
+                )
+                stored = True
+            return response
+        finally:
+            if not stored:
+                try:
+                    db.release_idempotent_request(scope=scope, idem_key=idem_key)
+                except Exception as e:
+                    log.warning(f"释放幂等键失败: {e}")
+            self._finish(key)
+
+
+# 全局实例
+idempotency_guard = IdempotencyGuard()
+
+
+def idempotent(scope: str):
+    """幂等接口装饰器：请求带 Idempotency-Key 时启用（不带时行为不变）"""
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            return idempotency_guard.handle(scope, f, *args, **kwargs)
+
+        # 限流钩子通过该属性识别幂等接口（重放已保存的响应不计入限流）
+        decorated_function.idempotency_scope = scope
+        return decorated_function
+
+    return decorator
@@ -11,10 +11,20 @@ from typing import Optional
 import config
 from config import env_bool
 from database import db
+from delay_queue import delay_queue
 from date_utils import add_months_same_day, parse_datetime_loose
 from lease_models import LeaseAction, SyncReason
 from logger import log
-from team_service import get_invite_status_for_email, get_member_info_for_email
+from team_service import (
+    get_all_invites_debug,
+    get_team_members_debug,
+    index_invites_by_email,
+    index_members_by_email,
+)
+
+
+# 延迟队列任务类型：兑换成功后的 joined_at 同步
+JOIN_SYNC_TASK = 'join_sync'
 
 
 def _defer_join_sync_seconds(reason: SyncReason) -> int:
@@ -29,19 +39,6 @@ def _defer_join_sync_seconds(reason: SyncReason) -> int:
     return delays.get(reason, 30 * 60)
 
 
-def _defer_join_sync(*, lease: dict, message: str, reason: SyncReason):
-    '''延迟下次同步尝试'''
-    try:
-        email = (lease.get('email') or '').strip().lower()
-        if not email:
-            return
-        delay = _defer_join_sync_seconds(reason)
-        next_at = datetime.now() + timedelta(seconds=delay)
-        db.defer_member_lease_join_sync(email=email, next_attempt_at=next_at, last_error=message)
-    except Exception:
-        pass
-
-
 def _expires_at_for_new_term(now: datetime) -> datetime:
     '''计算新租期的到期时间'''
     import os
@@ -50,6 +47,90 @@ def _expires_at_for_new_term(now: datetime) -> datetime:
     return add_months_same_day(now, term_months)
 
 
+class _TeamSnapshot:
+    '''单个 Team 的 invites / members 快照（各拉取一次，members 按需拉取）'''
+
+    def __init__(self, team_cfg: dict):
+        self.team_cfg = team_cfg
+        self._invites: dict | None = None
+        self._invite_error: str | None = None
+        self._members: dict | None = None
+        self._member_error: str | None = None
+
+    def invite_for(self, email: str) -> dict:
+        '''返回结构与 get_invite_status_for_email 相同'''
+        if self._invites is None:
+            try:
+                items, err = get_all_invites_debug(self.team_cfg, max_items=500)
+            except Exception as e:
+                items, err = [], str(e)
+            self._invite_error = err if err and not items else None
+            self._invites = index_invites_by_email(items)
+        if self._invite_error:
+            return {'found': False, 'error': self._invite_error}
+        return self._invites.get(email) or {'found': False}
+
+    def member_for(self, email: str) -> dict:
+        '''返回结构与 get_member_info_for_email 相同'''
+        if self._members is None:
+            try:
+                members, err = get_team_members_debug(self.team_cfg, max_items=500)
+            except Exception as e:
+                members, err = [], str(e)
+            self._member_error = err if err and not members else None
+            self._members = index_members_by_email(members)
+        if self._member_error:
+            return {'found': False, 'error': self._member_error}
+        return self._members.get(email) or {'found': False}
+
+
+class _SyncWrites:
+    '''收集一轮同步产生的数据库写入，最后在一个事务内提交'''
+
+    def __init__(self):
+        self.joined: list[dict] = []
+        self.deferred: dict[str, dict] = {}
+        self.events: list[dict] = []
+
+    def defer(self, *, lease: dict, message: str, reason: SyncReason):
+        '''延迟下次同步尝试（同一邮箱以最后一次为准）'''
+        email = (lease.get('email') or '').strip().lower()
+        if not email:
+            return
+        delay = _defer_join_sync_seconds(reason)
+        self.deferred[email] = {
+            'email': email,
+            'next_attempt_at': datetime.now() + timedelta(seconds=delay),
+            'last_error': message,
+        }
+
+    def event(self, *, email: str, action: str, from_team: str | None, message: str):
+        self.events.append(
+            {'email': email, 'action': action, 'from_team': from_team, 'to_team': None, 'message': message}
+        )
+
+    def join(self, *, email: str, joined_at: datetime, expires_at: datetime, from_team: str | None):
+        '''标记为已加入（与 db.update_member_lease_joined 写入内容一致）'''
+        self.deferred.pop(email, None)
+        self.joined.append({'email': email, 'joined_at': joined_at, 'expires_at': expires_at})
+        self.event(
+            email=email,
+            action='joined',
+            from_team=from_team,
+            message=f"检测到加入时间：{joined_at.isoformat(sep=' ', timespec='seconds')}",
+        )
+
+    def flush(self):
+        if not self.joined and not self.deferred and not self.events:
+            return
+        db.apply_member_lease_join_sync(
+            joined=self.joined,
+            deferred=list(self.deferred.values()),
+            events=self.events,
+        )
+        self.joined, self.deferred, self.events = [], {}, []
+
+
 class JoinSyncService:
     '''加入时间同步服务'''
 
@@ -73,38 +154,52 @@ class JoinSyncService:
 
         team_name = (lease.get('team_name') or '').strip()
         team_cfg = config.resolve_team(team_name) or {}
-        if not team_cfg:
+        snapshot = _TeamSnapshot(team_cfg) if team_cfg else None
+
+        writes = _SyncWrites()
+        try:
+            return JoinSyncService._sync_lease(lease, snapshot, writes, record_events)
+        finally:
+            writes.flush()
+
+    @staticmethod
+    def _sync_lease(
+        lease: dict, snapshot: Optional[_TeamSnapshot], writes: _SyncWrites, record_events: bool
+    ) -> dict:
+        '''基于 Team 快照同步单个租约（只收集写入，不直接写库）'''
+        target = (lease.get('email') or '').strip().lower()
+        team_name = (lease.get('team_name') or '').strip()
+
+        if snapshot is None:
             if record_events:
-                db.add_member_lease_event(
+                writes.event(
                     email=target,
                     action=LeaseAction.SYNC_SKIP,
                     from_team=team_name or None,
-                    to_team=None,
                     message='Team 配置不存在，无法同步 joined_at',
                 )
             return {'checked': 1, 'synced': 0, 'reason': 'team_cfg_missing'}
 
         # 1) 优先从 invites 获取 accepted 时间
         joined_at = JoinSyncService._get_joined_at_from_invites(
-            team_cfg, target, lease, record_events
+            snapshot, target, lease, writes, record_events
         )
 
         # 2) 如果 invites 没有,从 members 兜底
         if not joined_at:
             joined_at = JoinSyncService._get_joined_at_from_members(
-                team_cfg, target, lease, team_name, record_events
+                snapshot, target, lease, team_name, writes, record_events
             )
 
         if not joined_at:
             if record_events:
-                db.add_member_lease_event(
+                writes.event(
                     email=target,
                     action=LeaseAction.SYNC_NOT_JOINED,
                     from_team=team_name,
-                    to_team=None,
                     message='未在 invites(accepted/completed) 或 members 中找到已加入证据',
                 )
-            _defer_join_sync(
+            writes.defer(
                 lease=lease,
                 message='未在 invites(accepted/completed) 或 members 中找到已加入证据',
                 reason=SyncReason.NOT_JOINED,
@@ -113,20 +208,15 @@ class JoinSyncService:
 
         # 3) 更新租约为 active 状态
         expires_at = _expires_at_for_new_term(joined_at)
-        db.update_member_lease_joined(
-            email=target, joined_at=joined_at, expires_at=expires_at, from_team=team_name
-        )
+        writes.join(email=target, joined_at=joined_at, expires_at=expires_at, from_team=team_name)
         return {'checked': 1, 'synced': 1, 'reason': 'synced'}
 
     @staticmethod
     def _get_joined_at_from_invites(
-        team_cfg: dict, email: str, lease: dict, record_events: bool
+        snapshot: _TeamSnapshot, email: str, lease: dict, writes: _SyncWrites, record_events: bool
     ) -> Optional[datetime]:
         '''从 invites 获取加入时间'''
-        try:
-            inv = get_invite_status_for_email(team_cfg, email)
-        except Exception as e:
-            inv = {'found': False, 'error': str(e)}
+        inv = snapshot.invite_for(email)
 
         if inv.get('found'):
             status = (inv.get('status') or '').strip().lower()
@@ -138,31 +228,29 @@ class JoinSyncService:
                     except Exception:
                         pass
             else:
-                _defer_join_sync(
+                writes.defer(
                     lease=lease,
                     message=f"invites 状态={status or 'unknown'}，未达到 accepted/completed",
                     reason=SyncReason.INVITE_NOT_ACCEPTED,
                 )
                 if record_events:
-                    db.add_member_lease_event(
+                    writes.event(
                         email=email,
                         action=LeaseAction.SYNC_INVITE_STATUS,
                         from_team=lease.get('team_name'),
-                        to_team=None,
                         message=f"invites 状态={status or 'unknown'}，未达到 accepted/completed",
                     )
         elif inv.get('error'):
-            _defer_join_sync(
+            writes.defer(
                 lease=lease,
                 message=f"拉取 invites 失败：{inv.get('error')}",
                 reason=SyncReason.INVITE_ERROR,
             )
             if record_events:
-                db.add_member_lease_event(
+                writes.event(
                     email=email,
                     action=LeaseAction.SYNC_INVITE_ERROR,
                     from_team=lease.get('team_name'),
-                    to_team=None,
                     message=f"拉取 invites 失败：{inv.get('error')}",
                 )
 
@@ -170,13 +258,10 @@ class JoinSyncService:
 
     @staticmethod
     def _get_joined_at_from_members(
-        team_cfg: dict, email: str, lease: dict, team_name: str, record_events: bool
+        snapshot: _TeamSnapshot, email: str, lease: dict, team_name: str, writes: _SyncWrites, record_events: bool
     ) -> Optional[datetime]:
         '''从 members 获取加入时间(兜底)'''
-        try:
-            mi = get_member_info_for_email(team_cfg, email)
-        except Exception as e:
-            mi = {'found': False, 'error': str(e)}
+        mi = snapshot.member_for(email)
 
         if mi.get('found'):
             ts = mi.get('joined_at')
@@ -191,40 +276,37 @@ class JoinSyncService:
             if allow_approx:
                 joined_at = datetime.now()
                 if record_events:
-                    db.add_member_lease_event(
+                    writes.event(
                         email=email,
                         action=LeaseAction.JOINED_FALLBACK,
                         from_team=team_name,
-                        to_team=None,
                         message='成员列表未提供加入时间字段，已使用当前时间近似 joined_at（AUTO_TRANSFER_ALLOW_APPROX_JOIN_AT=true）',
                     )
                 return joined_at
             else:
                 if record_events:
-                    db.add_member_lease_event(
+                    writes.event(
                         email=email,
                         action=LeaseAction.SYNC_MEMBER_NO_TIME,
                         from_team=team_name,
-                        to_team=None,
                         message="成员列表未提供加入时间字段，未写入 joined_at（保持 pending；可手动录入 joined_at / 在后台点'近似加入' / 或开启 AUTO_TRANSFER_ALLOW_APPROX_JOIN_AT）",
                     )
-                _defer_join_sync(
+                writes.defer(
                     lease=lease,
                     message='成员列表未提供加入时间字段，未写入 joined_at',
                     reason=SyncReason.MEMBER_NO_TIME,
                 )
         elif mi.get('error'):
-            _defer_join_sync(
+            writes.defer(
                 lease=lease,
                 message=f"拉取 members 失败：{mi.get('error')}",
                 reason=SyncReason.MEMBER_ERROR,
             )
             if record_events:
-                db.add_member_lease_event(
+                writes.event(
                     email=email,
                     action=LeaseAction.SYNC_MEMBER_ERROR,
                     from_team=team_name,
-                    to_team=None,
                     message=f"拉取 members 失败：{mi.get('error')}",
                 )
 
@@ -234,22 +316,12 @@ class JoinSyncService:
     def sync_batch(*, limit: int = 50, include_not_due: bool = False, record_events: bool = True) -> dict:
         '''批量同步加入时间
 
+        按 Team 分组，每个 Team 的 invites / members 只拉取一次，
+        所有租约基于同一份快照在内存中比对，结果在一个事务内写回。
+
         Returns:
             dict: {checked, synced, invite_errors, invite_not_accepted, member_errors, member_no_time, not_joined, skipped}
         '''
-        rows = db.list_member_leases_pending_join_with_due(limit=limit, include_not_due=include_not_due)
-        if not rows:
-            return {
-                'checked': 0,
-                'synced': 0,
-                'invite_errors': 0,
-                'invite_not_accepted': 0,
-                'member_errors': 0,
-                'member_no_time': 0,
-                'not_joined': 0,
-                'skipped': 0,
-            }
-
         stats = {
             'checked': 0,
             'synced': 0,
@@ -261,26 +333,74 @@ class JoinSyncService:
             'skipped': 0,
         }
 
+        rows = db.list_member_leases_pending_join_with_due(limit=limit, include_not_due=include_not_due)
+        if not rows:
+            return stats
+
+        # 按 Team 分组
+        groups: dict[str, list[dict]] = {}
         for lease in rows:
             email = (lease.get('email') or '').strip().lower()
-            if not email:
+            if not email or (lease.get('status') or '').strip() != 'pending':
                 stats['skipped'] += 1
                 continue
+            groups.setdefault((lease.get('team_name') or '').strip(), []).append(lease)
 
-            result = JoinSyncService.sync_single_email(email, record_events=record_events)
-            stats['checked'] += result.get('checked', 0)
-            stats['synced'] += result.get('synced', 0)
-
-            reason = result.get('reason', '')
-            if 'invite_error' in reason:
-                stats['invite_errors'] += 1
-            elif 'invite_not_accepted' in reason or 'invite_status' in reason:
-                stats['invite_not_accepted'] += 1
-            elif 'member_error' in reason:
-                stats['member_errors'] += 1
-            elif 'member_no_time' in reason:
-                stats['member_no_time'] += 1
-            elif 'not_joined' in reason:
-                stats['not_joined'] += 1
+        writes = _SyncWrites()
+        try:
+            for team_name, leases in groups.items():
+                team_cfg = config.resolve_team(team_name) or {}
+                snapshot = _TeamSnapshot(team_cfg) if team_cfg else None
+
+                for lease in leases:
+                    result = JoinSyncService._sync_lease(lease, snapshot, writes, record_events)
+                    stats['checked'] += result.get('checked', 0)
+                    stats['synced'] += result.get('synced', 0)
+
+                    reason = result.get('reason', '')
+                    if 'invite_error' in reason:
+                        stats['invite_errors'] += 1
+                    elif 'invite_not_accepted' in reason or 'invite_status' in reason:
+                        stats['invite_not_accepted'] += 1
+                    elif 'member_error' in reason:
+                        stats['member_errors'] += 1
+                    elif 'member_no_time' in reason:
+                        stats['member_no_time'] += 1
+                    elif 'not_joined' in reason:
+                        stats['not_joined'] += 1
+        finally:
+            writes.flush()
 
         return stats
+
+    @staticmethod
+    def schedule_delayed_sync(email: str, *, delay_seconds: int = 60, retry_interval: int = 180, max_attempts: int = 5) -> bool:
+        '''登记延迟同步任务（兑换后给用户时间接受邀请；同一邮箱的待执行任务会合并）
+
+        Returns:
+            bool: 是否新建了任务
+        '''
+        target = (email or '').strip().lower()
+        if not target:
+            return False
+        return delay_queue.schedule(
+            JOIN_SYNC_TASK,
+            target,
+            delay_seconds=delay_seconds,
+            payload={'email': target},
+            retry_interval=retry_interval,
+            max_attempts=max_attempts,
+        )
+
+
+def _run_delayed_join_sync(payload: dict) -> bool:
+    '''延迟队列处理函数：已同步或无需同步时返回 True，否则等待下次重试'''
+    email = (payload.get('email') or '').strip().lower()
+    result = JoinSyncService.sync_single_email(email, record_events=True)
+    if result.get('synced', 0) > 0:
+        log.info(f"自动同步 joined_at 成功: {email}")
+        return True
+    return result.get('reason') in {'empty_email', 'lease_not_found', 'not_pending'}
+
+
+delay_queue.register(JOIN_SYNC_TASK, _run_delayed_join_sync)
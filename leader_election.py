@@ -0,0 +1,91 @@
+"""
+后台任务主节点选举
+多个进程（gunicorn worker / python -m worker 实例）通过 app_locks 表竞争同一把租约锁，
+持有者定期续约；只有主节点执行定时后台任务，主节点退出或续约失败后由其他进程接替。
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+import uuid
+
+from database import db
+from logger import log
+
+
+class LeaderElection:
+    """基于数据库租约锁的主节点选举（每个进程一个实例）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock_by = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease_seconds = 60
+        self._leader = False
+        self._valid_until = 0.0
+        self._lock = threading.Lock()
+        self._worker_started = False
+
+    def is_leader(self) -> bool:
+        """当前进程是否为主节点（租约在本地也按到期时间判断，续约线程卡住时自动让出）"""
+        return self._leader and time.monotonic() < self._valid_until
+
+    def _tick(self):
+        started = time.monotonic()
+        if self._leader:
+            ok = db.renew_lock(self.name, lock_by=self.lock_by, lock_seconds=self._lease_seconds)
+            if not ok:
+                self._leader = False
+                log.warning(f"后台任务主节点租约已丢失（{self.lock_by}）")
+                return
+        else:
+            ok = db.acquire_lock(self.name, lock_by=self.lock_by, lock_seconds=self._lease_seconds)
+            if not ok:
+                return
+            log.info(f"当前进程成为后台任务主节点（{self.lock_by}）", icon="start")
+        # 本地有效期比数据库租约略短，避免与接替者重叠
+        self._valid_until = started + self._lease_seconds * 0.8
+        self._leader = True
+
+    def start_worker(self, *, lease_seconds: int = 60):
+        """启动选举/续约线程（每 1/3 租约时间执行一次）"""
+        with self._lock:
+            if self._worker_started:
+                return
+            self._worker_started = True
+            self._lease_seconds = max(15, int(lease_seconds))
+
+        interval = self._lease_seconds / 3
+
+        # 先同步竞选一次，随后启动的后台任务第一轮即可判断自己是否为主节点
+        try:
+            self._tick()
+        except Exception as e:
+            log.warning(f"后台任务主节点选举出错: {e}")
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self._tick()
+                except Exception as e:
+                    log.warning(f"后台任务主节点选举出错: {e}")
+
+        thread = threading.Thread(target=_loop, daemon=True, name="LeaderElection")
+        thread.start()
+
+    def resign(self):
+        """主动让出主节点（进程退出前调用，其他进程无需等待租约过期）"""
+        if not self._leader:
+            return
+        self._leader = False
+        try:
+            db.release_lock(self.name, lock_by=self.lock_by)
+        except Exception as e:
+            log.warning(f"释放后台任务主节点锁失败: {e}")
+
+
+# 全局实例：定时后台任务（自动转移、监控、Team 状态检测、异常转移检测）共用
+background_leader = LeaderElection("background_jobs_leader")
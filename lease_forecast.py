@@ -0,0 +1,205 @@
+'''
+租约到期预测 - 按天/小时统计即将到期的租约，预测各 Team 的席位需求
+
+租约按"同日"规则续期（add_months_same_day），到期集中在每月固定几天。本模块：
+  1. 在 SQLite 中按到期时间分桶聚合（GROUP BY，走 (status, expires_at, team_name) 覆盖索引），
+     Python 侧只处理"桶 × Team"的计数，与租约总数无关
+  2. 按转移规划相同的规则（最早创建的可用 Team 优先、排除当前 Team）把每个桶的到期人数分配到目标 Team，
+     与 teams_stats 中最近一次记录的剩余席位比较，给出每个 Team 的预计流入、剩余席位和耗尽时间
+
+pending（尚未加入）租约的 expires_at 为预估值，加入后会按实际加入时间修正，单独计数。
+已过期但尚未转移的租约计入第一个桶 overdue。
+
+命令行用法:
+    python -m lease_forecast --days 35
+    python -m lease_forecast --days 3 --bucket hour --json
+'''
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+if __name__ == '__main__':
+    # 命令行模式：stdout 只输出报告，日志写到 stderr（需在导入 database / logger 之前设置）
+    os.environ.setdefault('LOG_STREAM', 'stderr')
+
+from database import db
+from transfer_executor import kick_old_team_enabled
+from transfer_planner import load_team_snapshot
+
+
+OVERDUE = 'overdue'
+
+
+def _capacity(row: dict | None) -> Optional[int]:
+    '''teams_stats 最近一次记录的剩余席位（没有记录时为 None）'''
+    if not row or row.get('total_seats') is None:
+        return None
+    total = int(row.get('total_seats') or 0)
+    used = int(row.get('used_seats') or 0)
+    pending = int(row.get('pending_invites') or 0)
+    return max(0, total - used - pending)
+
+
+def forecast(*, days: int = 35, bucket: str = 'day', now: datetime | None = None) -> dict[str, Any]:
+    '''生成到期预测
+
+    Args:
+        days: 预测天数
+        bucket: day / hour
+        now: 当前时间（默认 datetime.now()）
+
+    Returns:
+        dict: {generated_at, horizon_days, bucket, kick_old_team, totals, buckets, teams, first_shortfall}
+    '''
+    bucket = 'hour' if bucket == 'hour' else 'day'
+    now = now or datetime.now()
+    days = max(1, min(366, int(days)))
+    rows = db.aggregate_lease_expiries(until=now + timedelta(days=days), bucket=bucket)
+    current = now.strftime('%Y-%m-%d %H' if bucket == 'hour' else '%Y-%m-%d')
+
+    # 桶 -> 源 Team -> {active, pending}
+    timeline: dict[str, dict[str, dict[str, int]]] = {}
+    for row in rows:
+        key = (row.get('bucket') or '').replace('T', ' ')
+        if key < current:
+            key = OVERDUE
+        per_team = timeline.setdefault(key, {})
+        counts = per_team.setdefault(row.get('team_name') or '', {'active': 0, 'pending': 0})
+        counts['active' if row.get('status') == 'active' else 'pending'] += int(row.get('leases') or 0)
+
+    # 目标 Team：与转移规划一致（状态正常、配置完整，按创建时间排序）
+    stats = {row.get('team_name'): row for row in db.list_team_stats()}
+    slots = load_team_snapshot()
+    kick_old = kick_old_team_enabled()
+    remaining: dict[str, Optional[int]] = {slot.name: _capacity(stats.get(slot.name)) for slot in slots}
+    teams: dict[str, dict[str, Any]] = {}
+
+    def team_entry(name: str) -> dict[str, Any]:
+        if name not in teams:
+            row = stats.get(name) or {}
+            teams[name] = {
+                'team': name,
+                'target': name in remaining,
+                'capacity': _capacity(row),
+                'stats_updated_at': row.get('last_updated'),
+                'outgoing': 0,
+                'incoming': 0,
+                'remaining': remaining.get(name),
+                'exhausted_at': None,
+            }
+        return teams[name]
+
+    for slot in slots:
+        team_entry(slot.name)
+
+    buckets: list[dict[str, Any]] = []
+    first_shortfall = None
+    totals = {'leases': 0, 'active': 0, 'pending': 0, 'overdue': 0, 'unplaced': 0}
+    for key in sorted(timeline, key=lambda k: (k != OVERDUE, k)):
+        per_team = timeline[key]
+        entry = {'bucket': key, 'leases': 0, 'active': 0, 'pending': 0, 'by_team': {}, 'placed': {}, 'unplaced': 0}
+        freed: dict[str, int] = {}
+        for source, counts in sorted(per_team.items()):
+            demand = counts['active'] + counts['pending']
+            entry['leases'] += demand
+            entry['active'] += counts['active']
+            entry['pending'] += counts['pending']
+            entry['by_team'][source] = demand
+            team_entry(source)['outgoing'] += demand
+
+            # 按创建时间顺序分配到其他 Team；席位未知（没有统计记录）的 Team 不计入容量
+            for slot in slots:
+                if demand <= 0:
+                    break
+                seats = remaining.get(slot.name)
+                if slot.name == source or not seats:
+                    continue
+                placed = min(demand, seats)
+                remaining[slot.name] = seats - placed
+                demand -= placed
+                entry['placed'][slot.name] = entry['placed'].get(slot.name, 0) + placed
+                target = team_entry(slot.name)
+                target['incoming'] += placed
+                if remaining[slot.name] == 0 and target['exhausted_at'] is None:
+                    target['exhausted_at'] = key
+            entry['unplaced'] += demand
+            if kick_old:
+                # 自动退出旧 Team 时，转走的成员释放源 Team 的席位（下一个桶起可用）
+                freed[source] = freed.get(source, 0) + counts['active'] + counts['pending'] - demand
+
+        for name, count in freed.items():
+            if remaining.get(name) is not None:
+                remaining[name] += count
+        if entry['unplaced'] and first_shortfall is None:
+            first_shortfall = key
+
+        totals['leases'] += entry['leases']
+        totals['active'] += entry['active']
+        totals['pending'] += entry['pending']
+        totals['unplaced'] += entry['unplaced']
+        if key == OVERDUE:
+            totals['overdue'] = entry['leases']
+        buckets.append(entry)
+
+    for name, item in teams.items():
+        item['remaining'] = remaining.get(name)
+
+    return {
+        'generated_at': now.isoformat(timespec='seconds'),
+        'horizon_days': days,
+        'bucket': bucket,
+        'kick_old_team': kick_old,
+        'totals': totals,
+        'buckets': buckets,
+        'teams': sorted(teams.values(), key=lambda t: (not t['target'], t['team'])),
+        'first_shortfall': first_shortfall,
+    }
+
+
+def _print_report(report: dict[str, Any]):
+    totals = report['totals']
+    print(
+        f"📅 未来 {report['horizon_days']} 天到期租约: {totals['leases']}（生效中 {totals['active']}，"
+        f"待加入 {totals['pending']}，已过期未转移 {totals['overdue']}）"
+    )
+    print(f"{'时间':<16}{'到期':>8}{'待加入':>8}{'无席位':>8}  目标 Team 分配")
+    for entry in report['buckets']:
+        placed = ', '.join(f'{k}:{v}' for k, v in sorted(entry['placed'].items())) or '-'
+        print(f"{entry['bucket']:<16}{entry['leases']:>8}{entry['pending']:>8}{entry['unplaced']:>8}  {placed}")
+    print()
+    print(f"{'Team':<20}{'剩余席位':>10}{'流出':>8}{'流入':>8}{'预计剩余':>10}  席位耗尽")
+    for team in report['teams']:
+        capacity = '-' if team['capacity'] is None else team['capacity']
+        left = '-' if team['remaining'] is None else team['remaining']
+        name = team['team'] + ('' if team['target'] else ' (不可用)')
+        print(f"{name:<20}{capacity!s:>10}{team['outgoing']:>8}{team['incoming']:>8}{left!s:>10}  {team['exhausted_at'] or '-'}")
+    if report['first_shortfall']:
+        print(f"\n⚠️ 预计从 {report['first_shortfall']} 起席位不足，共 {totals['unplaced']} 人无法分配")
+    else:
+        print('\n✅ 预测期内席位充足')
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='租约到期预测与 Team 席位需求')
+    parser.add_argument('--days', '-d', type=int, default=35, help='预测天数 (默认: 35)')
+    parser.add_argument('--bucket', '-b', choices=['day', 'hour'], default='day', help='统计粒度 (默认: day)')
+    parser.add_argument('--json', action='store_true', help='输出 JSON')
+    args = parser.parse_args(argv)
+
+    report = forecast(days=args.days, bucket=args.bucket)
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2, default=str)
+        print()
+    else:
+        _print_report(report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
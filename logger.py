@@ -1,9 +1,24 @@
 # ==================== 日志模块 ====================
 # 统一的日志输出，带时间戳
+#
+# 输出方式（环境变量）:
+#   LOG_LEVEL    DEBUG / INFO / WARNING / ERROR，低于该级别的日志在格式化之前直接丢弃
+#   LOG_FORMAT   text（默认，带颜色和图标）/ json（每行一个 JSON 对象，便于日志平台采集）
+#   LOG_ASYNC    auto（默认：终端同步输出，容器/重定向时异步）/ true / false
+#                异步模式下调用方只把记录放入队列，由后台线程格式化并批量写入 stdout，
+#                队列满时丢弃新日志并在之后输出丢弃数量，不会阻塞请求处理
+#   LOG_DEDUPE_SECONDS  相同内容的日志在该时间窗口内只输出一次，之后附带重复次数（默认 10，0 关闭）
+#   LOG_STREAM   stdout（默认）/ stderr；命令行导出工具把数据写到 stdout 时使用 stderr，避免日志混入数据
 
 from datetime import datetime
+import atexit
+import json
 import os
+import queue
+import re
 import sys
+import threading
+import time
 
 # 设置Windows控制台UTF-8编码
 if sys.platform == 'win32':
@@ -15,6 +30,15 @@ if sys.platform == 'win32':
         pass
 
 
+def _env_bool_auto(name: str, auto: bool) -> bool:
+    value = os.environ.get(name, "auto").strip().lower()
+    if value in {"1", "true", "yes", "on"}:
+        return True
+    if value in {"0", "false", "no", "off"}:
+        return False
+    return auto
+
+
 class Logger:
     """统一日志输出"""
 
@@ -24,6 +48,8 @@ class Logger:
     LEVEL_WARNING = 2
     LEVEL_ERROR = 3
 
+    _LEVELS = {"debug": 0, "info": 1, "success": 1, "warning": 2, "error": 3}
+
     # 日志级别颜色 (ANSI)
     COLORS = {
         "info": "\033[0m",      # 默认
@@ -54,7 +80,6 @@ class Logger:
 
     def __init__(self, name: str = "", use_color: bool = True, level: int = None):
         self.name = name
-        self.use_color = use_color
         # 从环境变量读取日志级别，默认 INFO
         if level is None:
             env_level = os.environ.get("LOG_LEVEL", "INFO").upper()
@@ -63,13 +88,61 @@ class Logger:
         else:
             self.level = level
 
+        self.json_format = os.environ.get("LOG_FORMAT", "text").strip().lower() == "json"
+        self.use_color = use_color and not self.json_format
+
+        self.to_stderr = os.environ.get("LOG_STREAM", "stdout").strip().lower() == "stderr"
+        interactive = hasattr(self._stream(), "isatty") and self._stream().isatty()
+        self.async_mode = _env_bool_auto("LOG_ASYNC", not interactive)
+        try:
+            self.dedupe_seconds = max(0.0, float(os.environ.get("LOG_DEDUPE_SECONDS", "10") or 0))
+        except ValueError:
+            self.dedupe_seconds = 10.0
+
+        self._queue_size = int(os.environ.get("LOG_QUEUE_SIZE", "10000") or 10000)
+        # 去重窗口：(级别, 去重键) -> [窗口开始时间, 窗口内被抑制的次数, 记录]
+        self._recent: dict = {}
+        self._reset_backend()
+        if hasattr(os, "register_at_fork"):
+            # fork 出的子进程（gunicorn worker）没有写入线程，锁也可能处于持有状态，全部重建
+            os.register_at_fork(after_in_child=self._reset_backend)
+
+    def _stream(self):
+        return sys.stderr if self.to_stderr else sys.stdout
+
+    def _reset_backend(self):
+        self._queue: queue.Queue = queue.Queue(maxsize=self._queue_size)
+        self._dropped = 0
+        self._writer_started = False
+        self._writer_lock = threading.Lock()
+        self._recent_lock = threading.Lock()
+
+    # ==================== 后端 ====================
+
+    def enabled(self, level: str) -> bool:
+        """该级别是否会输出（热路径上可先判断再拼接日志内容）"""
+        return self.level <= self._LEVELS.get(level, self.LEVEL_INFO)
+
     def _timestamp(self) -> str:
         """获取时间戳"""
         return datetime.now().strftime("%H:%M:%S")
 
-    def _format(self, level: str, msg: str, icon: str = None, indent: int = 0) -> str:
+    def _format(self, level: str, msg: str, icon: str = None, indent: int = 0, ts: float = None, fields: dict = None) -> str:
         """格式化日志消息"""
-        ts = self._timestamp()
+        if self.json_format:
+            record = {
+                "ts": datetime.fromtimestamp(ts or time.time()).isoformat(timespec="milliseconds"),
+                "level": level,
+                "msg": msg,
+                "pid": os.getpid(),
+            }
+            if self.name:
+                record["logger"] = self.name
+            if fields:
+                record.update(fields)
+            return json.dumps(record, ensure_ascii=False, default=str)
+
+        ts_str = datetime.fromtimestamp(ts).strftime("%H:%M:%S") if ts else self._timestamp()
         prefix = "  " * indent
 
         if icon:
@@ -77,46 +150,178 @@ class Logger:
         else:
             icon_str = self.ICONS.get(level, "")
 
+        if fields:
+            fields = dict(fields)
+            repeated = fields.pop("repeated", None)
+            if fields:
+                msg = f"{msg} " + " ".join(f"{k}={v}" for k, v in fields.items())
+            if repeated:
+                msg = f"{msg}（{int(self.dedupe_seconds)}s 内重复 {repeated} 次）"
+
         if self.use_color:
             color = self.COLORS.get(level, self.COLORS["info"])
             reset = self.COLORS["reset"]
-            return f"{prefix}[{ts}] {color}{icon_str} {msg}{reset}"
+            return f"{prefix}[{ts_str}] {color}{icon_str} {msg}{reset}"
         else:
-            return f"{prefix}[{ts}] {icon_str} {msg}"
+            return f"{prefix}[{ts_str}] {icon_str} {msg}"
 
-    def info(self, msg: str, icon: str = None, indent: int = 0):
-        if self.level <= self.LEVEL_INFO:
-            print(self._format("info", msg, icon, indent), flush=True)
+    def _suppressed(self, record: tuple, key: str) -> bool:
+        """去重：窗口内重复的日志返回 True，窗口结束时由写入线程输出重复次数"""
+        if self.dedupe_seconds <= 0:
+            return False
+        now = time.monotonic()
+        with self._recent_lock:
+            entry = self._recent.get((record[0], key))
+            if entry is not None and now - entry[0] < self.dedupe_seconds:
+                entry[1] += 1
+                return True
+            if entry is not None and entry[1]:
+                # 写入线程尚未输出汇总（同步模式）：附在本条日志上
+                record[5]["repeated"] = entry[1]
+            self._recent[(record[0], key)] = [now, 0, record]
+            if len(self._recent) > 4096:
+                self._recent = {k: v for k, v in self._recent.items() if now - v[0] < self.dedupe_seconds}
+        return False
 
-    def success(self, msg: str, indent: int = 0):
-        if self.level <= self.LEVEL_INFO:
-            print(self._format("success", msg, indent=indent), flush=True)
+    def _expired_repeats(self) -> list:
+        """去重窗口已结束且有被抑制日志的汇总记录"""
+        now = time.monotonic()
+        summaries = []
+        with self._recent_lock:
+            for key, entry in list(self._recent.items()):
+                if now - entry[0] < self.dedupe_seconds:
+                    continue
+                if entry[1]:
+                    level, msg, icon, indent, _, fields = entry[2]
+                    summaries.append((level, msg, icon, indent, time.time(), {**fields, "repeated": entry[1]}))
+                del self._recent[key]
+        return summaries
 
-    def warning(self, msg: str, indent: int = 0):
-        if self.level <= self.LEVEL_WARNING:
-            print(self._format("warning", msg, indent=indent), flush=True)
+    def _log(self, level: str, msg: str, icon: str = None, indent: int = 0, dedupe_key: str = None, fields: dict = None):
+        if self.level > self._LEVELS[level]:
+            return
+        record = (level, msg, icon, indent, time.time(), dict(fields) if fields else {})
+        if self._suppressed(record, dedupe_key or msg):
+            return
+        if not self.async_mode:
+            self._write(self._render(record))
+            return
+        self._enqueue(record)
 
-    def error(self, msg: str, indent: int = 0):
-        if self.level <= self.LEVEL_ERROR:
-            print(self._format("error", msg, indent=indent), flush=True)
+    def _enqueue(self, item):
+        if not self._writer_started:
+            with self._writer_lock:
+                if not self._writer_started:
+                    self._writer_started = True
+                    threading.Thread(target=self._writer_loop, daemon=True, name="LogWriter").start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._dropped += 1
 
-    def debug(self, msg: str, indent: int = 0):
-        if self.level <= self.LEVEL_DEBUG:
-            print(self._format("debug", msg, indent=indent))
+    def _render(self, item) -> str:
+        if isinstance(item, str):
+            return item
+        level, msg, icon, indent, ts, fields = item
+        return self._format(level, msg, icon, indent, ts=ts, fields=fields or None)
+
+    def _writer_loop(self):
+        q = self._queue
+        # 开启去重时每秒检查一次已结束的去重窗口，输出重复次数汇总
+        wait = 1.0 if self.dedupe_seconds else None
+        last_sweep = time.monotonic()
+        while True:
+            items = []
+            try:
+                items.append(q.get(timeout=wait))
+            except queue.Empty:
+                pass
+            # 一次写入队列中已有的多条日志，减少 write/flush 次数
+            while items and len(items) < 256:
+                try:
+                    items.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            records = items
+            if wait and time.monotonic() - last_sweep >= wait:
+                last_sweep = time.monotonic()
+                records = items + self._expired_repeats()
+            lines = []
+            for item in records:
+                try:
+                    lines.append(self._render(item))
+                except Exception as e:
+                    lines.append(f"日志格式化失败: {e}")
+            if self._dropped:
+                dropped, self._dropped = self._dropped, 0
+                lines.append(self._format("warning", f"日志队列已满，丢弃了 {dropped} 条日志"))
+            if lines:
+                self._write("\n".join(lines))
+            for _ in items:
+                q.task_done()
+
+    def _write(self, text: str):
+        try:
+            stream = self._stream()
+            stream.write(text + "\n")
+            stream.flush()
+        except Exception:
+            pass
+
+    def flush(self, timeout: float = 2.0):
+        """等待队列中的日志写完（进程退出、交互输出前调用）"""
+        if not self.async_mode or not self._writer_started:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _print(self, text: str, **kwargs):
+        """非结构化输出（步骤、进度、标题等），异步模式下与其他日志保持顺序"""
+        if self.json_format:
+            # JSON 模式：作为普通 info 日志输出，分隔线等纯装饰内容跳过
+            text = re.sub(r"^\[\d{2}:\d{2}:\d{2}\]\s*", "", text.strip())
+            if len(set(text)) > 1:
+                self._log("info", text)
+            return
+        if self.async_mode and not kwargs:
+            self._enqueue(text)
+            return
+        self.flush()
+        print(text, file=self._stream(), flush=True, **kwargs)
+
+    # ==================== 日志接口 ====================
+    # dedupe_key: 去重键（默认按完整消息去重，内容含变量但属于同一类问题时可指定固定键）
+    # **fields: 结构化字段（JSON 模式下作为独立字段输出，文本模式追加在消息后）
+
+    def info(self, msg: str, icon: str = None, indent: int = 0, dedupe_key: str = None, **fields):
+        self._log("info", msg, icon, indent, dedupe_key, fields)
+
+    def success(self, msg: str, icon: str = None, indent: int = 0, dedupe_key: str = None, **fields):
+        self._log("success", msg, icon, indent, dedupe_key, fields)
+
+    def warning(self, msg: str, icon: str = None, indent: int = 0, dedupe_key: str = None, **fields):
+        self._log("warning", msg, icon, indent, dedupe_key, fields)
+
+    def error(self, msg: str, icon: str = None, indent: int = 0, dedupe_key: str = None, **fields):
+        self._log("error", msg, icon, indent, dedupe_key, fields)
+
+    def debug(self, msg: str, icon: str = None, indent: int = 0, dedupe_key: str = None, **fields):
+        self._log("debug", msg, icon, indent, dedupe_key, fields)
 
     def step(self, msg: str, indent: int = 0):
         """步骤日志 (INFO 级别)"""
         if self.level <= self.LEVEL_INFO:
             ts = self._timestamp()
             prefix = "  " * indent
-            print(f"{prefix}[{ts}] → {msg}")
+            self._print(f"{prefix}[{ts}] → {msg}")
 
     def verbose(self, msg: str, indent: int = 0):
         """详细日志 (DEBUG 级别)"""
         if self.level <= self.LEVEL_DEBUG:
             ts = self._timestamp()
             prefix = "  " * indent
-            print(f"{prefix}[{ts}] · {msg}")
+            self._print(f"{prefix}[{ts}] · {msg}")
 
     def progress(self, current: int, total: int, msg: str = ""):
         """进度日志"""
@@ -126,43 +331,43 @@ class Logger:
             bar_len = 20
             filled = int(bar_len * current / total) if total > 0 else 0
             bar = "█" * filled + "░" * (bar_len - filled)
-            print(f"[{ts}] [{bar}] {current}/{total} ({pct:.0f}%) {msg}")
+            self._print(f"[{ts}] [{bar}] {current}/{total} ({pct:.0f}%) {msg}")
 
     def progress_inline(self, msg: str):
         """内联进度 (覆盖当前行)"""
-        print(f"\r{msg}" + " " * 10, end='', flush=True)
+        self._print(f"\r{msg}" + " " * 10, end='')
 
     def progress_clear(self):
         """清除内联进度"""
-        print("\r" + " " * 40 + "\r", end='')
+        self._print("\r" + " " * 40 + "\r", end='')
 
     def countdown(self, seconds: int, msg: str = "等待", check_shutdown=None):
         """倒计时显示 (同一行动态更新数字)
-        
+
         Args:
             seconds: 倒计时秒数
             msg: 显示消息
             check_shutdown: 可选的检查函数，返回 True 时提前退出
         """
-        import time
+        self.flush()
         ts = self._timestamp()
         icon_str = self.ICONS.get("wait", "⏳")
         # 先打印固定部分
-        print(f"[{ts}] {icon_str} {msg} ", end='', flush=True)
+        print(f"[{ts}] {icon_str} {msg} ", end='', file=self._stream(), flush=True)
         for remaining in range(seconds, 0, -1):
             if check_shutdown and check_shutdown():
-                print()  # 换行
+                print(file=self._stream())  # 换行
                 return False
             # 用 \r 回到数字位置，覆盖更新
-            print(f"\b\b\b\b{remaining:2d}s ", end='', flush=True)
+            print(f"\b\b\b\b{remaining:2d}s ", end='', file=self._stream(), flush=True)
             time.sleep(1)
-        print()  # 完成后换行
+        print(file=self._stream())  # 完成后换行
         return True
 
     def separator(self, char: str = "=", length: int = 60):
         """分隔线"""
         if self.level <= self.LEVEL_INFO:
-            print(char * length)
+            self._print(char * length)
 
     def header(self, title: str):
         """标题"""
@@ -170,17 +375,20 @@ class Logger:
             self.separator()
             ts = self._timestamp()
             target_icon = "[>]" if sys.platform == 'win32' else "🎯"
-            print(f"[{ts}] {target_icon} {title}")
+            self._print(f"[{ts}] {target_icon} {title}")
             self.separator()
 
     def section(self, title: str):
         """小节标题"""
         if self.level <= self.LEVEL_INFO:
             ts = self._timestamp()
-            print(f"[{ts}] {'#' * 40}")
-            print(f"[{ts}] # {title}")
-            print(f"[{ts}] {'#' * 40}")
+            self._print(f"[{ts}] {'#' * 40}")
+            self._print(f"[{ts}] # {title}")
+            self._print(f"[{ts}] {'#' * 40}")
 
 
 # 全局日志实例
 log = Logger()
+
+# 进程退出前写完队列中的日志
+atexit.register(log.flush)
@@ -0,0 +1,508 @@
+"""
+Prometheus 指标
+每个进程在内存中累计指标，后台线程每隔 METRICS_FLUSH_INTERVAL 秒把快照写入共享目录
+（DATA_DIR/metrics/<pid>-<随机串>.json，原子替换）；/metrics 读取所有进程的快照合并后输出
+Prometheus 文本格式，gunicorn 多 worker / 独立后台任务进程的数据都会汇总。
+
+- 计数器 / 直方图：各进程求和；进程退出后快照超时，计数合并进 archive.json，总数不回退
+- 仪表（gauge）：只取存活进程，按定义合并（sum / max / 按 pid 分别输出）
+- 积压类指标（到期租约、待加入、延迟任务、异步兑换任务）在抓取时直接查询数据库
+"""
+
+from __future__ import annotations
+
+import atexit
+import bisect
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 等平台没有 fcntl，只输出本进程指标
+    fcntl = None
+
+from config import DATA_DIR, env_bool
+from logger import log
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+LOOP_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Metric:
+    def __init__(self, name: str, kind: str, help_text: str, *, buckets: tuple = (), merge: str = "sum"):
+        self.name = name
+        self.kind = kind  # counter / gauge / histogram
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.merge = merge  # gauge 合并方式：sum / max / pid
+
+
+_METRICS: Dict[str, _Metric] = {}
+
+
+def _define(name: str, kind: str, help_text: str, **kwargs) -> str:
+    _METRICS[name] = _Metric(name, kind, help_text, **kwargs)
+    return name
+
+
+# ==================== 指标定义 ====================
+
+HTTP_REQUESTS = _define("teamdh_http_requests_total", "counter", "HTTP 请求数（按路由、方法、状态码）")
+HTTP_LATENCY = _define("teamdh_http_request_duration_seconds", "histogram", "HTTP 请求耗时（按路由、方法）", buckets=LATENCY_BUCKETS)
+RATE_LIMITED = _define("teamdh_rate_limited_total", "counter", "被限流拒绝的请求数（按规则）")
+UPSTREAM_REQUESTS = _define("teamdh_upstream_requests_total", "counter", "上游请求数（按 Team、接口、状态码，异常为 error）")
+UPSTREAM_LATENCY = _define("teamdh_upstream_request_duration_seconds", "histogram", "上游请求耗时（按 Team、接口）", buckets=LATENCY_BUCKETS)
+DB_LATENCY = _define("teamdh_db_statement_duration_seconds", "histogram", "SQL 语句耗时（按操作、表，含 COMMIT）", buckets=DB_BUCKETS)
+DB_ERRORS = _define("teamdh_db_errors_total", "counter", "SQL 执行错误数（按操作、错误类型）")
+LOOP_LATENCY = _define("teamdh_background_loop_duration_seconds", "histogram", "后台任务单轮耗时", buckets=LOOP_BUCKETS)
+LOOP_FAILURES = _define("teamdh_background_loop_failures_total", "counter", "后台任务单轮失败次数")
+LOOP_LAST_SUCCESS = _define("teamdh_background_loop_last_success_timestamp_seconds", "gauge", "后台任务最近一次成功完成的时间（Unix 时间戳）", merge="max")
+PROCESS_THREADS = _define("teamdh_process_threads", "gauge", "进程线程数", merge="pid")
+PROCESS_RSS = _define("teamdh_process_resident_memory_bytes", "gauge", "进程常驻内存", merge="pid")
+BACKLOG = _define("teamdh_backlog", "gauge", "积压数量（抓取时查询数据库）")
+
+
+def _label_key(labels: Optional[Dict[str, Any]]) -> LabelKey:
+    if not labels:
+        return ()
+    return tuple(sorted((str(k), "" if v is None else str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    """进程内指标存储"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[Tuple[str, LabelKey], float] = {}
+        self.gauges: Dict[Tuple[str, LabelKey], float] = {}
+        # (名称, 标签) -> [各桶计数（非累计，最后一个为 +Inf）, sum, count]
+        self.histograms: Dict[Tuple[str, LabelKey], list] = {}
+
+    def inc(self, name: str, labels: Optional[Dict[str, Any]] = None, value: float = 1.0):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = float(value)
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        buckets = _METRICS[name].buckets
+        key = (name, _label_key(labels))
+        idx = bisect.bisect_left(buckets, value)
+        with self._lock:
+            item = self.histograms.get(key)
+            if item is None:
+                item = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            item[0][idx] += 1
+            item[1] += value
+            item[2] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": [[n, list(map(list, k)), v] for (n, k), v in self.counters.items()],
+                "gauges": [[n, list(map(list, k)), v] for (n, k), v in self.gauges.items()],
+                "histograms": [[n, list(map(list, k)), list(h[0]), h[1], h[2]] for (n, k), h in self.histograms.items()],
+            }
+
+
+registry = Registry()
+
+
+# ==================== 记录接口 ====================
+
+def inc(name: str, labels: Optional[Dict[str, Any]] = None, value: float = 1.0):
+    if METRICS_ENABLED:
+        _store.ensure_started()
+        registry.inc(name, labels, value)
+
+
+def set_gauge(name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+    if METRICS_ENABLED:
+        _store.ensure_started()
+        registry.set(name, value, labels)
+
+
+def observe(name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+    if METRICS_ENABLED:
+        _store.ensure_started()
+        registry.observe(name, value, labels)
+
+
+@contextmanager
+def track_loop(loop: str):
+    """后台任务单轮计时：成功时记录耗时和完成时间，异常时计失败次数（异常继续抛出）"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc(LOOP_FAILURES, {"loop": loop})
+        raise
+    else:
+        set_gauge(LOOP_LAST_SUCCESS, time.time(), {"loop": loop})
+    finally:
+        observe(LOOP_LATENCY, time.perf_counter() - start, {"loop": loop})
+
+
+_ID_SEGMENT_RE = re.compile(r"^(?=.*\d)[\w.@-]{8,}$|^\d+$")
+
+
+@functools.lru_cache(maxsize=512)
+def normalize_endpoint(method: str, path: str) -> str:
+    """上游接口标签：路径中的 ID / 邮箱段替换为 {id}，避免标签基数过高"""
+    parts = [("{id}" if _ID_SEGMENT_RE.match(p) or "@" in p else p) for p in path.split("/")]
+    return f"{method.upper()} {'/'.join(parts) or '/'}"
+
+
+def record_upstream(*, team: str, method: str, path: str, status: str, seconds: float):
+    endpoint = normalize_endpoint(method, path)
+    observe(UPSTREAM_LATENCY, seconds, {"team": team, "endpoint": endpoint})
+    inc(UPSTREAM_REQUESTS, {"team": team, "endpoint": endpoint, "status": status})
+
+
+# ==================== SQL 计时 ====================
+
+_SQL_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)", re.I)
+
+
+@functools.lru_cache(maxsize=1024)
+def _sql_labels(sql: str) -> Tuple[str, str]:
+    stripped = sql.lstrip()
+    op = stripped.split(None, 1)[0].upper() if stripped else "-"
+    if op == "WITH":
+        # CTE：按主语句的操作计
+        m = re.search(r"\)\s*(SELECT|INSERT|UPDATE|DELETE)\b", stripped, re.I)
+        op = m.group(1).upper() if m else "SELECT"
+    m = _SQL_TABLE_RE.search(stripped)
+    return op, (m.group(1).lower() if m else "-")
+
+
+def _timed_sql(fn, sql: str, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    except sqlite3.Error as e:
+        op, _ = _sql_labels(sql)
+        inc(DB_ERRORS, {"op": op, "error": "locked" if "locked" in str(e).lower() else type(e).__name__})
+        raise
+    finally:
+        op, table = _sql_labels(sql)
+        observe(DB_LATENCY, time.perf_counter() - start, {"op": op, "table": table})
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return _timed_sql(sqlite3.Cursor.execute, sql, self, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _timed_sql(sqlite3.Cursor.executemany, sql, self, sql, seq_of_parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    """给每条 SQL 和 COMMIT 计时的连接类（Database.connection_factory）"""
+
+    def cursor(self, factory=TimedCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        return _timed_sql(sqlite3.Connection.commit, "COMMIT", self)
+
+
+def connection_factory():
+    """Database 使用的连接类（METRICS_DB_TIMING=false 时不计时）"""
+    if METRICS_ENABLED and env_bool("METRICS_DB_TIMING", True):
+        return TimedConnection
+    return sqlite3.Connection
+
+
+# ==================== 多进程共享存储 ====================
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _process_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MetricsStore:
+    """各进程快照文件（每个进程一个实例）"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.interval = max(1.0, float(os.getenv("METRICS_FLUSH_INTERVAL", "5") or 5))
+        # 快照超过该时间未更新视为进程已退出
+        self.stale_after = max(30.0, self.interval * 6)
+        self._lock = threading.Lock()
+        self._started = False
+        self._pid: Optional[int] = None
+        self._path: Optional[Path] = None
+        self.shared = False
+
+    def ensure_started(self):
+        # fork 之后（gunicorn worker）需要使用新的文件名并重新启动刷新线程
+        if self._started and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._started and self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # fork 出的子进程：继承的数据已由父进程上报，清空避免重复计数
+                registry.reset()
+            self._pid = os.getpid()
+            self._started = True
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._path = self.directory / f"{self._pid}-{uuid.uuid4().hex[:8]}.json"
+                self.shared = fcntl is not None
+            except OSError as e:
+                log.warning(f"指标目录不可用，只输出本进程指标: {e}")
+                self.shared = False
+            if not self.shared:
+                return
+            thread = threading.Thread(target=self._loop, daemon=True, name="MetricsFlusher")
+            thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log.debug(f"写入指标快照失败: {e}")
+
+    def _process_gauges(self):
+        registry.set(PROCESS_THREADS, threading.active_count())
+        rss = _process_rss()
+        if rss is not None:
+            registry.set(PROCESS_RSS, rss)
+
+    def flush(self):
+        if not self.shared or self._path is None or self._pid != os.getpid():
+            return
+        self._process_gauges()
+        data = registry.snapshot()
+        data["pid"] = self._pid
+        data["updated_at"] = time.time()
+        _write_json(self._path, data)
+
+    @contextmanager
+    def _exclusive(self):
+        fd = os.open(self.directory / ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def collect(self) -> Tuple[List[dict], dict]:
+        """返回 (存活进程快照列表, 已退出进程的累计数据)"""
+        if not self.shared:
+            self._process_gauges()
+            snap = registry.snapshot()
+            snap["pid"] = os.getpid()
+            return [snap], {}
+
+        self.flush()
+        now = time.time()
+        live: List[dict] = []
+        with self._exclusive():
+            archive_path = self.directory / "archive.json"
+            archive = _read_json(archive_path) or {"counters": [], "histograms": []}
+            archived = False
+            for path in self.directory.glob("*.json"):
+                if path.name == "archive.json":
+                    continue
+                data = _read_json(path)
+                if data is None:
+                    continue
+                if now - float(data.get("updated_at") or 0) > self.stale_after:
+                    # 进程已退出：计数并入 archive，仪表丢弃
+                    archive = _merge_totals([archive, data])
+                    archived = True
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+                    continue
+                live.append(data)
+            if archived:
+                _write_json(archive_path, archive)
+        return live, archive
+
+
+def _merge_totals(snapshots: Iterable[dict]) -> dict:
+    """合并计数器和直方图（求和）"""
+    counters: Dict[Tuple[str, LabelKey], float] = {}
+    histograms: Dict[Tuple[str, LabelKey], list] = {}
+    for snap in snapshots:
+        for name, labels, value in snap.get("counters") or []:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, buckets, total, count in snap.get("histograms") or []:
+            key = (name, tuple(map(tuple, labels)))
+            item = histograms.get(key)
+            if item is None or len(item[0]) != len(buckets):
+                histograms[key] = [list(buckets), total, count]
+            else:
+                item[0] = [a + b for a, b in zip(item[0], buckets)]
+                item[1] += total
+                item[2] += count
+    return {
+        "counters": [[n, list(map(list, k)), v] for (n, k), v in counters.items()],
+        "histograms": [[n, list(map(list, k)), h[0], h[1], h[2]] for (n, k), h in histograms.items()],
+    }
+
+
+def _merge_gauges(snapshots: Iterable[dict]) -> Dict[Tuple[str, LabelKey], float]:
+    gauges: Dict[Tuple[str, LabelKey], float] = {}
+    for snap in snapshots:
+        pid = str(snap.get("pid") or "")
+        for name, labels, value in snap.get("gauges") or []:
+            metric = _METRICS.get(name)
+            if metric is None:
+                continue
+            label_key = tuple(map(tuple, labels))
+            if metric.merge == "pid":
+                label_key = tuple(sorted(label_key + (("pid", pid),)))
+            key = (name, label_key)
+            if key not in gauges:
+                gauges[key] = value
+            elif metric.merge == "max":
+                gauges[key] = max(gauges[key], value)
+            else:
+                gauges[key] += value
+    return gauges
+
+
+_store = MetricsStore(Path(os.getenv("METRICS_DIR") or (DATA_DIR / "metrics")))
+
+
+def _flush_at_exit():
+    try:
+        _store.flush()
+    except Exception:
+        pass
+
+
+atexit.register(_flush_at_exit)
+
+
+def loop_last_success() -> Dict[str, float]:
+    """各后台任务最近一次成功完成的时间（合并所有存活进程，健康检查用）"""
+    live, _ = _store.collect()
+    result: Dict[str, float] = {}
+    for (name, labels), value in _merge_gauges(live).items():
+        if name == LOOP_LAST_SUCCESS:
+            result[dict(labels).get("loop", "")] = value
+    return result
+
+
+# ==================== 输出 ====================
+
+def _collect_backlog() -> Dict[Tuple[str, LabelKey], float]:
+    """抓取时查询积压数量（不写入进程快照，避免其他进程的旧值参与合并）"""
+    try:
+        from database import db
+
+        return {(BACKLOG, (("queue", name),)): float(value) for name, value in db.get_backlog_counts().items()}
+    except Exception as e:
+        log.warning(f"查询积压指标失败: {e}")
+        return {}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def render() -> str:
+    """合并所有进程的指标，输出 Prometheus 文本格式"""
+    backlog = _collect_backlog()
+    live, archive = _store.collect()
+    totals = _merge_totals(live + [archive])
+    gauges = _merge_gauges(live)
+    gauges.update(backlog)
+
+    by_name: Dict[str, List[tuple]] = {}
+    for name, labels, value in totals["counters"]:
+        by_name.setdefault(name, []).append((tuple(map(tuple, labels)), value))
+    for name, labels, buckets, total, count in totals["histograms"]:
+        by_name.setdefault(name, []).append((tuple(map(tuple, labels)), (buckets, total, count)))
+    for (name, labels), value in gauges.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines: List[str] = []
+    for name, metric in _METRICS.items():
+        samples = by_name.get(name)
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(samples, key=lambda s: s[0]):
+            if metric.kind == "histogram":
+                buckets, total, count = value
+                cumulative = 0
+                for bound, n in zip(list(metric.buckets) + [float("inf")], buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
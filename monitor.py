@@ -17,7 +17,9 @@ from typing import Dict, List, Optional
 from dataclasses import dataclass, asdict
 
 from database import db
+from leader_election import background_leader
 from logger import log
+import metrics
 import config
 
 
@@ -85,12 +87,19 @@ class AlertManager:
         # 保存到数据库
         import json
         with db.get_connection() as conn:
-            conn.execute("""
+            cursor = conn.execute("""
                 INSERT INTO system_alerts (level, category, title, message, metadata)
                 VALUES (?, ?, ?, ?, ?)
             """, (level, category, title, message, json.dumps(metadata or {})))
+            alert_id = cursor.lastrowid
             conn.commit()
 
+        # 推送到管理后台（SSE）
+        try:
+            db.append_event("alert", {"id": alert_id, "level": level, "category": category, "title": title, "message": message})
+        except Exception as e:
+            log.warning(f"告警事件写入失败: {e}")
+
         # 保存到内存（用于快速访问）
         self.alerts.append(alert)
         if len(self.alerts) > self.max_alerts:
@@ -417,13 +426,15 @@ monitor = Monitor()
 
 
 def run_monitor_loop(interval: int = 300):
-    """运行监控循环（每 5 分钟检查一次）"""
+    """运行监控循环（每 5 分钟检查一次，只有后台任务主节点执行）"""
     import threading
 
     def _loop():
         while True:
             try:
-                monitor.run_all_checks()
+                if background_leader.is_leader():
+                    with metrics.track_loop("monitor"):
+                        monitor.run_all_checks()
             except Exception as e:
                 log.error(f"监控循环出错: {e}")
 
@@ -0,0 +1,252 @@
+"""
+请求限流模块（GCRA）
+每个限流键（IP / 邮箱 / 兑换码前缀）只保存一个"理论到达时间"（TAT），存放在 mmap 共享文件的定长槽位表中，
+gunicorn 多个 worker 映射同一个文件，判断 + 更新在文件锁内完成，请求路径上不访问数据库。
+
+规则在 before_request 中按路由执行（业务逻辑之前），失败、格式错误的请求同样计数：
+  - redeem：/api/redeem、/api/redeem/batch，按 IP，额度为 redemption.rate_limit_per_hour；
+            批量兑换按兑换码数量扣减，额度不足时只放行剩余额度内的部分
+  - redeem_email：同上，按邮箱（RATE_LIMIT_REDEEM_PER_EMAIL，默认关闭）
+  - redeem_prefix：同上，按兑换码前缀（RATE_LIMIT_REDEEM_PER_CODE_PREFIX，默认关闭，用于限制单个批次的码被集中刷取）
+  - verify：/api/verify，按 IP
+  - user：/api/user/*，按 IP
+  - status：异步兑换状态查询，按 IP
+
+规则格式为 "次数/周期"，周期可写 second/minute/hour/day 或秒数，如 "60/minute"、"10/3600"。
+
+清除某个 IP / 邮箱的限流状态:
+
+    python -m rate_limit reset 1.2.3.4
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 等平台没有 fcntl，退化为进程内限流
+    fcntl = None
+
+import config
+from config import env_bool
+from logger import log
+
+
+# 槽位：键哈希（0 表示空）+ TAT（毫秒时间戳）
+_SLOT = struct.Struct("<Qq")
+# 线性探测的最大步数，找不到空位时覆盖其中 TAT 最早的槽位
+_PROBE = 32
+
+_PERIODS = {"s": 1, "sec": 1, "second": 1, "m": 60, "min": 60, "minute": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+
+@dataclass(frozen=True)
+class RateRule:
+    name: str
+    limit: int
+    period: float  # 秒
+
+    @property
+    def interval_ms(self) -> float:
+        return self.period * 1000 / self.limit
+
+
+@dataclass
+class RateDecision:
+    allowed: bool
+    granted: int
+    remaining: int
+    retry_after: float  # 秒，allowed 时为 0
+    limit: int
+
+
+def parse_rule(name: str, spec: str | None) -> Optional[RateRule]:
+    """解析 "次数/周期"，空值或 0 表示不限流"""
+    spec = (spec or "").strip().lower()
+    if not spec:
+        return None
+    m = re.fullmatch(r"(\d+)\s*/\s*(\d*)\s*([a-z]*)", spec)
+    if not m:
+        log.warning(f"限流规则格式错误，已忽略: {name}={spec}")
+        return None
+    limit = int(m.group(1))
+    count = int(m.group(2)) if m.group(2) else 1
+    unit = m.group(3)
+    if unit not in _PERIODS and unit.endswith("s"):
+        unit = unit[:-1]  # minutes / hours
+    if unit and unit not in _PERIODS:
+        log.warning(f"限流规则周期无法识别，已忽略: {name}={spec}")
+        return None
+    period = count * _PERIODS.get(unit, 1)
+    if limit <= 0 or period <= 0:
+        return None
+    return RateRule(name, limit, float(period))
+
+
+class GCRALimiter:
+    """跨进程 GCRA 限流器（mmap 槽位表；path 为空或无 fcntl 时只在本进程内生效）"""
+
+    def __init__(self, path: str | None, *, slots: int = 8192):
+        self.slots = max(_PROBE, int(slots))
+        self._lock = threading.Lock()
+        self._fd: int | None = None
+        self._mm: mmap.mmap | bytearray = bytearray(self.slots * _SLOT.size)
+
+        if not path or fcntl is None:
+            return
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            size = self.slots * _SLOT.size
+            if os.fstat(fd).st_size < size:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self._fd = fd
+        except Exception as e:
+            log.warning(f"限流共享文件不可用，改为进程内限流: {e}")
+            self._fd = None
+
+    @property
+    def shared(self) -> bool:
+        return self._fd is not None
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        value = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+        return value or 1
+
+    def _find_slot(self, key_hash: int, now_ms: int) -> tuple[int, int]:
+        """返回 (槽位, 已保存的 TAT)；新键返回可复用的空位/过期槽位，TAT 为 0"""
+        start = key_hash % self.slots
+        reusable = None
+        oldest = (None, None)
+        for step in range(_PROBE):
+            slot = (start + step) % self.slots
+            stored_hash, tat = _SLOT.unpack_from(self._mm, slot * _SLOT.size)
+            if stored_hash == key_hash:
+                return slot, tat
+            if reusable is None and (stored_hash == 0 or tat <= now_ms):
+                reusable = slot
+            if oldest[1] is None or tat < oldest[1]:
+                oldest = (slot, tat)
+        return (reusable if reusable is not None else oldest[0]), 0
+
+    def take(self, rule: RateRule, key: str, *, cost: int = 1, partial: bool = False) -> RateDecision:
+        """
+        尝试扣减 cost 个额度
+
+        Args:
+            partial: True 时额度不足也放行剩余部分（granted < cost）
+        """
+        cost = max(1, int(cost))
+        interval = rule.interval_ms
+        period_ms = rule.period * 1000
+        key_hash = self._hash(f"{rule.name}:{key}")
+        with self._lock:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now_ms = int(time.time() * 1000)
+                slot, stored = self._find_slot(key_hash, now_ms)
+                tat = max(stored, now_ms)
+                available = max(0, math.floor((period_ms - (tat - now_ms)) / interval))
+                granted = min(cost, available) if partial else (cost if cost <= available else 0)
+                if granted:
+                    tat += int(math.ceil(granted * interval))
+                    _SLOT.pack_into(self._mm, slot * _SLOT.size, key_hash, tat)
+            finally:
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        remaining = available - granted
+        retry_after = 0.0
+        if granted < cost:
+            # 下一个额度（整单拒绝时为整单额度）恢复所需时间
+            need = 1 if partial else cost
+            retry_after = max(0.0, (tat - period_ms + need * interval - now_ms) / 1000)
+        return RateDecision(granted == cost, granted, remaining, retry_after, rule.limit)
+
+    def reset(self, rule: RateRule, key: str):
+        """清除某个键的限流状态（管理操作）"""
+        key_hash = self._hash(f"{rule.name}:{key}")
+        with self._lock:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                slot, stored = self._find_slot(key_hash, int(time.time() * 1000))
+                if stored:
+                    _SLOT.pack_into(self._mm, slot * _SLOT.size, 0, 0)
+            finally:
+                if self._fd is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_rules(specs: tuple) -> Dict[str, RateRule]:
+    rules = {}
+    for name, spec in specs:
+        rule = parse_rule(name, spec)
+        if rule is not None:
+            rules[name] = rule
+    return rules
+
+
+def load_rules() -> Dict[str, RateRule]:
+    """当前限流规则（按配置值缓存解析结果，兑换额度跟随配置热加载）"""
+    per_hour = int(config.get("redemption.rate_limit_per_hour", 10) or 0)
+    return _parse_rules((
+        ("redeem", os.getenv("RATE_LIMIT_REDEEM") or (f"{per_hour}/hour" if per_hour > 0 else "")),
+        ("redeem_email", os.getenv("RATE_LIMIT_REDEEM_PER_EMAIL", "")),
+        ("redeem_prefix", os.getenv("RATE_LIMIT_REDEEM_PER_CODE_PREFIX", "")),
+        ("verify", os.getenv("RATE_LIMIT_VERIFY", "60/minute")),
+        ("user", os.getenv("RATE_LIMIT_USER", "30/minute")),
+        ("status", os.getenv("RATE_LIMIT_STATUS", "240/minute")),
+    ))
+
+
+RATE_LIMIT_ENABLED = env_bool("RATE_LIMIT_ENABLED", True)
+
+# 全局实例
+limiter = GCRALimiter(
+    str(config.DATA_DIR / "rate_limit.state"),
+    slots=int(os.getenv("RATE_LIMIT_SLOTS", "8192") or 8192),
+)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="请求限流管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reset_parser = sub.add_parser("reset", help="清除 IP / 邮箱的限流状态")
+    reset_parser.add_argument("key", help="IP 或邮箱")
+    reset_parser.add_argument("--rule", help="只清除指定规则（默认全部）")
+    args = parser.parse_args(argv)
+
+    key = args.key.strip()
+    if "@" in key:
+        key = key.lower()
+    rules = [r for name, r in load_rules().items() if not args.rule or name == args.rule]
+    for rule in rules:
+        limiter.reset(rule, key)
+    print(f"✅ 已清除 {key} 的限流状态（{', '.join(r.name for r in rules) or '无匹配规则'}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+异步兑换任务模块
+/api/redeem 异步模式：请求内只做本地校验和兑换码预占，
+席位检查、邀请、统计刷新等上游调用交给后台线程执行，客户端通过任务 ID 轮询结果
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+import config
+from database import db
+from logger import log
+import metrics
+from redemption_service import RedemptionService
+
+
+# 任务终态
+TERMINAL_STATUSES = {"success", "failed"}
+
+
+class RedemptionJobRunner:
+    """异步兑换任务调度器（每个进程一个实例）"""
+
+    def __init__(self):
+        self._executor: ThreadPoolExecutor | None = None
+        self._worker_started = False
+        self._lock = threading.Lock()
+
+    def submit(self, code: str, email: str, ip_address: Optional[str] = None) -> Dict[str, Any]:
+        """
+        校验并预占兑换码，成功后创建排队任务
+
+        Returns:
+            成功: {"success": True, "job_id": ..., "status": "queued"}
+            失败: 与 RedemptionService.redeem 相同的错误结构
+        """
+        reservation = RedemptionService.reserve(code, email, ip_address)
+        if not reservation["success"]:
+            return reservation
+
+        code_info = reservation["code_info"]
+        job_id = uuid.uuid4().hex
+        try:
+            db.create_redemption_job(
+                job_id=job_id,
+                code=reservation["code"],
+                email=reservation["email"],
+                ip_address=ip_address,
+                code_id=code_info["id"],
+                team_name=code_info["team_name"],
+                lock_id=reservation["lock_id"],
+            )
+        except Exception as e:
+            db.release_reserved_code(reservation["code"], lock_by=reservation["lock_id"])
+            log.error(f"创建兑换任务失败: {e}")
+            return {"success": False, "error": f"系统错误: {str(e)}", "code": "SYSTEM_ERROR"}
+
+        self._dispatch(job_id)
+        return {"success": True, "job_id": job_id, "status": "queued"}
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态（任意 worker 均可查询）"""
+        job = db.get_redemption_job(job_id)
+        if not job:
+            return None
+
+        data: Dict[str, Any] = {
+            "job_id": job["id"],
+            "status": job["status"],
+            "email": job["email"],
+            "team": job["team_name"],
+            "created_at": job["created_at"],
+            "finished_at": job.get("finished_at"),
+        }
+        if job.get("result"):
+            try:
+                data["result"] = json.loads(job["result"])
+            except Exception:
+                data["result"] = None
+        return data
+
+    def _dispatch(self, job_id: str):
+        """交给本进程线程池执行；未启动时由其他进程的兜底轮询领取"""
+        executor = self._executor
+        if executor is None:
+            return
+        try:
+            executor.submit(self._run, job_id)
+        except RuntimeError:
+            # 线程池已关闭（进程退出中），任务保持 queued 由其他进程领取
+            pass
+
+    def _run(self, job_id: str):
+        """执行单个任务"""
+        lock_seconds = int(config.get("redemption.code_lock_seconds", 120) or 120)
+        job = db.claim_redemption_job(job_id, lock_seconds=lock_seconds)
+        if not job:
+            return
+
+        try:
+            result = RedemptionService.fulfill(
+                job["code"],
+                job["email"],
+                job.get("ip_address"),
+                lock_id=job["lock_id"],
+                code_info={"id": job["code_id"], "team_name": job["team_name"]},
+            )
+        except Exception as e:
+            log.error(f"兑换任务 {job_id} 执行出错: {e}")
+            result = {"success": False, "error": f"系统错误: {str(e)}", "code": "SYSTEM_ERROR"}
+
+        try:
+            db.finish_redemption_job(job_id, status="success" if result.get("success") else "failed", result=result)
+        except Exception as e:
+            log.error(f"写入兑换任务结果失败: {e}")
+
+    def start_worker(self, *, max_workers: int = 4, poll_interval: int = 5, job_timeout: int = 600):
+        """启动任务线程池和兜底轮询线程
+
+        Args:
+            max_workers: 并发执行的任务数
+            poll_interval: 兜底轮询间隔（秒）
+            job_timeout: running 状态超过该时间视为遗留任务（秒）
+        """
+        with self._lock:
+            if self._worker_started:
+                return
+            self._worker_started = True
+            self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="redeem-job")
+
+        def _poller():
+            log.info(f"异步兑换任务线程已启动（并发 {max_workers}）", icon="start")
+            while True:
+                try:
+                    # 领取提交后未被及时执行的任务（其他 worker 提交/进程重启遗留）
+                    with metrics.track_loop("redemption_jobs"):
+                        for job_id in db.list_queued_redemption_jobs(older_than_seconds=poll_interval, limit=20):
+                            self._dispatch(job_id)
+                        db.fail_stale_redemption_jobs(timeout_seconds=job_timeout)
+                except Exception as e:
+                    log.warning(f"异步兑换任务轮询出错: {e}")
+                time.sleep(poll_interval)
+
+        thread = threading.Thread(target=_poller, daemon=True, name="RedemptionJobPoller")
+        thread.start()
+
+
+# 全局实例
+redemption_job_runner = RedemptionJobRunner()
+
+
+def start_redemption_job_runner():
+    """启动异步兑换任务执行线程（并发数通过 REDEEM_ASYNC_WORKERS 配置）"""
+    max_workers = int(os.getenv("REDEEM_ASYNC_WORKERS", "4") or 4)
+    redemption_job_runner.start_worker(max_workers=max_workers)
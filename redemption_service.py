@@ -4,12 +4,14 @@
 """
 
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 from database import db
 from team_service import batch_invite_to_team, get_team_stats
 from logger import log
 import config
+import code_format
 from date_utils import add_months_same_day
 import os
 
@@ -32,12 +34,32 @@ class RedemptionService:
         Returns:
             兑换结果字典
         """
+        reservation = RedemptionService.reserve(code, email, ip_address)
+        if not reservation["success"]:
+            return reservation
+
+        return RedemptionService.fulfill(
+            reservation["code"],
+            reservation["email"],
+            ip_address,
+            lock_id=reservation["lock_id"],
+            code_info=reservation["code_info"],
+        )
+
+    @staticmethod
+    def reserve(
+        code: str, email: str, ip_address: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        兑换第一阶段：只做本地校验并预占兑换码（不访问上游）
+
+        Returns:
+            成功: {"success": True, "code", "email", "lock_id", "code_info"}
+            失败: 与 redeem 相同的错误结构
+        """
         code = (code or "").strip().upper()
         email = (email or "").strip().lower()
 
-        lock_id: str | None = None
-        reserved = False
-
         try:
             # 1. 验证邮箱格式
             if not RedemptionService._validate_email(email):
@@ -47,14 +69,12 @@ class RedemptionService:
                     "code": "INVALID_EMAIL",
                 }
 
-            # 2. 检查IP限流
-            rate_limit = config.get("redemption.rate_limit_per_hour", 10)
-            if ip_address and db.count_ip_redemptions(ip_address) >= rate_limit:
-                return {
-                    "success": False,
-                    "error": f"操作过于频繁，请1小时后再试 (限制: {rate_limit}次/小时)",
-                    "code": "RATE_LIMIT",
-                }
+            # 1.1 兑换码格式/校验段本地校验（格式错误或伪造的码不访问数据库）
+            code_ok, code_error = code_format.precheck_code(code)
+            if not code_ok:
+                return {"success": False, "error": code_error, "code": "INVALID_CODE"}
+
+            # 2. IP 限流在 Web 请求入口执行（rate_limit.py，失败的请求同样计数）
 
             # 3. 检查邮箱是否已兑换
             if db.check_email_redeemed(email):
@@ -64,14 +84,46 @@ class RedemptionService:
                     "code": "EMAIL_ALREADY_REDEEMED",
                 }
 
-            # 4. 预占兑换码（数据库级并发锁）
+            # 4. 预占兑换码使用名额（数据库级，多次使用的兑换码可并发兑换）
             lock_id = uuid.uuid4().hex
             lock_seconds = int(config.get("redemption.code_lock_seconds", 120) or 120)
             ok, message, code_info = db.reserve_code(code, lock_by=lock_id, lock_seconds=lock_seconds)
             if not ok or not code_info:
                 return {"success": False, "error": message, "code": "INVALID_CODE"}
-            reserved = True
 
+            return {
+                "success": True,
+                "code": code,
+                "email": email,
+                "lock_id": lock_id,
+                "code_info": code_info,
+            }
+
+        except Exception as e:
+            log.error(f"兑换过程出错: {e}")
+            return {
+                "success": False,
+                "error": f"系统错误: {str(e)}",
+                "code": "SYSTEM_ERROR",
+            }
+
+    @staticmethod
+    def fulfill(
+        code: str,
+        email: str,
+        ip_address: Optional[str] = None,
+        *,
+        lock_id: str,
+        code_info: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        兑换第二阶段：检查席位、发送邀请并消费预占的兑换码
+
+        调用前必须已通过 reserve 预占兑换码；无论成功失败都会消费或释放预占名额。
+        """
+        reserved = True
+
+        try:
             team_name = code_info["team_name"]
 
             # 5. 检查Team席位
@@ -102,10 +154,11 @@ class RedemptionService:
                 # 8. 更新兑换记录状态为成功
                 db.update_redemption_status(redemption_id, "success")
 
-                # 9. 消费预占的兑换码（增加使用次数并释放锁）
+                # 9. 消费预占的名额（增加使用次数）
                 if not db.consume_reserved_code(code, lock_by=lock_id):
-                    # 兜底：避免因锁过期导致未计数
-                    db.increment_code_usage(code)
+                    # 兜底：避免因名额过期被清理导致未计数（已达 max_uses 时不再计数）
+                    if not db.increment_code_usage(code):
+                        log.warning(f"兑换码 {code} 名额已过期且已达使用上限，{email} 的兑换未计入使用次数")
                     db.release_reserved_code(code, lock_by=lock_id)
                 reserved = False
 
@@ -113,67 +166,10 @@ class RedemptionService:
                 RedemptionService._update_team_stats(team_name)
 
                 # 11. 记录"成员租约"（用于按月到期自动转移到新 Team）
-                # 只为启用了 auto_transfer 的兑换码创建租约
-                try:
-                    code_info = db.get_code(code)
-                    auto_transfer_enabled = code_info.get("auto_transfer_enabled", 1) if code_info else 1
-
-                    if auto_transfer_enabled:
-                        now = datetime.now()
-                        team_cfg = config.resolve_team(team_name) or {}
-                        team_account_id = team_cfg.get("account_id")
-                        term_months = int(os.getenv("AUTO_TRANSFER_TERM_MONTHS", "1") or 1)
-                        expires_at = add_months_same_day(now, max(1, min(24, term_months)))
-
-                        existed = db.get_member_lease(email) is not None
-                        # 新模型: created_at=兑换时间, invited_at=发送邀请时间, joined_at=NULL (等待同步)
-                        db.upsert_member_lease(
-                            email=email,
-                            team_name=team_name,
-                            team_account_id=team_account_id,
-                            created_at=now,
-                            invited_at=now,
-                            expires_at=expires_at,
-                            status="pending",
-                        )
-                        if not existed:
-                            db.add_member_lease_event(
-                                email=email,
-                                action="created",
-                                from_team=None,
-                                to_team=team_name,
-                                message=f"创建租约：到期 {expires_at.date().isoformat()}（实际到期日将以 joined_at 为准）",
-                            )
-                    else:
-                        log.info(f"兑换码 {code} 的 auto_transfer_enabled=0，跳过创建租约", icon="info")
-                except Exception as e:
-                    log.warning(f"写入成员租约失败（不影响兑换流程）: {e}")
+                RedemptionService._record_member_lease(code, email, team_name)
 
                 # 12. 触发后台同步 joined_at（延迟执行，给用户时间接受邀请）
-                try:
-                    from threading import Thread
-                    import time as time_module
-
-                    def delayed_sync_join(target_email: str, delay_seconds: int = 60):
-                        """延迟同步 joined_at"""
-                        try:
-                            time_module.sleep(delay_seconds)
-                            from join_sync_service import JoinSyncService
-                            for attempt in range(5):  # 最多尝试5次
-                                result = JoinSyncService.sync_single_email(target_email, record_events=True)
-                                if result.get("synced", 0) > 0:
-                                    log.info(f"自动同步 joined_at 成功: {target_email}")
-                                    break
-                                # 等待3分钟后重试
-                                time_module.sleep(180)
-                        except Exception as sync_err:
-                            log.warning(f"自动同步 joined_at 失败: {sync_err}")
-
-                    # 启动后台线程，60秒后开始同步
-                    sync_thread = Thread(target=delayed_sync_join, args=(email, 60), daemon=True)
-                    sync_thread.start()
-                except Exception as sync_setup_err:
-                    log.warning(f"启动同步任务失败: {sync_setup_err}")
+                RedemptionService._schedule_join_sync(email)
 
                 log.info(f"{email} 兑换成功", icon="success")
 
@@ -216,6 +212,276 @@ class RedemptionService:
                 except Exception:
                     pass
 
+    @staticmethod
+    def redeem_batch(
+        items: List[Dict[str, str]], ip_address: Optional[str] = None, *, rate_budget: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量兑换：一次事务预占所有兑换码，按 Team 分组后
+        每个 Team 只做一次席位检查和一次 batch_invite_to_team，最后统一写回结果
+
+        Args:
+            items: [{"email": ..., "code": ...}]
+            ip_address: 用户IP地址 (可选)
+            rate_budget: 本次请求获得的限流额度（None 表示不限制）
+
+        Returns:
+            与 items 顺序一致的结果列表，单项结构与 redeem 相同，另带 email/code 字段
+        """
+        entries: List[Dict[str, Any]] = []
+        for item in items:
+            entries.append(
+                {
+                    "code": (item.get("code") or "").strip().upper(),
+                    "email": (item.get("email") or "").strip().lower(),
+                    "result": None,
+                }
+            )
+
+        def _fail(entry: Dict[str, Any], error: str, error_code: str):
+            entry["result"] = {"success": False, "error": error, "code": error_code}
+
+        lock_id = uuid.uuid4().hex
+        reserved: List[Dict[str, Any]] = []
+
+        try:
+            # 1. 验证邮箱格式 / 兑换码格式（本地校验，不访问数据库）
+            for entry in entries:
+                if not RedemptionService._validate_email(entry["email"]):
+                    _fail(entry, "邮箱格式无效", "INVALID_EMAIL")
+                elif not entry["code"]:
+                    _fail(entry, "兑换码不能为空", "INVALID_CODE")
+                else:
+                    code_ok, code_error = code_format.precheck_code(entry["code"])
+                    if not code_ok:
+                        _fail(entry, code_error, "INVALID_CODE")
+
+            # 2. IP 限流：请求入口已按兑换码数量扣减额度（rate_limit.py），超出额度的部分直接拒绝
+            if rate_budget is not None:
+                remaining = rate_budget
+                for entry in entries:
+                    if entry["result"] is not None:
+                        continue
+                    if remaining <= 0:
+                        _fail(entry, "操作过于频繁，请稍后再试", "RATE_LIMIT")
+                    else:
+                        remaining -= 1
+
+            # 3. 检查邮箱是否已兑换（一次查询）
+            pending = [e for e in entries if e["result"] is None]
+            redeemed_emails = db.list_redeemed_emails(list({e["email"] for e in pending}))
+            for entry in pending:
+                if entry["email"] in redeemed_emails:
+                    _fail(entry, "该邮箱已经兑换过席位", "EMAIL_ALREADY_REDEEMED")
+
+            # 4. 同一事务内预占全部兑换码
+            pending = [e for e in entries if e["result"] is None]
+            lock_seconds = int(config.get("redemption.code_lock_seconds", 120) or 120)
+            reservations = db.reserve_codes(
+                [e["code"] for e in pending], lock_by=lock_id, lock_seconds=lock_seconds
+            )
+
+            # 多次使用的兑换码在同一批次中可出现多次，每次各占一个名额
+            claimed_emails: set = set()
+            extra_codes: List[str] = []
+            for entry, (ok, message, code_info) in zip(pending, reservations):
+                if not ok or not code_info:
+                    _fail(entry, message, "INVALID_CODE")
+                    continue
+                # 同一邮箱只兑换一个席位，多余的兑换码释放回去
+                if entry["email"] in claimed_emails:
+                    extra_codes.append(entry["code"])
+                    _fail(entry, "该邮箱已经兑换过席位", "EMAIL_ALREADY_REDEEMED")
+                    continue
+                claimed_emails.add(entry["email"])
+                entry["code_info"] = code_info
+                reserved.append(entry)
+
+            if extra_codes:
+                db.release_reserved_codes(extra_codes, lock_by=lock_id)
+
+            # 5. 按 Team 分组，各 Team 并行处理
+            groups: Dict[str, List[Dict[str, Any]]] = {}
+            for entry in reserved:
+                groups.setdefault(entry["code_info"]["team_name"], []).append(entry)
+
+            if len(groups) == 1:
+                team_name, group = next(iter(groups.items()))
+                RedemptionService._fulfill_team_group(team_name, group, ip_address, lock_id)
+            elif groups:
+                with ThreadPoolExecutor(max_workers=min(len(groups), 4)) as executor:
+                    futures = [
+                        executor.submit(RedemptionService._fulfill_team_group, team_name, group, ip_address, lock_id)
+                        for team_name, group in groups.items()
+                    ]
+                    for future in futures:
+                        future.result()
+
+        except Exception as e:
+            log.error(f"批量兑换过程出错: {e}")
+            for entry in entries:
+                if entry["result"] is None:
+                    _fail(entry, f"系统错误: {str(e)}", "SYSTEM_ERROR")
+        finally:
+            # 兜底：释放本批次中尚未消费或释放的预占名额
+            leftover = [e["code"] for e in reserved if not e.get("settled")]
+            if leftover:
+                try:
+                    db.release_reserved_codes(leftover, lock_by=lock_id)
+                except Exception:
+                    pass
+
+        return [dict(entry["result"], email=entry["email"], code=entry["code"]) for entry in entries]
+
+    @staticmethod
+    def _fulfill_team_group(
+        team_name: str, group: List[Dict[str, Any]], ip_address: Optional[str], lock_id: str
+    ):
+        """批量兑换：处理同一 Team 下的所有预占项（一次席位检查 + 一次邀请）"""
+        try:
+            # 席位检查：只邀请可用席位数以内的部分，其余直接释放
+            seat_check = RedemptionService._check_team_seats(team_name)
+            seats = int(seat_check.get("seats", 0)) if seat_check["available"] else 0
+            accepted, rejected = group[:seats], group[seats:]
+            if rejected:
+                db.release_reserved_codes([e["code"] for e in rejected], lock_by=lock_id)
+                for entry in rejected:
+                    entry["settled"] = True
+                message = seat_check["message"] if not seat_check["available"] else "Team席位不足"
+                for entry in rejected:
+                    entry["result"] = {"success": False, "error": message, "code": "NO_SEATS"}
+            if not accepted:
+                return
+
+            # 创建兑换记录
+            redemption_ids = db.create_redemptions(
+                [
+                    {
+                        "code_id": e["code_info"]["id"],
+                        "email": e["email"],
+                        "team_name": team_name,
+                        "ip_address": ip_address,
+                    }
+                    for e in accepted
+                ],
+                status="inviting",
+            )
+            for entry, redemption_id in zip(accepted, redemption_ids):
+                entry["redemption_id"] = redemption_id
+
+            # 一次邀请整组邮箱
+            team_config = config.resolve_team(team_name)
+            emails = [e["email"] for e in accepted]
+            log.info(f"正在批量邀请 {len(emails)} 个邮箱到 Team {team_name}...")
+            if team_config:
+                invite_result = batch_invite_to_team(emails, team_config)
+            else:
+                invite_result = {
+                    "success": [],
+                    "failed": [{"email": e, "error": f"Team {team_name} 配置不存在"} for e in emails],
+                }
+            succeeded_emails, failed_emails = RedemptionService._split_invite_result(invite_result)
+
+            succeeded: List[Dict[str, Any]] = []
+            failed: List[Dict[str, Any]] = []
+            for entry in accepted:
+                if entry["email"] in succeeded_emails:
+                    succeeded.append(entry)
+                else:
+                    entry["error"] = failed_emails.get(entry["email"], "未知错误")
+                    failed.append(entry)
+
+            # 统一写回结果（同一事务）
+            db.finalize_redemption_batch(
+                lock_by=lock_id,
+                succeeded=[{"redemption_id": e["redemption_id"], "code": e["code"]} for e in succeeded],
+                failed=[{"redemption_id": e["redemption_id"], "code": e["code"], "error": e["error"]} for e in failed],
+            )
+            for entry in accepted:
+                entry["settled"] = True
+
+            redeemed_at = datetime.now().isoformat()
+            for entry in failed:
+                log.error(f"{entry['email']} 邀请失败: {entry['error']}")
+                entry["result"] = {
+                    "success": False,
+                    "error": f"邀请失败: {entry['error']}",
+                    "code": "INVITE_FAILED",
+                }
+            for entry in succeeded:
+                log.info(f"{entry['email']} 兑换成功", icon="success")
+                entry["result"] = {
+                    "success": True,
+                    "message": f"兑换成功！邀请邮件已发送到 {entry['email']}",
+                    "data": {"email": entry["email"], "team": team_name, "redeemed_at": redeemed_at},
+                }
+
+            if succeeded:
+                RedemptionService._update_team_stats(team_name)
+                for entry in succeeded:
+                    RedemptionService._record_member_lease(
+                        entry["code"], entry["email"], team_name, code_info=entry["code_info"]
+                    )
+                    RedemptionService._schedule_join_sync(entry["email"])
+
+        except Exception as e:
+            log.error(f"Team {team_name} 批量兑换出错: {e}")
+            for entry in group:
+                if entry["result"] is None:
+                    entry["result"] = {"success": False, "error": f"系统错误: {str(e)}", "code": "SYSTEM_ERROR"}
+
+    @staticmethod
+    def _record_member_lease(
+        code: str, email: str, team_name: str, code_info: Optional[Dict[str, Any]] = None
+    ):
+        """记录成员租约（只为启用了 auto_transfer 的兑换码创建），失败不影响兑换流程"""
+        try:
+            if code_info is None:
+                code_info = db.get_code(code)
+            auto_transfer_enabled = code_info.get("auto_transfer_enabled", 1) if code_info else 1
+
+            if not auto_transfer_enabled:
+                log.info(f"兑换码 {code} 的 auto_transfer_enabled=0，跳过创建租约", icon="info")
+                return
+
+            now = datetime.now()
+            team_cfg = config.resolve_team(team_name) or {}
+            team_account_id = team_cfg.get("account_id")
+            term_months = int(os.getenv("AUTO_TRANSFER_TERM_MONTHS", "1") or 1)
+            expires_at = add_months_same_day(now, max(1, min(24, term_months)))
+
+            existed = db.get_member_lease(email) is not None
+            # 新模型: created_at=兑换时间, invited_at=发送邀请时间, joined_at=NULL (等待同步)
+            db.upsert_member_lease(
+                email=email,
+                team_name=team_name,
+                team_account_id=team_account_id,
+                created_at=now,
+                invited_at=now,
+                expires_at=expires_at,
+                status="pending",
+            )
+            if not existed:
+                db.add_member_lease_event(
+                    email=email,
+                    action="created",
+                    from_team=None,
+                    to_team=team_name,
+                    message=f"创建租约：到期 {expires_at.date().isoformat()}（实际到期日将以 joined_at 为准）",
+                )
+        except Exception as e:
+            log.warning(f"写入成员租约失败（不影响兑换流程）: {e}")
+
+    @staticmethod
+    def _schedule_join_sync(email: str):
+        """登记延迟同步 joined_at（60 秒后首次执行，之后每 3 分钟重试，最多 5 次）"""
+        try:
+            from join_sync_service import JoinSyncService
+
+            JoinSyncService.schedule_delayed_sync(email, delay_seconds=60, retry_interval=180, max_attempts=5)
+        except Exception as sync_setup_err:
+            log.warning(f"登记同步任务失败: {sync_setup_err}")
+
     @staticmethod
     def verify_code_info(code: str) -> Dict[str, Any]:
         """
@@ -224,12 +490,17 @@ class RedemptionService:
         Returns:
             验证结果字典
         """
-        valid, message = db.verify_code(code)
+        code_ok, code_error = code_format.precheck_code(code)
+        if not code_ok:
+            return {"valid": False, "error": code_error}
+
+        # 兑换码元数据走跨 worker 缓存（状态/使用次数变化时自动失效）
+        valid, message = db.verify_code(code, cached=True)
 
         if not valid:
             return {"valid": False, "error": message}
 
-        code_info = db.get_code(code)
+        code_info = db.get_code_cached(code)
 
         return {
             "valid": True,
@@ -301,11 +572,11 @@ class RedemptionService:
             # 调用batch_invite_to_team (支持单个邮箱)
             result = batch_invite_to_team([email], team_config)
 
-            if email in result.get("success", []):
+            succeeded, failed = RedemptionService._split_invite_result(result)
+            if email.lower() in succeeded:
                 return {"success": True, "message": "邀请成功"}
-            elif email in result.get("failed", {}):
-                error = result["failed"][email]
-                return {"success": False, "error": error}
+            elif email.lower() in failed:
+                return {"success": False, "error": failed[email.lower()]}
             else:
                 return {"success": False, "error": "未知错误"}
 
@@ -313,6 +584,16 @@ class RedemptionService:
             log.error(f"邀请到Team失败: {e}")
             return {"success": False, "error": str(e)}
 
+    @staticmethod
+    def _split_invite_result(result: Dict[str, Any]) -> tuple[set, Dict[str, str]]:
+        """把 batch_invite_to_team 的返回值整理为 (成功邮箱集合, {失败邮箱: 错误})，邮箱统一小写"""
+        succeeded = {(e or "").strip().lower() for e in result.get("success", [])}
+        failed: Dict[str, str] = {}
+        for item in result.get("failed", []):
+            if isinstance(item, dict):
+                failed[(item.get("email") or "").strip().lower()] = item.get("error") or "未知错误"
+        return succeeded, failed
+
     @staticmethod
     def _update_team_stats(team_name: str):
         """更新Team统计信息到数据库"""
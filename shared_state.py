@@ -0,0 +1,86 @@
+"""
+跨进程共享状态模块
+基于 mmap 文件的版本计数器：gunicorn 多个 worker 映射同一个文件，
+写入方递增计数器后，其他 worker 读取时立即可见（用于本地缓存失效）
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows 等平台没有 fcntl，退化为进程内计数
+    fcntl = None
+
+
+_SLOT = struct.Struct("<Q")
+
+
+class SharedCounters:
+    """共享版本计数器（固定槽位，槽位 0 为全局版本）"""
+
+    def __init__(self, path: str | None, *, slots: int = 1024):
+        self.slots = max(2, int(slots))
+        self._lock = threading.Lock()
+        self._local = [0] * self.slots
+        self._fd: int | None = None
+        self._mm: mmap.mmap | None = None
+
+        if not path or fcntl is None:
+            return
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            size = self.slots * _SLOT.size
+            if os.fstat(fd).st_size < size:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            self._fd = fd
+        except Exception:
+            self._mm = None
+            self._fd = None
+
+    @property
+    def shared(self) -> bool:
+        """是否为跨进程共享（False 时仅本进程可见）"""
+        return self._mm is not None
+
+    def slot_for(self, key: str) -> int:
+        """按 key 计算槽位（1..slots-1）"""
+        return zlib.crc32(key.encode("utf-8")) % (self.slots - 1) + 1
+
+    def get(self, slot: int) -> int:
+        if self._mm is None:
+            return self._local[slot]
+        return _SLOT.unpack_from(self._mm, slot * _SLOT.size)[0]
+
+    def bump(self, slot: int, delta: int = 1) -> int:
+        """递增指定槽位的版本号（也可作为跨进程累加计数器使用）"""
+        with self._lock:
+            if self._mm is None:
+                self._local[slot] += delta
+                return self._local[slot]
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                value = _SLOT.unpack_from(self._mm, slot * _SLOT.size)[0] + delta
+                _SLOT.pack_into(self._mm, slot * _SLOT.size, value)
+                return value
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def version(self, key: str) -> tuple[int, int]:
+        """返回 (全局版本, key 所在槽位版本)，任一变化即视为失效"""
+        return self.get(0), self.get(self.slot_for(key))
+
+    def invalidate(self, key: str | None = None):
+        """使 key 失效；key 为空时使全部失效"""
+        self.bump(self.slot_for(key) if key else 0)
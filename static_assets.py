@@ -0,0 +1,158 @@
+"""
+静态页面与资源分发
+优先返回 build_assets.py 的构建产物（static/dist）：
+  - 指纹资源 /assets/<name>.<hash>.css|js：长期缓存（immutable）
+  - 页面 HTML：no-cache + ETag，未变化时返回 304
+  - 按 Accept-Encoding 选择预压缩的 br / gzip 版本
+未构建或源文件在构建后被修改时，回退到 static/ 源文件（同样带 ETag，按 mtime 缓存）。
+构建产物在进程内缓存，请求路径上不做磁盘读取。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Optional
+
+from flask import Response, request
+
+from logger import log
+
+
+BASE_DIR = Path(__file__).parent
+SOURCE_DIR = BASE_DIR / "static"
+DIST_DIR = SOURCE_DIR / "dist"
+
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PAGE_CACHE_CONTROL = "no-cache"
+
+_MIMETYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+# 优先级从高到低
+_ENCODINGS = ("br", "gzip")
+
+
+class StaticAssets:
+    """静态文件分发（每个进程一个实例，首次使用时加载 manifest）"""
+
+    def __init__(self, source_dir: Path = SOURCE_DIR, dist_dir: Path = DIST_DIR):
+        self.source_dir = source_dir
+        self.dist_dir = dist_dir
+        self._lock = threading.Lock()
+        self._manifest: Optional[dict] = None
+        self._loaded = False
+        self._stale_pages: set[str] = set()
+        # 路径 -> (内容, etag)
+        self._files: dict[str, tuple[bytes, str]] = {}
+        # 源文件路径 -> (mtime, 内容, etag)
+        self._sources: dict[str, tuple[float, bytes, str]] = {}
+
+    def _load_manifest(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            manifest_path = self.dist_dir / "manifest.json"
+            if not manifest_path.exists():
+                log.info("未找到静态资源构建产物，直接使用 static/ 源文件（可运行 python build_assets.py 构建）")
+                return
+            try:
+                manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            except Exception as e:
+                log.warning(f"读取静态资源 manifest 失败，使用源文件: {e}")
+                return
+
+            # 构建后源文件又被修改（本地开发），该页面回退到源文件，避免返回旧内容
+            for name, page in (manifest.get("pages") or {}).items():
+                source = self.source_dir / f"{name}.html"
+                try:
+                    current = hashlib.sha256(source.read_bytes()).hexdigest()
+                except OSError:
+                    continue
+                if current != page.get("source_sha256"):
+                    self._stale_pages.add(name)
+                    log.warning(f"static/{name}.html 在构建后被修改，该页面使用源文件（请重新运行 python build_assets.py）")
+            self._manifest = manifest
+
+    def _read(self, path: Path, etag: Optional[str] = None) -> tuple[bytes, str]:
+        key = str(path)
+        cached = self._files.get(key)
+        if cached is not None:
+            return cached
+        data = path.read_bytes()
+        item = (data, etag or hashlib.sha256(data).hexdigest()[:16])
+        with self._lock:
+            self._files[key] = item
+        return item
+
+    def _read_source(self, path: Path) -> tuple[bytes, str]:
+        """读取源文件（按 mtime 缓存，修改后自动生效，便于本地开发）"""
+        key = str(path)
+        mtime = path.stat().st_mtime
+        cached = self._sources.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+        data = path.read_bytes()
+        etag = hashlib.sha256(data).hexdigest()[:16]
+        with self._lock:
+            self._sources[key] = (mtime, data, etag)
+        return data, etag
+
+    def _respond(self, rel_path: str, cache_control: str) -> Response:
+        """返回 dist 中的文件（按 Accept-Encoding 选择预压缩版本）"""
+        entry = (self._manifest or {}).get("files", {}).get(rel_path)
+        if entry is None:
+            return Response("Not Found", status=404)
+
+        path = self.dist_dir / rel_path
+        encoding = None
+        for name in _ENCODINGS:
+            variant = entry.get("encodings", {}).get(name)
+            if variant and request.accept_encodings[name]:
+                encoding = name
+                path = path.with_name(variant["file"])
+                break
+
+        etag = entry["etag"] + (f"-{encoding}" if encoding else "")
+        data, _ = self._read(path, etag)
+        response = Response(data, content_type=_MIMETYPES.get(Path(rel_path).suffix, "application/octet-stream"))
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = cache_control
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    def page_response(self, name: str, *, cache_control: str = PAGE_CACHE_CONTROL) -> Response:
+        """返回页面 HTML"""
+        self._load_manifest()
+        page = (self._manifest or {}).get("pages", {}).get(name)
+        if page and name not in self._stale_pages:
+            return self._respond(page["html"], cache_control)
+
+        data, etag = self._read_source(self.source_dir / f"{name}.html")
+        response = Response(data, content_type=_MIMETYPES[".html"])
+        response.headers["Cache-Control"] = cache_control
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    def asset_page(self, filename: str) -> Optional[str]:
+        """资源文件所属页面（不存在返回 None）"""
+        self._load_manifest()
+        return (self._manifest or {}).get("assets", {}).get(filename)
+
+    def asset_response(self, filename: str, *, cache_control: str = ASSET_CACHE_CONTROL) -> Response:
+        """返回指纹资源文件"""
+        if self.asset_page(filename) is None:
+            return Response("Not Found", status=404)
+        return self._respond(f"assets/{filename}", cache_control)
+
+
+# 全局实例
+static_assets = StaticAssets()
@@ -41,11 +41,10 @@ class TeamManager:
             # 同步更新 config.toml 中的 team_names
             self._update_config_team_names(teams, team_names=team_names)
 
-            # 重新加载 config.TEAMS,使新Team立即可用
+            # 重新加载 config.TEAMS,使新Team立即可用,并通知其他 worker
             try:
-                import config
-                config.reload_teams()
-                log.info(f"配置已重新加载,当前有 {len(config.TEAMS)} 个Team", icon="success")
+                from config_watcher import config_watcher
+                config_watcher.publish()
             except Exception as e:
                 log.warning(f"重新加载配置失败: {e}")
 
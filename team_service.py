@@ -3,10 +3,15 @@
 
 from __future__ import annotations
 
+import os
+import time
+from urllib.parse import urlsplit
+
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+import config
 from config import (
     TEAMS,
     ACCOUNTS_PER_TEAM,
@@ -14,6 +19,37 @@ from config import (
     USER_AGENT
 )
 from logger import log
+import metrics
+
+
+def _team_label(account_id: str | None) -> str:
+    """按 chatgpt-account-id 请求头找到 Team 名称（指标标签）"""
+    if not account_id:
+        return "-"
+    for team in config.TEAMS:
+        if team.get("account_id") == account_id:
+            return team.get("name") or account_id[:8]
+    return account_id[:8]
+
+
+class MetricsHTTPAdapter(HTTPAdapter):
+    """记录上游请求耗时和状态码（按 Team、接口），包含 urllib3 内部重试的时间"""
+
+    def send(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = super().send(request, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            metrics.record_upstream(
+                team=_team_label(request.headers.get("chatgpt-account-id")),
+                method=request.method or "GET",
+                path=urlsplit(request.url or "").path,
+                status=status,
+                seconds=time.perf_counter() - start,
+            )
 
 
 def create_session_with_retry():
@@ -25,7 +61,12 @@ def create_session_with_retry():
         status_forcelist=[429, 500, 502, 503, 504],
         allowed_methods=["HEAD", "GET", "POST", "OPTIONS"]
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    # 连接池大小：默认 10 只适合同步 worker；gevent/gthread 模式下由 gunicorn.conf.py 按并发数设置
+    try:
+        pool_size = max(10, int(os.getenv("UPSTREAM_POOL_MAXSIZE", "10") or 10))
+    except ValueError:
+        pool_size = 10
+    adapter = MetricsHTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=pool_size)
     session.mount("https://", adapter)
     session.mount("http://", adapter)
     return session
@@ -174,7 +215,7 @@ def batch_invite_to_team(emails: list, team: dict) -> dict:
                     invited_email = invite.get("email_address", "")
                     if invited_email:
                         result["success"].append(invited_email)
-                        log.success(f"邀请成功: {invited_email}")
+                        log.debug(f"邀请成功: {invited_email}")
 
             # 处理失败的邮箱
             if resp_data.get("errored_emails"):
@@ -183,23 +224,24 @@ def batch_invite_to_team(emails: list, team: dict) -> dict:
                     err_msg = err.get("error", "Unknown error")
                     if err_email:
                         result["failed"].append({"email": err_email, "error": err_msg})
-                        log.error(f"邀请失败: {err_email} - {err_msg}")
+                        log.error(f"邀请失败: {err_email} - {err_msg}", team=team["name"])
 
             # 如果没有明确的成功/失败信息，假设全部成功
             if not resp_data.get("account_invites") and not resp_data.get("errored_emails"):
                 result["success"] = emails
-                for email in emails:
-                    log.success(f"邀请成功: {email}")
+                if log.enabled("debug"):
+                    for email in emails:
+                        log.debug(f"邀请成功: {email}")
 
         else:
-            log.error(f"批量邀请失败: HTTP {response.status_code}")
+            log.error(f"批量邀请失败: HTTP {response.status_code}", team=team["name"])
             result["failed"] = [{"email": e, "error": f"HTTP {response.status_code}"} for e in emails]
 
     except Exception as e:
-        log.error(f"批量邀请异常: {e}")
+        log.error(f"批量邀请异常: {e}", team=team["name"])
         result["failed"] = [{"email": e, "error": str(e)} for e in emails]
 
-    log.info(f"邀请结果: 成功 {len(result['success'])}, 失败 {len(result['failed'])}")
+    log.info(f"邀请结果: 成功 {len(result['success'])}, 失败 {len(result['failed'])}", team=team["name"])
     return result
 
 
@@ -221,14 +263,14 @@ def get_team_stats(team: dict) -> dict:
     try:
         response = http_session.get(subs_url, headers=headers, timeout=REQUEST_TIMEOUT)
 
-        log.info(f"[Team Stats] {team_name} - 订阅 API 响应: HTTP {response.status_code}")
+        log.debug(f"[Team Stats] {team_name} - 订阅 API 响应: HTTP {response.status_code}")
 
         if response.status_code != 200:
             log.warning(f"[Team Stats] {team_name} - 获取统计失败: HTTP {response.status_code}, 响应: {response.text[:200]}")
             return {}
 
         data = response.json() or {}
-        log.info(f"[Team Stats] {team_name} - API 返回数据: seats_in_use={data.get('seats_in_use')}, seats_entitled={data.get('seats_entitled')}")
+        log.debug(f"[Team Stats] {team_name} - API 返回数据: seats_in_use={data.get('seats_in_use')}, seats_entitled={data.get('seats_entitled')}")
 
         # 订阅接口的 pending_invites 有时不准确，这里用 invites 列表兜底（取更大值）
         pending_from_subs = (
@@ -374,9 +416,20 @@ def get_invite_status_for_email(team: dict, email: str) -> dict:
     if err and not items:
         return {"found": False, "error": err}
 
+    return index_invites_by_email(items).get(target) or {"found": False}
+
+
+def index_invites_by_email(items: list) -> dict:
+    """
+    把邀请列表整理为 {邮箱(小写): 邀请状态}，同一邮箱只保留第一条，
+    单条结构与 get_invite_status_for_email 的返回值相同。
+    """
+    index: dict = {}
     for inv in items:
+        if not isinstance(inv, dict):
+            continue
         e = (inv.get("email_address") or inv.get("email") or inv.get("emailAddress") or "").strip().lower()
-        if e != target:
+        if not e or e in index:
             continue
 
         status = (
@@ -395,9 +448,9 @@ def get_invite_status_for_email(team: dict, email: str) -> dict:
             or inv.get("created_at")
             or inv.get("createdAt")
         )
-        return {"found": True, "status": status, "timestamp": ts, "raw": inv}
+        index[e] = {"found": True, "status": status, "timestamp": ts, "raw": inv}
 
-    return {"found": False}
+    return index
 
 
 def get_team_members_debug(team: dict, *, max_items: int = 500) -> tuple[list, str | None]:
@@ -494,6 +547,15 @@ def get_member_info_for_email(team: dict, email: str) -> dict:
     if err and not members:
         return {"found": False, "error": err}
 
+    return index_members_by_email(members).get(target) or {"found": False}
+
+
+def index_members_by_email(members: list) -> dict:
+    """
+    把成员列表整理为 {邮箱(小写): 成员信息}，同一邮箱只保留第一条，
+    单条结构与 get_member_info_for_email 的返回值相同。
+    """
+    index: dict = {}
     for m in members:
         if not isinstance(m, dict):
             continue
@@ -504,7 +566,7 @@ def get_member_info_for_email(team: dict, email: str) -> dict:
             or ((m.get("account_user", {}) or {}).get("email") or "")
         )
         e = (e or "").strip().lower()
-        if e != target:
+        if not e or e in index:
             continue
 
         joined_at = (
@@ -517,9 +579,9 @@ def get_member_info_for_email(team: dict, email: str) -> dict:
             or m.get("updated_at")
             or m.get("updatedAt")
         )
-        return {"found": True, "joined_at": joined_at, "raw": m}
+        index[e] = {"found": True, "joined_at": joined_at, "raw": m}
 
-    return {"found": False}
+    return index
 
 
 def remove_member_by_email(team: dict, email: str) -> tuple[bool, str]:
@@ -8,6 +8,8 @@ import time
 from datetime import datetime
 from logger import log
 from database import db
+from leader_election import background_leader
+import metrics
 
 
 class TeamStatusChecker:
@@ -100,15 +102,19 @@ class TeamStatusChecker:
         def _worker():
             log.info(f"Team 状态检测后台任务已启动（间隔: {interval // 3600} 小时）", icon="rocket")
 
-            # 启动后立即执行一次检测
+            # 启动后立即执行一次检测（只有后台任务主节点执行）
             time.sleep(10)  # 等待 10 秒让服务器完全启动
-            self.check_all_teams()
+            if background_leader.is_leader():
+                with metrics.track_loop("team_status"):
+                    self.check_all_teams()
 
             # 定期检测
             while True:
                 try:
                     time.sleep(interval)
-                    self.check_all_teams()
+                    if background_leader.is_leader():
+                        with metrics.track_loop("team_status"):
+                            self.check_all_teams()
                 except Exception as e:
                     log.error(f"Team 状态检测循环出错: {e}")
                     time.sleep(60)  # 出错后等待 1 分钟再继续
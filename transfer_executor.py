@@ -4,7 +4,9 @@
 
 from __future__ import annotations
 
+import contextlib
 import os
+import threading
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -16,87 +18,27 @@ from join_sync_service import JoinSyncService
 from lease_models import LeaseAction
 from logger import log
 from redemption_service import RedemptionService
-from team_service import invite_single_email, remove_member_by_email
+from team_service import batch_invite_to_team, invite_single_email, remove_member_by_email
+from transfer_planner import TransferTarget, configured_teams, is_current_team, load_team_snapshot
 
 
 def _pick_next_team(*, current_account_id: str | None, current_team_name: str | None, email: str) -> list[dict]:
-    '''选择下一个 Team（优先选择时间最长的可用 Team）'''
-    # 获取所有有效的 Team
-    teams = [
-        t
-        for t in (config.TEAMS or [])
-        if (t.get('auth_token') or '').strip() and (t.get('account_id') or '').strip()
-    ]
-    if len(teams) <= 1:
+    '''选择下一个 Team（优先选择时间最长的可用 Team；单个租约使用，批量转移见 transfer_planner）'''
+    slots = load_team_snapshot()
+    if len(configured_teams()) <= 1:
         return []
 
-    # 过滤掉状态不正常的 Team，并获取创建时间
-    active_teams_with_time = []
-    for t in teams:
-        team_name = t.get('name', '')
-
-        # 跳过当前 Team
-        if current_account_id and t.get('account_id') == current_account_id:
-            continue
-        if current_team_name and t.get('name') == current_team_name:
-            continue
-
-        # 检查 Team 状态
-        team_status = db.get_team_status(team_name)
-
-        # 如果没有状态信息，默认认为是正常的（向后兼容）
-        if team_status is None:
-            # 获取创建时间（用于排序）
-            team_time_info = db.get_team_created_at(team_name)
-            created_at = None
-            if team_time_info and team_time_info.get('created_at'):
-                try:
-                    created_at = datetime.fromisoformat(team_time_info['created_at'])
-                except Exception:
-                    pass
-
-            active_teams_with_time.append({
-                'team': t,
-                'created_at': created_at or datetime.now()  # 如果没有创建时间，使用当前时间
-            })
-            continue
-
-        # 只选择状态为正常的 Team
-        is_active = team_status.get('is_active', 1)
-        if is_active:
-            # 获取创建时间（用于排序）
-            team_time_info = db.get_team_created_at(team_name)
-            created_at = None
-            if team_time_info and team_time_info.get('created_at'):
-                try:
-                    created_at = datetime.fromisoformat(team_time_info['created_at'])
-                except Exception:
-                    pass
-
-            active_teams_with_time.append({
-                'team': t,
-                'created_at': created_at or datetime.now()
-            })
-        else:
-            log.warning(f"跳过停用的 Team: {team_name} ({team_status.get('status_error', '未知错误')})")
+    lease = {'team_name': current_team_name, 'team_account_id': current_account_id}
+    ordered = [slot for slot in slots if not is_current_team(slot, lease)]
 
     # 如果没有可用的 Team，返回空列表
-    if len(active_teams_with_time) == 0:
+    if not ordered:
         log.error("没有状态正常的 Team 可用于转移")
         return []
 
-    # 按创建时间排序（最早的在前面）
-    active_teams_with_time.sort(key=lambda x: x['created_at'])
-
-    # 提取 Team 配置
-    ordered = [item['team'] for item in active_teams_with_time]
-
-    log.info(f"为 {email} 选择了 {len(ordered)} 个候选 Team（共 {len(teams)} 个 Team，按创建时间排序）")
-    if ordered:
-        first_team = ordered[0]
-        log.info(f"优先选择最早的 Team: {first_team.get('name')} (创建于 {active_teams_with_time[0]['created_at'].strftime('%Y-%m-%d')})")
-
-    return ordered
+    log.info(f"为 {email} 选择了 {len(ordered)} 个候选 Team（共 {len(configured_teams())} 个 Team，按创建时间排序）")
+    log.info(f"优先选择最早的 Team: {ordered[0].name} (创建于 {ordered[0].created_at.strftime('%Y-%m-%d')})")
+    return [slot.config for slot in ordered]
 
 
 def _next_attempt_time(attempts: int) -> datetime:
@@ -106,6 +48,11 @@ def _next_attempt_time(attempts: int) -> datetime:
     return datetime.now() + timedelta(seconds=secs)
 
 
+def kick_old_team_enabled() -> bool:
+    '''是否自动退出旧 Team'''
+    return env_bool('AUTO_TRANSFER_AUTO_LEAVE_OLD_TEAM', False) or env_bool('AUTO_TRANSFER_KICK_OLD_TEAM', False)
+
+
 def _expires_at_for_new_term(now: datetime) -> datetime:
     '''计算新租期的到期时间'''
     term_months = int(os.getenv('AUTO_TRANSFER_TERM_MONTHS', '1') or 1)
@@ -113,30 +60,200 @@ def _expires_at_for_new_term(now: datetime) -> datetime:
     return add_months_same_day(now, term_months)
 
 
+class TransferLimits:
+    '''转移并发限制：同一源 Team / 目标 Team 同时进行的转移数上限（进程内）'''
+
+    def __init__(self, *, per_source: int = 2, per_target: int = 2):
+        self.per_source = max(1, int(per_source))
+        self.per_target = max(1, int(per_target))
+        self._lock = threading.Lock()
+        self._sources: dict[str, threading.BoundedSemaphore] = {}
+        self._targets: dict[str, threading.BoundedSemaphore] = {}
+
+    def _semaphore(self, table: dict, team_name: str, size: int) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = table.get(team_name)
+            if sem is None:
+                sem = table[team_name] = threading.BoundedSemaphore(size)
+            return sem
+
+    def try_acquire_source(self, team_name: str) -> bool:
+        '''不阻塞地占用源 Team 名额（调度线程用：占不到时先调度其他租约）'''
+        return self._semaphore(self._sources, team_name or '', self.per_source).acquire(blocking=False)
+
+    def release_source(self, team_name: str):
+        self._semaphore(self._sources, team_name or '', self.per_source).release()
+
+    @contextlib.contextmanager
+    def target(self, team_name: str):
+        '''占用目标 Team 名额（席位检查 + 邀请期间持有）'''
+        sem = self._semaphore(self._targets, team_name or '', self.per_target)
+        sem.acquire()
+        try:
+            yield
+        finally:
+            sem.release()
+
+
 class TransferExecutor:
     '''转移执行器 - 负责执行单个租约的转移'''
 
     @staticmethod
-    def execute(lease: dict, *, only_if_due: bool = True) -> bool:
+    def execute(
+        lease: dict,
+        *,
+        only_if_due: bool = True,
+        limits: TransferLimits | None = None,
+        target: TransferTarget | None = None,
+    ) -> bool:
         '''执行转移操作
 
         Args:
             lease: 租约记录
             only_if_due: 是否只转移已到期的
+            limits: 并行转移时的目标 Team 并发限制（源 Team 名额由调用方占用）
+            target: 批量规划的目标 Team（已计入席位，不再逐个检查）；为空时按单个租约选择
 
         Returns:
             bool: 是否转移成功
         '''
-        email = (lease.get('email') or '').strip().lower()
+        email = TransferExecutor._begin(lease, only_if_due=only_if_due)
         if not email:
             return False
+        try:
+            return TransferExecutor._execute_marked(lease, email, limits=limits, target=target)
+        except Exception as e:
+            # 已标记为转移中：出错时必须写回失败状态，否则租约会一直停留在 transferring
+            log.warning(f'转移 {email} 出错: {e}')
+            TransferExecutor._fail_quietly(lease, email, f'转移出错: {e}')
+            return False
+
+    @staticmethod
+    def _execute_marked(
+        lease: dict, email: str, *, limits: TransferLimits | None, target: TransferTarget | None
+    ) -> bool:
+        '''execute 的主体（租约已标记为转移中）'''
+        # 选择候选 Team
+        if target is not None:
+            candidates = target.candidates
+            planned = target.team
+        else:
+            candidates = _pick_next_team(
+                current_account_id=lease.get('team_account_id'),
+                current_team_name=lease.get('team_name'),
+                email=email,
+            )
+            planned = None
+
+        if not candidates:
+            msg = (target.reason if target is not None else '') or '没有可用的新 Team（请至少配置 2 个 Team）'
+            TransferExecutor._fail(lease, email, msg, count_attempt=False)
+            return False
+
+        # 先退出旧 Team (如果配置了)
+        if kick_old_team_enabled():
+            err = TransferExecutor._leave_old_team(lease, email)
+            if err:
+                TransferExecutor._fail(lease, email, err)
+                return False
+
+        transferred, last_err = TransferExecutor._try_candidates(
+            lease, email, candidates, planned=planned, limits=limits
+        )
+        if not transferred:
+            TransferExecutor._fail(lease, email, last_err or '无可用 Team/邀请失败')
+            return False
+        return True
+
+    @staticmethod
+    def prepare(lease: dict, *, target: TransferTarget | None, only_if_due: bool = True) -> bool:
+        '''批量转移第一步：检查并标记为转移中、退出旧 Team（如配置），之后由 deliver 批量邀请
+
+        Returns:
+            bool: 是否可以进入批量邀请（False 时租约未处理或已记为失败）
+        '''
+        if target is None:
+            return False
+        email = TransferExecutor._begin(lease, only_if_due=only_if_due)
+        if not email:
+            return False
+
+        try:
+            if target.team is None:
+                msg = target.reason or '没有可用的新 Team（请至少配置 2 个 Team）'
+                TransferExecutor._fail(lease, email, msg, count_attempt=False)
+                return False
+
+            if kick_old_team_enabled():
+                err = TransferExecutor._leave_old_team(lease, email)
+                if err:
+                    TransferExecutor._fail(lease, email, err)
+                    return False
+        except Exception as e:
+            log.warning(f'转移 {email} 出错: {e}')
+            TransferExecutor._fail_quietly(lease, email, f'转移出错: {e}')
+            return False
+        return True
+
+    @staticmethod
+    def deliver(
+        team: dict, batch: list[tuple[dict, TransferTarget]], *, limits: TransferLimits | None = None
+    ) -> tuple[int, int]:
+        '''批量转移第二步：一次邀请同一目标 Team 的一组租约（已 prepare），按邮箱写回结果；
+        邀请失败的租约再依次尝试备选 Team（单个邀请）
+
+        每个租约单独处理异常：没有写回成功的租约都会记为失败，不会停留在 transferring。
+
+        Returns:
+            tuple: (成功转移的人数, 失败的人数)
+        '''
+        if not batch:
+            return 0, 0
+        team_name = team.get('name') or ''
+        emails = [(lease.get('email') or '').strip().lower() for lease, _ in batch]
+        batch_error = ''
+        try:
+            with (limits.target(team_name) if limits else contextlib.nullcontext()):
+                result = batch_invite_to_team(emails, team)
+            succeeded, failed = RedemptionService._split_invite_result(result)
+        except Exception as e:
+            log.warning(f'批量邀请 {team_name} 出错: {e}')
+            succeeded, failed, batch_error = set(), {}, str(e)
+
+        moved = 0
+        for (lease, target), email in zip(batch, emails):
+            try:
+                if email in succeeded:
+                    TransferExecutor._succeed(lease, email, team)
+                    moved += 1
+                    continue
+                err = f"邀请错误: {failed.get(email) or batch_error or '未知错误'}"
+                transferred, last_err = TransferExecutor._try_candidates(lease, email, target.fallbacks, limits=limits)
+                if transferred:
+                    moved += 1
+                    continue
+                err = last_err or err
+            except Exception as e:
+                log.warning(f'转移 {email} 出错: {e}')
+                err = f'转移出错: {e}'
+            TransferExecutor._fail_quietly(lease, email, err)
+        return moved, len(batch) - moved
+
+    # ==================== 内部步骤 ====================
+
+    @staticmethod
+    def _begin(lease: dict, *, only_if_due: bool) -> str:
+        '''检查租约是否可转移并标记为转移中，返回邮箱（不可转移时返回空字符串）'''
+        email = (lease.get('email') or '').strip().lower()
+        if not email:
+            return ''
 
         # 只转移 active 状态且已加入的租约
         if (lease.get('status') or '').strip() != 'active':
-            return False
+            return ''
 
         if not lease.get('joined_at'):
-            return False
+            return ''
 
         # 检查是否到期
         if only_if_due:
@@ -145,121 +262,116 @@ class TransferExecutor:
                 if isinstance(exp, str) and exp:
                     exp_dt = datetime.fromisoformat(exp)
                     if exp_dt > datetime.now():
-                        return False
+                        return ''
             except Exception:
-                return False
+                return ''
 
         # 标记为转移中
         if not db.mark_member_lease_transferring(email):
-            return False
+            return ''
+        return email
 
+    @staticmethod
+    def _leave_old_team(lease: dict, email: str) -> str:
+        '''退出旧 Team，返回错误信息（成功或无旧 Team 时返回空字符串）'''
         current_team_name = lease.get('team_name')
-        current_account_id = lease.get('team_account_id')
-
-        # 选择候选 Team
-        candidates = _pick_next_team(
-            current_account_id=current_account_id,
-            current_team_name=current_team_name,
-            email=email,
-        )
-
-        if not candidates:
-            msg = '没有可用的新 Team（请至少配置 2 个 Team）'
-            db.update_member_lease_transfer_failure(
-                email=email,
-                message=msg,
-                next_attempt_at=_next_attempt_time(int(lease.get('attempts') or 0)),
-            )
+        if not current_team_name:
+            return ''
+        old_cfg = config.resolve_team(current_team_name) or {}
+        if not old_cfg:
+            return f'旧 Team 配置不存在: {current_team_name}'
+        ok_kick, kick_msg = remove_member_by_email(old_cfg, email)
+        if not ok_kick:
             db.add_member_lease_event(
                 email=email,
-                action=LeaseAction.TRANSFER_FAILED,
+                action=LeaseAction.LEAVE_OLD_FAILED,
                 from_team=current_team_name,
                 to_team=None,
-                message=msg,
+                message=kick_msg,
             )
-            return False
-
-        # 是否自动退出旧 Team
-        kick_old = env_bool('AUTO_TRANSFER_AUTO_LEAVE_OLD_TEAM', False) or env_bool(
-            'AUTO_TRANSFER_KICK_OLD_TEAM', False
+            return f'退出旧 Team 失败: {kick_msg}'
+        db.add_member_lease_event(
+            email=email,
+            action=LeaseAction.LEFT_OLD_TEAM,
+            from_team=current_team_name,
+            to_team=None,
+            message='已退出旧 Team',
         )
-        kicked_old = False
-        transferred = False
-        last_err = ''
+        return ''
 
-        # 尝试转移到候选 Team
+    @staticmethod
+    def _try_candidates(
+        lease: dict,
+        email: str,
+        candidates: list[dict],
+        *,
+        planned: dict | None = None,
+        limits: TransferLimits | None = None,
+    ) -> tuple[bool, str]:
+        '''依次尝试候选 Team（单个邀请），返回 (是否成功, 最后的错误)'''
+        last_err = ''
         for t in candidates:
             team_name = t.get('name') or ''
-            account_id = t.get('account_id') or ''
-
-            # 先退出旧 Team (如果配置了)
-            if kick_old and (not kicked_old) and current_team_name:
-                old_cfg = config.resolve_team(current_team_name) or {}
-                if not old_cfg:
-                    last_err = f'旧 Team 配置不存在: {current_team_name}'
-                    break
-                ok_kick, kick_msg = remove_member_by_email(old_cfg, email)
-                if not ok_kick:
-                    last_err = f'退出旧 Team 失败: {kick_msg}'
-                    db.add_member_lease_event(
-                        email=email,
-                        action=LeaseAction.LEAVE_OLD_FAILED,
-                        from_team=current_team_name,
-                        to_team=None,
-                        message=kick_msg,
-                    )
-                    break
-                kicked_old = True
-                db.add_member_lease_event(
-                    email=email,
-                    action=LeaseAction.LEFT_OLD_TEAM,
-                    from_team=current_team_name,
-                    to_team=None,
-                    message='已退出旧 Team',
-                )
-
-            # 检查新 Team 席位
-            seat_check = RedemptionService._check_team_seats(team_name)
-            if not seat_check.get('available'):
-                last_err = seat_check.get('message') or '无可用席位'
-                continue
-
-            # 邀请到新 Team
-            ok, msg = invite_single_email(email, t)
+
+            # 检查新 Team 席位并邀请（规划分配的 Team 已计入席位；并行转移时同一目标 Team 限制并发）
+            with (limits.target(team_name) if limits else contextlib.nullcontext()):
+                if t is not planned:
+                    seat_check = RedemptionService._check_team_seats(team_name)
+                    if not seat_check.get('available'):
+                        last_err = seat_check.get('message') or '无可用席位'
+                        continue
+
+                # 邀请到新 Team
+                ok, msg = invite_single_email(email, t)
             if ok:
-                now = datetime.now()
-                expires_at = _expires_at_for_new_term(now)
-                db.update_member_lease_transfer_success(
-                    email=email,
-                    new_team_name=team_name,
-                    new_team_account_id=account_id,
-                    invited_at=now,
-                    expires_at=expires_at,
-                )
-                db.add_member_lease_event(
-                    email=email,
-                    action=LeaseAction.TRANSFERRED,
-                    from_team=current_team_name,
-                    to_team=team_name,
-                    message='自动转移：已发送新 Team 邀请，等待接受；到期日将以实际加入时间为准自动修正',
-                )
-                log.info(f'自动转移成功: {email} -> {team_name}', icon='success')
-                transferred = True
-                break
+                TransferExecutor._succeed(lease, email, t)
+                return True, ''
             last_err = msg or '邀请失败'
+        return False, last_err
 
-        if not transferred:
-            attempts = int(lease.get('attempts') or 0) + 1
-            next_at = _next_attempt_time(attempts)
-            msg = last_err or '无可用 Team/邀请失败'
-            db.update_member_lease_transfer_failure(email=email, message=msg, next_attempt_at=next_at)
+    @staticmethod
+    def _succeed(lease: dict, email: str, team: dict):
+        '''转移成功：更新为新 Team 并记录事件'''
+        team_name = team.get('name') or ''
+        now = datetime.now()
+        expires_at = _expires_at_for_new_term(now)
+        db.update_member_lease_transfer_success(
+            email=email,
+            new_team_name=team_name,
+            new_team_account_id=team.get('account_id') or '',
+            invited_at=now,
+            expires_at=expires_at,
+        )
+        try:
             db.add_member_lease_event(
                 email=email,
-                action=LeaseAction.TRANSFER_FAILED,
-                from_team=current_team_name,
-                to_team=None,
-                message=msg,
+                action=LeaseAction.TRANSFERRED,
+                from_team=lease.get('team_name'),
+                to_team=team_name,
+                message='自动转移：已发送新 Team 邀请，等待接受；到期日将以实际加入时间为准自动修正',
             )
-            return False
+        except Exception as e:
+            # 租约已更新为新 Team，事件写入失败不影响转移结果
+            log.warning(f'记录转移事件失败 {email}: {e}')
+        log.info(f'自动转移成功: {email} -> {team_name}', icon='success')
 
-        return True
+    @staticmethod
+    def _fail(lease: dict, email: str, msg: str, *, count_attempt: bool = True):
+        '''转移失败：记录错误并按退避时间安排重试'''
+        attempts = int(lease.get('attempts') or 0) + (1 if count_attempt else 0)
+        db.update_member_lease_transfer_failure(email=email, message=msg, next_attempt_at=_next_attempt_time(attempts))
+        db.add_member_lease_event(
+            email=email,
+            action=LeaseAction.TRANSFER_FAILED,
+            from_team=lease.get('team_name'),
+            to_team=None,
+            message=msg,
+        )
+
+    @staticmethod
+    def _fail_quietly(lease: dict, email: str, msg: str):
+        '''出错后的兜底写回：_fail 本身出错时只记录日志'''
+        try:
+            TransferExecutor._fail(lease, email, msg)
+        except Exception as e:
+            log.error(f'写回转移失败状态出错 {email}: {e}（租约仍为 transferring）')
@@ -0,0 +1,144 @@
+'''
+转移容量规划 - 为一批到期租约统一分配目标 Team
+
+一批租约只读取一次 Team 状态（一次查询），每个 Team 最多检查一次席位（按需、按创建时间顺序），
+然后按"最早创建的可用 Team 优先"逐个分配并扣减剩余席位，保证同一批次不会超出席位上限。
+邀请失败时执行器再按规划结束时仍有剩余席位的 Team 依次尝试（这些 Team 仍会实时检查席位）。
+'''
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import config
+from database import db
+from logger import log
+from redemption_service import RedemptionService
+
+
+@dataclass
+class TeamSlot:
+    '''规划用的 Team 快照'''
+    name: str
+    config: dict
+    created_at: datetime
+    seats: Optional[int] = None  # None 表示尚未检查席位
+    message: str = ''
+
+
+@dataclass
+class TransferTarget:
+    '''单个租约的规划结果'''
+    email: str
+    team: Optional[dict] = None  # 分配的目标 Team（已计入席位）
+    fallbacks: list[dict] = field(default_factory=list)  # 邀请失败时依次尝试的 Team
+    reason: str = ''  # 未分配时的原因
+
+    @property
+    def candidates(self) -> list[dict]:
+        return ([self.team] if self.team else []) + self.fallbacks
+
+
+def configured_teams() -> list[dict]:
+    '''已配置 Token 和 account_id 的 Team'''
+    return [
+        t
+        for t in (config.TEAMS or [])
+        if (t.get('auth_token') or '').strip() and (t.get('account_id') or '').strip()
+    ]
+
+
+def load_team_snapshot() -> list[TeamSlot]:
+    '''状态正常、配置完整的 Team，按创建时间排序（最早的在前面）'''
+    teams = configured_teams()
+    rows = {row.get('team_name'): row for row in db.list_team_stats()}
+    now = datetime.now()
+
+    slots: list[TeamSlot] = []
+    for t in teams:
+        team_name = t.get('name', '')
+        row = rows.get(team_name)
+        # 没有状态信息时默认认为是正常的（向后兼容）
+        if row is not None and not row.get('is_active', 1):
+            log.warning(f"跳过停用的 Team: {team_name} ({row.get('status_error') or '未知错误'})")
+            continue
+        created_at = None
+        if row and row.get('created_at'):
+            try:
+                created_at = datetime.fromisoformat(row['created_at'])
+            except Exception:
+                pass
+        slots.append(TeamSlot(name=team_name, config=t, created_at=created_at or now))
+
+    slots.sort(key=lambda s: s.created_at)
+    return slots
+
+
+def is_current_team(slot: TeamSlot, lease: dict) -> bool:
+    '''是否为租约当前所在的 Team'''
+    account_id = lease.get('team_account_id')
+    return slot.name == lease.get('team_name') or bool(account_id and slot.config.get('account_id') == account_id)
+
+
+class TransferPlanner:
+    '''批量转移规划器'''
+
+    @staticmethod
+    def plan(leases: list[dict], *, slots: list[TeamSlot] | None = None) -> dict[str, TransferTarget]:
+        '''为一批租约分配目标 Team（按传入顺序，即到期时间先后）
+
+        Returns:
+            dict: email -> TransferTarget
+        '''
+        if slots is None:
+            slots = load_team_snapshot()
+        configured = len(configured_teams())
+
+        def seats_of(slot: TeamSlot) -> int:
+            if slot.seats is None:
+                check = RedemptionService._check_team_seats(slot.name)
+                slot.seats = int(check.get('seats', 0)) if check.get('available') else 0
+                slot.message = check.get('message') or ''
+            return slot.seats
+
+        result: dict[str, TransferTarget] = {}
+        for lease in leases:
+            email = (lease.get('email') or '').strip().lower()
+            if not email:
+                continue
+            target = TransferTarget(email=email)
+            others = [s for s in slots if not is_current_team(s, lease)]
+            if configured <= 1 or not others:
+                target.reason = '没有可用的新 Team（请至少配置 2 个 Team）'
+            else:
+                for slot in others:
+                    if seats_of(slot) > 0:
+                        slot.seats -= 1
+                        if slot.seats == 0:
+                            slot.message = 'Team席位已满（本批次已分配完剩余席位）'
+                        target.team = slot.config
+                        break
+                else:
+                    target.reason = '；'.join(f'{s.name}: {s.message or "无可用席位"}' for s in others)
+            result[email] = target
+
+        # 邀请失败时的备选：规划结束后仍有剩余席位的 Team（未检查过的 Team 也可尝试）
+        spare = [s for s in slots if s.seats is None or s.seats > 0]
+        for lease in leases:
+            target = result.get((lease.get('email') or '').strip().lower())
+            if target is None or target.team is None:
+                continue
+            target.fallbacks = [
+                s.config for s in spare if s.config is not target.team and not is_current_team(s, lease)
+            ]
+
+        assigned = sum(1 for t in result.values() if t.team)
+        if result:
+            log.info(
+                f'转移规划: {assigned}/{len(result)} 个租约已分配目标 Team'
+                f"（检查席位 {sum(1 for s in slots if s.seats is not None)}/{len(slots)} 个 Team）",
+                icon='team',
+            )
+        return result
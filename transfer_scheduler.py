@@ -1,5 +1,11 @@
 '''
 转移调度器 - 负责定时任务和批量转移调度
+
+到期转移按批处理：先由 transfer_planner 为整批租约分配目标 Team，线程池（AUTO_TRANSFER_WORKERS）并行准备租约，
+再按目标 Team 分组批量发送邀请（每次 AUTO_TRANSFER_INVITE_CHUNK 个邮箱）。
+同一源 Team / 目标 Team 的并发数分别受 AUTO_TRANSFER_PER_SOURCE_TEAM / AUTO_TRANSFER_PER_TARGET_TEAM 限制，
+所有转移共享一个速率预算（AUTO_TRANSFER_RATE_LIMIT，GCRA，见 rate_limit.py）。
+后台线程有积压时连续处理直到清空，没有积压时才按 AUTO_TRANSFER_POLL_SECONDS 休眠。
 '''
 
 from __future__ import annotations
@@ -8,12 +14,179 @@ import os
 import threading
 import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Optional
 
 from config import env_bool
 from database import db
 from join_sync_service import JoinSyncService
+from leader_election import background_leader
 from logger import log
-from transfer_executor import TransferExecutor
+import metrics
+import rate_limit
+from transfer_executor import TransferExecutor, TransferLimits
+from transfer_planner import TransferPlanner, TransferTarget
+
+
+# 转移期间持有的全局锁（与手动触发互斥），处理过程中按批续约
+_LOCK_NAME = 'auto_transfer_monthly'
+_LOCK_SECONDS = 90
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+class TransferEngine:
+    '''并行转移引擎：按批规划目标 Team、线程池准备租约、按目标 Team 批量邀请，按源/目标 Team 限制并发，共享全局速率预算'''
+
+    def __init__(
+        self,
+        *,
+        max_workers: int = 4,
+        per_source: int = 2,
+        per_target: int = 2,
+        rate: str = '600/hour',
+        invite_chunk: int = 20,
+    ):
+        self.max_workers = max(1, int(max_workers))
+        self.invite_chunk = max(1, int(invite_chunk))
+        self.limits = TransferLimits(per_source=per_source, per_target=per_target)
+        self.rate_rule = rate_limit.parse_rule('auto_transfer', rate)
+
+    def run_batch(self, leases: list[dict], *, heartbeat: Optional[Callable[[], bool]] = None) -> dict:
+        '''并行转移一批租约
+
+        1. 规划：一次性为整批租约分配目标 Team（transfer_planner）
+        2. 准备：线程池并行标记转移中、退出旧 Team（如配置）；源 Team 名额已满的租约暂缓、先派发其他 Team 的；
+           速率预算用完时停止派发，剩余租约留到下一批（仍为 active 状态，不会丢失）
+        3. 邀请：按目标 Team 分组，每 invite_chunk 个邮箱一次 batch_invite_to_team，按邮箱写回结果
+
+        Args:
+            leases: 到期租约（按到期时间排序）
+            heartbeat: 等待期间定期调用（续约全局锁），返回 False 时停止派发
+
+        Returns:
+            dict: {moved, failed, skipped, retry_after}，retry_after 为速率预算恢复所需秒数（未受限时为 0）
+        '''
+        stats = {'moved': 0, 'failed': 0, 'skipped': 0, 'retry_after': 0.0}
+        if not leases:
+            return stats
+
+        targets = TransferPlanner.plan(leases)
+        prepared: list[tuple[dict, TransferTarget]] = []
+        pending = deque(leases)
+        cond = threading.Condition()
+        in_flight = 0
+        last_beat = time.monotonic()
+
+        def _beat() -> bool:
+            nonlocal last_beat
+            if not heartbeat or time.monotonic() - last_beat < _LOCK_SECONDS / 3:
+                return True
+            last_beat = time.monotonic()
+            return heartbeat()
+
+        def _prepare(lease: dict, source: str):
+            nonlocal in_flight
+            target = targets.get((lease.get('email') or '').strip().lower())
+            ok = False
+            try:
+                ok = TransferExecutor.prepare(lease, target=target)
+            except Exception as e:
+                log.warning(f"转移 {lease.get('email')} 出错: {e}")
+            finally:
+                self.limits.release_source(source)
+                with cond:
+                    in_flight -= 1
+                    if ok:
+                        prepared.append((lease, target))
+                    else:
+                        stats['failed'] += 1
+                    cond.notify()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='transfer') as pool:
+            with cond:
+                while pending or in_flight:
+                    for _ in range(len(pending)):
+                        if in_flight >= self.max_workers:
+                            break
+                        lease = pending.popleft()
+                        source = lease.get('team_name') or ''
+                        if not self.limits.try_acquire_source(source):
+                            pending.append(lease)
+                            continue
+                        if self.rate_rule is not None:
+                            decision = rate_limit.limiter.take(self.rate_rule, 'global')
+                            if not decision.allowed:
+                                self.limits.release_source(source)
+                                pending.appendleft(lease)
+                                stats['retry_after'] = decision.retry_after
+                                break
+                        in_flight += 1
+                        pool.submit(_prepare, lease, source)
+
+                    if stats['retry_after']:
+                        stats['skipped'] += len(pending)
+                        pending.clear()
+                    if not pending and not in_flight:
+                        break
+                    cond.wait(timeout=1)
+
+                    cond.release()
+                    try:
+                        alive = _beat()
+                    finally:
+                        cond.acquire()
+                    if not alive:
+                        log.warning('转移锁已失效，停止派发剩余租约')
+                        stats['skipped'] += len(pending)
+                        pending.clear()
+
+            # 已标记转移中的租约必须完成邀请并写回结果（锁失效也继续，避免停留在 transferring）
+            groups: dict[str, list[tuple[dict, TransferTarget]]] = {}
+            for lease, target in prepared:
+                groups.setdefault(target.team.get('name') or '', []).append((lease, target))
+            futures = {}
+            for items in groups.values():
+                team = items[0][1].team
+                for i in range(0, len(items), self.invite_chunk):
+                    chunk = items[i : i + self.invite_chunk]
+                    futures[pool.submit(TransferExecutor.deliver, team, chunk, limits=self.limits)] = chunk
+
+            pending_futures = set(futures)
+            while pending_futures:
+                done, pending_futures = wait(pending_futures, timeout=5)
+                for future in done:
+                    chunk = futures[future]
+                    try:
+                        moved, failed = future.result()
+                    except Exception as e:
+                        # deliver 按租约处理异常，这里只在意外情况下兜底计数
+                        log.warning(f"批量邀请 {chunk[0][1].team.get('name')} 出错: {e}")
+                        moved, failed = 0, len(chunk)
+                    stats['moved'] += moved
+                    stats['failed'] += failed
+                _beat()
+        return stats
+
+
+def _engine_from_env() -> TransferEngine:
+    return TransferEngine(
+        max_workers=_env_int('AUTO_TRANSFER_WORKERS', 4),
+        per_source=_env_int('AUTO_TRANSFER_PER_SOURCE_TEAM', 2),
+        per_target=_env_int('AUTO_TRANSFER_PER_TARGET_TEAM', 2),
+        rate=os.getenv('AUTO_TRANSFER_RATE_LIMIT', '600/hour'),
+        invite_chunk=_env_int('AUTO_TRANSFER_INVITE_CHUNK', 20),
+    )
+
+
+# 全局实例
+transfer_engine = _engine_from_env()
 
 
 class TransferScheduler:
@@ -23,33 +196,67 @@ class TransferScheduler:
 
     @staticmethod
     def run_once(*, limit: int = 20) -> int:
-        '''执行一轮到期转移
+        '''执行一轮到期转移（最多 limit 个，并行执行）
 
         Returns:
             int: 成功转移的人数
         '''
+        return TransferScheduler.drain(batch_size=limit, max_batches=1)['moved']
+
+    @staticmethod
+    def drain(*, batch_size: int = 50, max_batches: int | None = None, max_seconds: float | None = None) -> dict:
+        '''连续处理到期租约，直到没有积压 / 速率预算用完 / 达到批数或时间上限
+
+        Returns:
+            dict: {moved, failed, skipped, batches, retry_after, backlog}
+                  backlog 为 True 表示仍有到期租约未处理（调用方应尽快再次调用）
+        '''
+        totals = {'moved': 0, 'failed': 0, 'skipped': 0, 'batches': 0, 'retry_after': 0.0, 'backlog': False}
         lock_by = uuid.uuid4().hex
-        if not db.acquire_lock('auto_transfer_monthly', lock_by=lock_by, lock_seconds=90):
-            return 0
+        if not db.acquire_lock(_LOCK_NAME, lock_by=lock_by, lock_seconds=_LOCK_SECONDS):
+            return totals
+
+        def heartbeat() -> bool:
+            return db.renew_lock(_LOCK_NAME, lock_by=lock_by, lock_seconds=_LOCK_SECONDS)
 
-        moved = 0
+        started = time.monotonic()
+        batch_size = max(1, int(batch_size))
         try:
             # 先同步加入时间
             JoinSyncService.sync_batch(limit=50, include_not_due=False, record_events=False)
 
-            # 获取到期租约
-            due = db.list_due_member_leases(limit=limit)
-            if not due:
-                return 0
-
-            # 逐个转移
-            for lease in due:
-                if TransferExecutor.execute(lease, only_if_due=True):
-                    moved += 1
-
-            return moved
+            seen: set[str] = set()
+            while True:
+                due = db.list_due_member_leases(limit=batch_size)
+                # 兜底：状态未变化的租约（被其他流程并发修改等）再次出现时不重复处理，避免空转
+                due = [lease for lease in due if lease.get('email') not in seen]
+                if not due:
+                    totals['backlog'] = False
+                    break
+                seen.update(lease.get('email') for lease in due)
+
+                stats = transfer_engine.run_batch(due, heartbeat=heartbeat)
+                totals['batches'] += 1
+                for key in ('moved', 'failed', 'skipped'):
+                    totals[key] += stats[key]
+                # 处理过的租约都会离开 active 状态；不满一批说明已经清空
+                totals['backlog'] = len(due) >= batch_size or stats['skipped'] > 0
+
+                if stats['retry_after']:
+                    totals['retry_after'] = stats['retry_after']
+                    break
+                if not totals['backlog']:
+                    break
+                if max_batches is not None and totals['batches'] >= max_batches:
+                    break
+                if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                    break
+                if not heartbeat():
+                    break
+
+            return totals
         finally:
-            db.release_lock('auto_transfer_monthly', lock_by=lock_by)
+            db.release_lock(_LOCK_NAME, lock_by=lock_by)
 
     @staticmethod
     def run_for_email(email: str) -> dict:
@@ -142,19 +349,38 @@ class TransferScheduler:
             log.info('AUTO_TRANSFER_ENABLED=false，自动转移功能未启用', icon='info')
             return
 
-        poll_seconds = int(os.getenv('AUTO_TRANSFER_POLL_SECONDS', '300') or 300)
-        poll_seconds = max(30, poll_seconds)
+        poll_seconds = max(30, _env_int('AUTO_TRANSFER_POLL_SECONDS', 300))
+        batch_size = max(1, _env_int('AUTO_TRANSFER_BATCH_SIZE', 50))
+        # 单次连续处理的时间上限：到期后立即开始下一次，期间刷新心跳指标
+        drain_seconds = max(60, _env_int('AUTO_TRANSFER_DRAIN_MAX_SECONDS', 600))
 
         def loop():
-            log.info(f'自动转移线程已启动（每 {poll_seconds}s 检查一次）', icon='start')
+            log.info(
+                f'自动转移线程已启动（空闲时每 {poll_seconds}s 检查一次，并发 {transfer_engine.max_workers}）',
+                icon='start',
+            )
             while True:
+                delay = poll_seconds
                 try:
-                    moved = TransferScheduler.run_once(limit=20)
-                    if moved:
-                        log.info(f'本轮自动转移完成: {moved} 人', icon='team')
+                    # 只有后台任务主节点执行（多 worker/多实例时避免重复调用上游）
+                    if background_leader.is_leader():
+                        with metrics.track_loop('auto_transfer'):
+                            result = TransferScheduler.drain(batch_size=batch_size, max_seconds=drain_seconds)
+                        if result['moved'] or result['failed']:
+                            log.info(
+                                f"本轮自动转移完成: 成功 {result['moved']} 人，失败 {result['failed']} 人"
+                                f"（{result['batches']} 批）",
+                                icon='team',
+                            )
+                        if result['retry_after']:
+                            # 速率预算用完：预算恢复后继续
+                            delay = min(poll_seconds, max(1.0, result['retry_after']))
+                        elif result['backlog']:
+                            delay = 0
                 except Exception as e:
                     log.warning(f'自动转移任务异常: {e}')
-                time.sleep(poll_seconds)
+                if delay:
+                    time.sleep(delay)
 
         t = threading.Thread(target=loop, name='auto-transfer', daemon=True)
         t.start()
@@ -3,22 +3,35 @@ Flask Web服务器
 提供兑换码兑换的Web界面和API接口
 """
 
-from flask import Flask, request, jsonify, render_template_string, session, redirect, url_for
+from flask import Flask, Response, g, request, jsonify, render_template_string, session, redirect, stream_with_context, url_for
 from functools import wraps
+import hashlib
+import json
+import math
 import os
 import secrets
+import time
 from datetime import datetime
 from redemption_service import RedemptionService
+from redemption_jobs import TERMINAL_STATUSES as REDEMPTION_JOB_TERMINAL_STATUSES
+from redemption_jobs import redemption_job_runner, start_redemption_job_runner
+from config_watcher import start_config_watcher
+from health import health_prober, start_health_prober
+from events import iter_event_stream, stream_hold_seconds
+from idempotency import idempotency_guard, idempotent
 from database import db
+from cache import TTLCache
+from static_assets import static_assets
 from logger import log
 import config
+import metrics
+import rate_limit
+from config import env_bool
 import ipaddress
 from team_service import get_member_info_for_email
-from transfer_scheduler import start_transfer_worker
 from transfer_scheduler import run_transfer_once, sync_joined_leases_once, sync_joined_leases_once_detailed, run_transfer_for_email, sync_joined_lease_for_email_once_detailed
-from monitor import monitor, run_monitor_loop
-from team_status_checker import start_team_status_checker
-from abnormal_transfer_checker import start_abnormal_transfer_checker
+from monitor import monitor
+from worker import start_background_jobs
 
 
 app = Flask(__name__)
@@ -40,65 +53,40 @@ app.secret_key = _secret_key  # 用于 session 加密
 ADMIN_PASSWORD = config.get("web.admin_password", "admin123")
 ENABLE_ADMIN = config.get("web.enable_admin", True)
 
-# 后台：按月到期自动转移（默认关闭，通过 AUTO_TRANSFER_ENABLED=true 开启）
-start_transfer_worker()
+# 后台：配置热加载（Team 变更通过 SQLite 版本号通知所有 worker）
+start_config_watcher()
 
-# 后台：监控和告警（默认开启，通过 MONITOR_ENABLED=false 关闭）
-if os.getenv("MONITOR_ENABLED", "true").lower() != "false":
-    monitor_interval = int(os.getenv("MONITOR_INTERVAL", "300"))  # 默认 5 分钟
-    run_monitor_loop(interval=monitor_interval)
+# 后台：深度健康检查探测（同一主机只有一个进程执行探测，其余进程读取快照）
+start_health_prober()
 
-# 后台：Team 状态检测（默认开启，通过 TEAM_STATUS_CHECK_ENABLED=false 关闭）
-if os.getenv("TEAM_STATUS_CHECK_ENABLED", "true").lower() != "false":
-    # 默认 3 小时检测一次，可通过环境变量配置
-    check_interval = int(os.getenv("TEAM_STATUS_CHECK_INTERVAL", "10800"))  # 10800 秒 = 3 小时
-    start_team_status_checker(interval=check_interval)
+# 后台：异步兑换任务执行（/api/redeem 异步模式，属于请求处理的一部分，Web 进程始终启动）
+start_redemption_job_runner()
 
-# 后台：异常转移检测（默认开启，通过 ABNORMAL_TRANSFER_CHECK_ENABLED=false 关闭）
-if os.getenv("ABNORMAL_TRANSFER_CHECK_ENABLED", "true").lower() != "false":
-    # 默认 30 分钟检测一次，可通过环境变量配置
-    abnormal_check_interval = int(os.getenv("ABNORMAL_TRANSFER_CHECK_INTERVAL", "1800"))  # 1800 秒 = 30 分钟
-    start_abnormal_transfer_checker(interval=abnormal_check_interval)
+# 后台：定时任务（自动转移、监控、Team 状态检测、异常转移检测、延迟任务队列）
+# 默认在 Web 进程内运行，多个 worker 通过数据库选主只执行一份；
+# RUN_BACKGROUND_JOBS=false 时 Web 只处理请求，后台任务由独立进程 `python -m worker` 运行
+if env_bool("RUN_BACKGROUND_JOBS", True):
+    start_background_jobs()
+else:
+    log.info("RUN_BACKGROUND_JOBS=false，本进程不运行后台任务（请单独启动 python -m worker）", icon="info")
 
 
-_last_config_reload_sig: tuple[float, float, int, int] | None = None
-
-
-def _config_files_signature() -> tuple[float, float, int, int]:
-    cfg_path = config.CONFIG_FILE if config.CONFIG_FILE.exists() else config.FALLBACK_CONFIG_FILE
-    team_path = config.TEAM_JSON_FILE if config.TEAM_JSON_FILE.exists() else config.FALLBACK_TEAM_JSON_FILE
-    try:
-        cfg_stat = cfg_path.stat()
-        cfg_mtime = cfg_stat.st_mtime
-        cfg_size = cfg_stat.st_size
-    except Exception:
-        cfg_mtime = 0.0
-        cfg_size = 0
-    try:
-        team_stat = team_path.stat()
-        team_mtime = team_stat.st_mtime
-        team_size = team_stat.st_size
-    except Exception:
-        team_mtime = 0.0
-        team_size = 0
-    return (cfg_mtime, team_mtime, cfg_size, team_size)
-
+# ==================== 请求指标 ====================
 
 @app.before_request
-def _auto_reload_config_if_changed():
-    """
-    多 worker 环境下（gunicorn）Team 变更只会在触发保存的那个 worker 里 reload。
-    这里按文件 mtime 自动 reload，保证所有 worker 最终一致。
-    """
-    global _last_config_reload_sig
-    try:
-        sig = _config_files_signature()
-        if _last_config_reload_sig != sig:
-            config.reload_teams()
-            _last_config_reload_sig = sig
-    except Exception:
-        # 不影响请求主流程
-        pass
+def _metrics_start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+@app.after_request
+def _metrics_record_request(response):
+    """按路由模板记录请求耗时和状态码（流式响应只计到返回响应头为止）"""
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.observe(metrics.HTTP_LATENCY, time.perf_counter() - start, {"method": request.method, "route": route})
+        metrics.inc(metrics.HTTP_REQUESTS, {"method": request.method, "route": route, "status": response.status_code})
+    return response
 
 
 # ==================== 认证装饰器 ====================
@@ -178,6 +166,105 @@ def _get_client_ip() -> str | None:
     return str(parsed[0]) if parsed else None
 
 
+# ==================== 请求限流 ====================
+
+# 路由 -> 限流规则（见 rate_limit.py）
+_RATE_LIMIT_ENDPOINTS = {
+    "redeem": "redeem",
+    "redeem_batch": "redeem",
+    "verify": "verify",
+    "user_status": "user",
+    "user_unbind": "user",
+    "user_transfer": "user",
+    "redeem_status": "status",
+    "redeem_status_stream": "status",
+}
+
+
+def _rate_limit_batch_size(data: dict) -> int:
+    """批量兑换按兑换码数量扣减额度（超过单次上限的请求会被接口直接拒绝，只计 1 次）"""
+    items = data.get("items") if data.get("items") is not None else data.get("codes")
+    if not isinstance(items, list) or not 0 < len(items) <= 20:
+        return 1
+    return len(items)
+
+
+def _rate_limit_keys(data: dict) -> tuple[list[str], list[str]]:
+    """请求中的 (邮箱列表, 兑换码前缀列表)，用于按邮箱 / 按前缀限流"""
+    entries = [data]
+    if isinstance(data.get("items"), list):
+        entries += [item for item in data["items"] if isinstance(item, dict)]
+    emails = {str(e.get("email") or "").strip().lower() for e in entries}
+    codes = [str(e.get("code") or "") for e in entries]
+    if isinstance(data.get("codes"), list):
+        codes += [str(code or "") for code in data["codes"]]
+    prefixes = {code.strip().upper().split("-", 1)[0] for code in codes if "-" in code}
+    return sorted(e for e in emails if e), sorted(p for p in prefixes if p)
+
+
+def _rate_limited_response(rule: rate_limit.RateRule, decision: rate_limit.RateDecision):
+    metrics.inc(metrics.RATE_LIMITED, {"rule": rule.name})
+    retry_after = max(1, math.ceil(decision.retry_after))
+    wait = f"{retry_after} 秒" if retry_after < 120 else f"{math.ceil(retry_after / 60)} 分钟"
+    response = jsonify({
+        "success": False,
+        "error": f"操作过于频繁，请 {wait}后再试",
+        "code": "RATE_LIMIT",
+        "retry_after": retry_after,
+    })
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    response.headers["X-RateLimit-Limit"] = str(decision.limit)
+    response.headers["X-RateLimit-Remaining"] = "0"
+    return response
+
+
+@app.before_request
+def _enforce_rate_limit():
+    """按路由限流（在业务逻辑之前执行，失败、格式错误的请求同样计数）"""
+    if not rate_limit.RATE_LIMIT_ENABLED or request.method == "OPTIONS":
+        return None
+    group = _RATE_LIMIT_ENDPOINTS.get(request.endpoint or "")
+    rules = rate_limit.load_rules()
+    rule = rules.get(group) if group else None
+    if rule is None:
+        return None
+
+    # 用同一个幂等键重试以取回已完成的结果：直接由 @idempotent 重放，不消耗限流额度
+    scope = getattr(app.view_functions.get(request.endpoint), "idempotency_scope", None)
+    if scope and idempotency_guard.is_replay(scope):
+        return None
+
+    data = request.get_json(silent=True) if request.is_json else None
+    data = data if isinstance(data, dict) else {}
+    batch = request.endpoint == "redeem_batch"
+    cost = _rate_limit_batch_size(data) if batch else 1
+
+    # 批量兑换额度不足时放行剩余额度内的部分，其余兑换码返回 RATE_LIMIT
+    decision = rate_limit.limiter.take(rule, _get_client_ip() or "unknown", cost=cost, partial=batch)
+    if decision.granted == 0:
+        return _rate_limited_response(rule, decision)
+    g.rate_limit_budget = decision.granted
+    g.rate_limit_headers = {"X-RateLimit-Limit": str(decision.limit), "X-RateLimit-Remaining": str(decision.remaining)}
+
+    if group == "redeem" and ("redeem_email" in rules or "redeem_prefix" in rules):
+        emails, prefixes = _rate_limit_keys(data)
+        for rule_name, keys in (("redeem_email", emails), ("redeem_prefix", prefixes)):
+            extra_rule = rules.get(rule_name)
+            for key in keys if extra_rule is not None else ():
+                extra = rate_limit.limiter.take(extra_rule, key)
+                if not extra.allowed:
+                    return _rate_limited_response(extra_rule, extra)
+    return None
+
+
+@app.after_request
+def _rate_limit_headers(response):
+    for key, value in (g.pop("rate_limit_headers", None) or {}).items():
+        response.headers.setdefault(key, value)
+    return response
+
+
 def _team_index_from_any_name(team_name: str | None) -> int | None:
     if not team_name:
         return None
@@ -209,25 +296,61 @@ def _team_display_name(team_name: str | None) -> str | None:
 @app.route("/")
 def index():
     """兑换页面"""
-    with open("static/index.html", "r", encoding="utf-8") as f:
-        return f.read()
+    return static_assets.page_response("index")
 
 
 @app.route("/batch.html")
 def batch_page():
     """批量兑换页面"""
-    with open("static/batch.html", "r", encoding="utf-8") as f:
-        return f.read()
+    return static_assets.page_response("batch")
 
 
 @app.route("/user.html")
 def user_page():
     """用户中心页面"""
-    with open("static/user.html", "r", encoding="utf-8") as f:
-        return f.read()
+    return static_assets.page_response("user")
+
+
+@app.route("/assets/<path:filename>")
+def static_asset(filename: str):
+    """带指纹的静态资源（build_assets.py 构建产物，长期缓存）"""
+    if static_assets.asset_page(filename) == "admin":
+        # 管理后台脚本只对已登录管理员开放
+        if not ENABLE_ADMIN or not session.get("admin_logged_in"):
+            return jsonify({"success": False, "error": "未登录"}), 401
+        return static_assets.asset_response(filename, cache_control="private, max-age=31536000, immutable")
+    return static_assets.asset_response(filename)
+
+
+def _redeem_http_status(result: dict) -> int:
+    """根据兑换结果的错误类型返回 HTTP 状态码"""
+    if result.get("success"):
+        return 200
+    error_code = result.get("code", "UNKNOWN")
+    if error_code == "RATE_LIMIT":
+        return 429  # Too Many Requests
+    if error_code in ["INVALID_EMAIL", "INVALID_CODE"]:
+        return 400  # Bad Request
+    return 500  # Internal Server Error
+
+
+def _redeem_async_requested(data: dict) -> bool:
+    """
+    是否使用异步兑换：
+    - 请求体 async=true 或请求头 Prefer: respond-async
+    - 或全局开启 REDEEM_ASYNC_MODE=true / redemption.async_mode
+    """
+    if "async" in data:
+        return bool(data.get("async"))
+    if "respond-async" in (request.headers.get("Prefer") or "").lower():
+        return True
+    if env_bool("REDEEM_ASYNC_MODE", False):
+        return True
+    return bool(config.get("redemption.async_mode", False))
 
 
 @app.route("/api/redeem", methods=["POST"])
+@idempotent("redeem")
 def redeem():
     """兑换接口"""
     try:
@@ -245,28 +368,83 @@ def redeem():
         # 获取客户端IP（反代环境使用真实IP）
         ip_address = _get_client_ip()
 
+        # 异步模式：本地校验 + 预占后立即返回 202，上游调用在后台执行
+        if _redeem_async_requested(data):
+            result = redemption_job_runner.submit(code, email, ip_address)
+            if not result["success"]:
+                return jsonify(result), _redeem_http_status(result)
+
+            job_id = result["job_id"]
+            status_url = url_for("redeem_status", job_id=job_id)
+            response = jsonify({
+                "success": True,
+                "message": "兑换请求已受理，正在发送邀请",
+                "job_id": job_id,
+                "status": result["status"],
+                "status_url": status_url,
+            })
+            response.headers["Location"] = status_url
+            return response, 202
+
         # 执行兑换
         result = RedemptionService.redeem(code, email, ip_address)
 
         # 根据结果返回不同的HTTP状态码
-        if result["success"]:
-            return jsonify(result), 200
-        else:
-            # 根据错误类型返回不同状态码
-            error_code = result.get("code", "UNKNOWN")
-            if error_code == "RATE_LIMIT":
-                return jsonify(result), 429  # Too Many Requests
-            elif error_code in ["INVALID_EMAIL", "INVALID_CODE"]:
-                return jsonify(result), 400  # Bad Request
-            else:
-                return jsonify(result), 500  # Internal Server Error
+        return jsonify(result), _redeem_http_status(result)
 
     except Exception as e:
         log.error(f"兑换接口错误: {e}")
         return jsonify({"success": False, "error": f"系统错误: {str(e)}"}), 500
 
 
+@app.route("/api/redeem/status/<job_id>")
+def redeem_status(job_id):
+    """查询异步兑换任务状态"""
+    try:
+        job = redemption_job_runner.get_status(job_id)
+        if not job:
+            return jsonify({"success": False, "error": "兑换任务不存在"}), 404
+        return jsonify({"success": True, "data": job})
+    except Exception as e:
+        log.error(f"查询兑换任务失败: {e}")
+        return jsonify({"success": False, "error": f"系统错误: {str(e)}"}), 500
+
+
+@app.route("/api/redeem/status/<job_id>/stream")
+def redeem_status_stream(job_id):
+    """以 SSE 推送异步兑换任务状态，任务结束或超时后关闭连接
+
+    sync worker 下不保持连接（与 /api/admin/events 相同）：只推送当前状态和 retry 间隔后结束，由浏览器重连。
+    """
+    if not redemption_job_runner.get_status(job_id):
+        return jsonify({"success": False, "error": "兑换任务不存在"}), 404
+
+    hold_seconds = stream_hold_seconds(request.environ, env="REDEEM_STREAM_HOLD_SECONDS", default=180)
+
+    def generate():
+        yield f"retry: {2000 if hold_seconds <= 0 else 3000}\n\n"
+        last_status = None
+        deadline = time.monotonic() + hold_seconds
+        while True:
+            job = redemption_job_runner.get_status(job_id)
+            if not job:
+                break
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"event: status\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if last_status in REDEMPTION_JOB_TERMINAL_STATUSES or time.monotonic() >= deadline:
+                break
+            time.sleep(1)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/api/redeem/batch", methods=["POST"])
+@idempotent("redeem_batch")
 def redeem_batch():
     """批量兑换接口"""
     try:
@@ -275,17 +453,34 @@ def redeem_batch():
         if not data:
             return jsonify({"success": False, "error": "无效的请求数据"}), 400
 
-        email = data.get("email", "").strip()
-        codes = data.get("codes", [])
+        # 两种格式：{"items": [{"email", "code"}]} 或 {"email", "codes": [...]}
+        items = data.get("items")
+        if items is not None:
+            if not isinstance(items, list) or not items:
+                return jsonify({"success": False, "error": "兑换列表不能为空"}), 400
+            items = [
+                {"email": str(item.get("email") or ""), "code": str(item.get("code") or "")}
+                for item in items
+                if isinstance(item, dict)
+            ]
+        else:
+            email = data.get("email", "").strip()
+            codes = data.get("codes", [])
 
-        if not email:
-            return jsonify({"success": False, "error": "邮箱不能为空"}), 400
+            if not email:
+                return jsonify({"success": False, "error": "邮箱不能为空"}), 400
 
-        if not codes or not isinstance(codes, list):
+            if not codes or not isinstance(codes, list):
+                return jsonify({"success": False, "error": "兑换码列表不能为空"}), 400
+
+            items = [{"email": email, "code": str(code or "")} for code in codes]
+
+        items = [item for item in items if item["code"].strip()]
+        if not items:
             return jsonify({"success": False, "error": "兑换码列表不能为空"}), 400
 
         # 限制单次批量兑换数量
-        if len(codes) > 20:
+        if len(items) > 20:
             return jsonify({"success": False, "error": "单次最多兑换20个码"}), 400
 
         # 获取客户端IP
@@ -295,14 +490,10 @@ def redeem_batch():
         success_count = 0
         fail_count = 0
 
-        for code in codes:
-            code = (code or "").strip().upper()
-            if not code:
-                continue
-
-            result = RedemptionService.redeem(code, email, ip_address)
+        for result in RedemptionService.redeem_batch(items, ip_address, rate_budget=g.get("rate_limit_budget")):
             results.append({
-                "code": code,
+                "code": result["code"],
+                "email": result["email"],
                 "success": result.get("success", False),
                 "message": result.get("message") or result.get("error", "未知错误")
             })
@@ -325,59 +516,91 @@ def redeem_batch():
         return jsonify({"success": False, "error": f"系统错误: {str(e)}"}), 500
 
 
-@app.route("/api/user/status", methods=["POST"])
-def user_status():
-    """用户状态查询接口"""
-    try:
-        data = request.get_json() or {}
-        email = (data.get("email") or "").strip().lower()
-
-        if not email:
-            return jsonify({"success": False, "error": "邮箱不能为空"}), 400
+# 用户状态缓存：按邮箱缓存响应，租约/租约事件/兑换记录写入后通过跨 worker 的邮箱版本号失效
+_user_status_cache = TTLCache(
+    maxsize=int(os.getenv("USER_STATUS_CACHE_SIZE", "4096") or 4096),
+    ttl=float(os.getenv("USER_STATUS_CACHE_TTL", "10") or 10),
+)
 
-        # 查询租约信息
-        lease = db.get_member_lease(email)
 
-        # 查询兑换记录
-        redemptions = db.get_redemptions_by_email(email, limit=10)
+def _build_user_status(email: str) -> dict:
+    """查询租约和兑换记录，构建用户状态响应"""
+    # 查询租约信息
+    lease = db.get_member_lease(email)
 
-        if not lease and not redemptions:
-            return jsonify({
-                "success": True,
-                "found": False,
-                "message": "未找到该邮箱的记录"
-            })
+    # 查询兑换记录
+    redemptions = db.get_redemptions_by_email(email, limit=10)
 
-        # 构建响应数据
-        response = {
+    if not lease and not redemptions:
+        return {
             "success": True,
-            "found": True,
-            "email": email,
-            "lease": None,
-            "redemptions": []
+            "found": False,
+            "message": "未找到该邮箱的记录"
         }
 
-        if lease:
-            response["lease"] = {
-                "team_name": lease.get("team_name"),
-                "status": lease.get("status"),
-                "joined_at": lease.get("joined_at"),
-                "expires_at": lease.get("expires_at"),
-                "created_at": lease.get("created_at")
+    # 构建响应数据
+    response = {
+        "success": True,
+        "found": True,
+        "email": email,
+        "lease": None,
+        "redemptions": []
+    }
+
+    if lease:
+        response["lease"] = {
+            "team_name": lease.get("team_name"),
+            "status": lease.get("status"),
+            "joined_at": lease.get("joined_at"),
+            "expires_at": lease.get("expires_at"),
+            "created_at": lease.get("created_at")
+        }
+
+    if redemptions:
+        response["redemptions"] = [
+            {
+                "code": r.get("code"),
+                "team_name": r.get("team_name"),
+                "redeemed_at": r.get("redeemed_at"),
+                "status": r.get("status", "success")
             }
+            for r in redemptions
+        ]
+
+    return response
+
+
+def _user_status_cached(email: str) -> tuple[dict, str]:
+    """返回 (响应, ETag)；内容不变时 ETag 不变（与缓存是否过期、由哪个 worker 生成无关）"""
+    version = db.email_version(email)
+    hit, value = _user_status_cache.get(email, version=version)
+    if not hit:
+        payload = _build_user_status(email)
+        body = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        value = (payload, hashlib.blake2b(body.encode("utf-8"), digest_size=12).hexdigest())
+        _user_status_cache.set(email, value, version=version)
+    return value
 
-        if redemptions:
-            response["redemptions"] = [
-                {
-                    "code": r.get("code"),
-                    "team_name": r.get("team_name"),
-                    "redeemed_at": r.get("redeemed_at"),
-                    "status": r.get("status", "success")
-                }
-                for r in redemptions
-            ]
 
-        return jsonify(response)
+@app.route("/api/user/status", methods=["GET", "POST"])
+def user_status():
+    """用户状态查询接口（GET 支持 If-None-Match，内容未变化时返回 304）"""
+    try:
+        if request.method == "GET":
+            email = (request.args.get("email") or "").strip().lower()
+        else:
+            data = request.get_json() or {}
+            email = (data.get("email") or "").strip().lower()
+
+        if not email:
+            return jsonify({"success": False, "error": "邮箱不能为空"}), 400
+
+        payload, etag = _user_status_cached(email)
+        response = jsonify(payload)
+        response.set_etag(etag)
+        # 允许浏览器保存，但每次使用前都要带 ETag 重新验证
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response.make_conditional(request)
 
     except Exception as e:
         log.error(f"用户状态查询错误: {e}")
@@ -438,6 +661,7 @@ def user_unbind():
 
 
 @app.route("/api/user/transfer", methods=["POST"])
+@idempotent("user_transfer")
 def user_transfer():
     """用户换车接口 - 质保换车，转移到新 Team"""
     try:
@@ -570,16 +794,8 @@ def admin_logout():
 @require_admin
 def admin_dashboard():
     """管理后台首页"""
-    from flask import make_response
-    with open("static/admin.html", "r", encoding="utf-8") as f:
-        content = f.read()
-
-    # 创建响应并添加禁用缓存的头部
-    response = make_response(content)
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    return response
+    # 每次向服务端校验（ETag），页面未变化时返回 304
+    return static_assets.page_response("admin", cache_control="private, no-cache")
 
 
 @app.route("/admin/debug/team-stats")
@@ -597,140 +813,144 @@ def admin_debug_team_stats_page():
     return response
 
 
-@app.route("/api/admin/stats")
-@require_admin
-def admin_stats():
-    """获取统计信息"""
-    try:
-        # 获取仪表盘统计
-        stats = db.get_dashboard_stats()
+def _normalize_utc_timestamp(value):
+    """SQLite CURRENT_TIMESTAMP（UTC，无时区）转为带 Z 的 ISO 格式，便于前端按本地时区显示"""
+    if isinstance(value, str) and value:
+        if " " in value and "T" not in value:
+            value = value.replace(" ", "T", 1)
+        if not (value.endswith("Z") or "+" in value or "-" in value[10:]):
+            value = value + "Z"
+    return value
 
-        # 获取Team统计
-        raw_team_stats = db.list_team_stats()
 
-        # 只返回"当前已配置的 Team"，并对历史遗留的 Team1/Team2/Team3 名称做归一化，避免出现重复/莫名其妙的 TeamX
-        from team_manager import team_manager
+# Team 表格缓存：teams_stats 写入（跨 worker 版本号）或 Team 配置重新加载后失效
+_team_table_cache = TTLCache(maxsize=4, ttl=float(os.getenv("ADMIN_STATS_CACHE_TTL", "10") or 10))
 
-        teams = team_manager.get_team_list()
 
-        # 调试日志
-        log.info(f"[Team Stats] 配置的 Team 数量: {len(teams)}")
-        log.info(f"[Team Stats] 数据库统计记录数量: {len(raw_team_stats)}")
+def _build_team_table() -> list[dict]:
+    """构建管理后台 Team 表格（一次数据库查询，按当前已配置的 Team 输出）"""
+    from team_manager import team_manager
 
-        stats_by_index: dict[int, dict] = {}
-        for row in raw_team_stats:
-            team_name = row.get("team_name")
-            idx = _team_index_from_any_name(team_name)
-            log.info(f"[Team Stats] 数据库记录: team_name={team_name}, 匹配到 index={idx}")
-            if idx is None:
-                log.warning(f"[Team Stats] 无法匹配 team_name={team_name}，跳过此记录")
-                continue
-            prev = stats_by_index.get(idx)
-            if not prev:
-                stats_by_index[idx] = row
-                continue
-            # 保留更新时间更新的一条
-            if str(row.get("last_updated") or "") > str(prev.get("last_updated") or ""):
-                stats_by_index[idx] = row
+    rows = db.list_team_table()
+    rows_by_name = {row.get("team_name"): row for row in rows}
 
-        team_stats: list[dict] = []
-        for team in teams:
-            idx = team.get("index")
-            if not isinstance(idx, int):
-                log.warning(f"[Team Stats] Team index 不是整数: {idx}")
-                continue
-            row = stats_by_index.get(idx) or {}
-            team_name = team.get("name")
-            log.info(f"[Team Stats] 处理 Team: index={idx}, name={team_name}, 有统计数据={bool(row)}")
+    # 只返回"当前已配置的 Team"，并对历史遗留的 Team1/Team2/Team3 名称做归一化，避免出现重复/莫名其妙的 TeamX
+    teams = team_manager.get_team_list()
+    # 逐 Team 调试日志：未开启 DEBUG 时不拼接内容
+    debug = log.enabled("debug")
+    if debug:
+        log.debug(f"[Team Stats] 配置的 Team 数量: {len(teams)}，数据库记录数量: {len(rows)}")
 
-            last_updated = row.get("last_updated")
-            # teams_stats.last_updated 来自 SQLite CURRENT_TIMESTAMP（UTC）
-            if isinstance(last_updated, str) and last_updated:
-                if " " in last_updated and "T" not in last_updated:
-                    last_updated = last_updated.replace(" ", "T", 1)
-                if not (last_updated.endswith("Z") or "+" in last_updated or "-" in last_updated[10:]):
-                    last_updated = last_updated + "Z"
+    stats_by_index: dict[int, dict] = {}
+    for row in rows:
+        if row.get("id") is None:
+            continue  # 只有兑换码、没有统计行
+        team_name = row.get("team_name")
+        idx = _team_index_from_any_name(team_name)
+        if debug:
+            log.debug(f"[Team Stats] 数据库记录: team_name={team_name}, 匹配到 index={idx}")
+        if idx is None:
+            continue
+        prev = stats_by_index.get(idx)
+        # 保留更新时间更新的一条
+        if not prev or str(row.get("last_updated") or "") > str(prev.get("last_updated") or ""):
+            stats_by_index[idx] = row
+
+    team_stats: list[dict] = []
+    for team in teams:
+        idx = team.get("index")
+        if not isinstance(idx, int):
+            if debug:
+                log.debug(f"[Team Stats] Team index 不是整数: {idx}")
+            continue
+        row = stats_by_index.get(idx) or {}
+        team_name = team.get("name")
+        own = rows_by_name.get(team_name) or {}
+        has_own_stats = own.get("id") is not None
+        if debug:
+            log.debug(f"[Team Stats] 处理 Team: index={idx}, name={team_name}, 有统计数据={bool(row)}")
+
+        created_at = team.get("created_at")
+        created_at_source = None
+
+        # 优先从 teams_stats 表获取
+        if not created_at and has_own_stats:
+            created_at = own.get("created_at")
+            created_at_source = own.get("created_at_source")
+            if not created_at:
+                created_at = own.get("first_seen_at")
+                created_at_source = "first_seen"
+
+        # 兼容老数据：Team 没有 created_at 时，用该 Team 最早生成兑换码的时间兜底（近似"添加时间"）
+        if not created_at:
+            first_codes = [
+                r.get("first_code_at")
+                for r in (own, rows_by_name.get(f"Team{idx+1}") or {})
+                if r.get("first_code_at")
+            ]
+            if first_codes:
+                created_at = min(first_codes)
+                created_at_source = "first_code"
+
+        # Team 状态信息
+        status = "unknown"
+        status_error = None
+        last_checked_at = None
+        if has_own_stats:
+            is_active = own.get("is_active", 1)
+            status = "active" if is_active else "inactive"
+            status_error = own.get("status_error")
+            last_checked_at = own.get("last_checked_at")
+
+        team_stats.append(
+            {
+                "team_name": team_name,
+                "team_display_name": team_name,  # 添加显示名称
+                "team_key": team_name,  # 添加 key
+                "team_index": idx,
+                "total_seats": row.get("total_seats", 0),
+                "used_seats": row.get("used_seats", 0),
+                "pending_invites": row.get("pending_invites", 0),
+                "available_seats": row.get("available_seats", 0),
+                # created_at / last_updated 来自 SQLite CURRENT_TIMESTAMP（UTC）
+                "created_at": _normalize_utc_timestamp(created_at),
+                "created_at_source": created_at_source,
+                "last_updated": _normalize_utc_timestamp(row.get("last_updated")),
+                "status": status,
+                "status_error": status_error,
+                "last_checked_at": last_checked_at,
+            }
+        )
 
-            created_at = team.get("created_at")
-            created_at_source = None
+    log.debug(f"[Team Stats] 最终返回 {len(team_stats)} 个 Team 统计")
+    return team_stats
 
-            # 优先从 teams_stats 表获取
-            if not created_at:
-                team_time_info = db.get_team_created_at(team_name)
-                if team_time_info:
-                    created_at = team_time_info.get("created_at")
-                    created_at_source = team_time_info.get("created_at_source")
-                    if not created_at:
-                        created_at = team_time_info.get("first_seen_at")
-                        created_at_source = "first_seen"
-
-            # 兼容老数据：Team 没有 created_at 时，用该 Team 最早生成兑换码的时间兜底（近似"添加时间"）
-            if not created_at:
-                try:
-                    with db.get_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            """
-                            SELECT MIN(created_at) AS first_time
-                            FROM redemption_codes
-                            WHERE team_name IN (?, ?)
-                        """,
-                            (team_name, f"Team{idx+1}"),
-                        )
-                        r = cursor.fetchone()
-                        created_at = (r["first_time"] if r else None)
-                        if created_at:
-                            created_at_source = "first_code"
-                except Exception:
-                    created_at = None
-
-            if isinstance(created_at, str) and created_at:
-                if " " in created_at and "T" not in created_at:
-                    created_at = created_at.replace(" ", "T", 1)
-                # redemption_codes.created_at 来自 SQLite CURRENT_TIMESTAMP（UTC）
-                if not (created_at.endswith("Z") or "+" in created_at or "-" in created_at[10:]):
-                    created_at = created_at + "Z"
-
-            # 获取 Team 状态信息
-            team_status_info = db.get_team_status(team_name)
-            status = "unknown"
-            status_error = None
-            last_checked_at = None
-
-            if team_status_info:
-                is_active = team_status_info.get("is_active", 1)
-                status = "active" if is_active else "inactive"
-                status_error = team_status_info.get("status_error")
-                last_checked_at = team_status_info.get("last_checked_at")
-
-            team_stats.append(
-                {
-                    "team_name": team_name,
-                    "team_display_name": team_name,  # 添加显示名称
-                    "team_key": team_name,  # 添加 key
-                    "team_index": idx,
-                    "total_seats": row.get("total_seats", 0),
-                    "used_seats": row.get("used_seats", 0),
-                    "pending_invites": row.get("pending_invites", 0),
-                    "available_seats": row.get("available_seats", 0),
-                    "created_at": created_at,
-                    "created_at_source": created_at_source,
-                    "last_updated": last_updated,
-                    "status": status,
-                    "status_error": status_error,
-                    "last_checked_at": last_checked_at,
-                }
-            )
 
-        log.info(f"[Team Stats] 最终返回 {len(team_stats)} 个 Team 统计")
+@app.route("/api/admin/stats")
+@require_admin
+def admin_stats():
+    """获取统计信息（支持 ETag / If-None-Match 条件请求）"""
+    try:
+        # 获取仪表盘统计
+        stats = db.get_dashboard_stats()
 
-        return jsonify({
+        # 获取Team统计（短时缓存；config.TEAMS 为只读快照，重新加载后对象变化即失效）
+        version = (db.team_stats_version(), config.TEAMS)
+        hit, team_stats = _team_table_cache.get("teams", version=version)
+        if not hit:
+            team_stats = _build_team_table()
+            _team_table_cache.set("teams", team_stats, version=version)
+
+        response = jsonify({
             "success": True,
             "data": {
                 "dashboard": stats,
                 "teams": team_stats
             }
         })
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.add_etag()
+        return response.make_conditional(request)
     except Exception as e:
         log.error(f"获取统计失败: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -791,6 +1011,68 @@ def debug_team_stats_api():
         }), 500
 
 
+@app.route("/api/admin/events")
+@require_admin
+def admin_events():
+    """管理后台变更事件（SSE）：兑换完成、租约变化、告警、Team 状态切换"""
+    raw = request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or ""
+    try:
+        last_event_id = int(raw) if raw.strip() else None
+    except ValueError:
+        last_event_id = None
+
+    return Response(
+        stream_with_context(iter_event_stream(last_event_id, hold_seconds=stream_hold_seconds(request.environ))),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/admin/export/<kind>")
+@require_admin
+def admin_export(kind: str):
+    """流式导出 CSV / NDJSON（codes / redemptions / leases / events）"""
+    from exporters import EXPORT_FORMATS, iter_export
+
+    fmt = (request.args.get("format") or "csv").strip().lower()
+    team_name = (request.args.get("team") or "").strip()
+    team_names = None
+    if team_name:
+        # 兼容：数据库中可能存的是 Team3 这类旧名字
+        team_names = [team_name]
+        idx = _team_index_from_any_name(team_name)
+        if idx is not None:
+            team_names.append(f"Team{idx+1}")
+            current = config.TEAMS[idx].get("name")
+            if current:
+                team_names.append(current)
+            team_names = list(dict.fromkeys(team_names))
+
+    try:
+        chunks = iter_export(
+            kind,
+            fmt,
+            team_names=team_names,
+            group_name=request.args.get("group"),
+            status=(request.args.get("status") or "").strip() or None,
+            since=(request.args.get("since") or "").strip() or None,
+            until=(request.args.get("until") or "").strip() or None,
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+
+    filename = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(chunks),
+        content_type=EXPORT_FORMATS[fmt],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
 @app.route("/api/admin/codes")
 @require_admin
 def admin_list_codes():
@@ -1137,6 +1419,23 @@ def admin_run_transfer_once():
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/api/admin/leases/forecast")
+@require_admin
+def admin_lease_forecast():
+    """租约到期预测：按天/小时统计到期人数，预测各 Team 席位需求"""
+    try:
+        from lease_forecast import forecast
+
+        days = int(request.args.get("days", 35))
+        bucket = request.args.get("bucket", "day")
+        return jsonify({"success": True, "data": forecast(days=days, bucket=bucket)})
+    except ValueError:
+        return jsonify({"success": False, "error": "days 必须是整数"}), 400
+    except Exception as e:
+        log.error(f"租约到期预测失败: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @app.route("/api/admin/leases/force-expire", methods=["POST"])
 @require_admin
 def admin_force_expire_lease():
@@ -1519,8 +1818,7 @@ def admin_add_team():
         if result["success"]:
             # 自动刷新该 Team 的统计信息
             try:
-                # 重新加载配置以获取新添加的 Team
-                config.reload_teams()
+                # team_manager 保存时已重新加载配置
                 team_config = config.resolve_team(name)
 
                 if team_config:
@@ -1583,7 +1881,6 @@ def admin_update_team(index):
             # 如果更新了 access_token，自动刷新统计信息
             if access_token:
                 try:
-                    config.reload_teams()
                     team_config = config.resolve_team(name)
 
                     if team_config:
@@ -1859,6 +2156,57 @@ def health():
     })
 
 
+def _bearer_token_ok(env_name: str) -> bool:
+    """请求是否携带与环境变量 env_name 一致的 Bearer Token（未配置时返回 False）"""
+    token = (os.getenv(env_name) or "").strip()
+    if not token:
+        return False
+    auth = request.headers.get("Authorization", "")
+    return secrets.compare_digest(auth.encode(), f"Bearer {token}".encode())
+
+
+@app.route("/health/deep")
+def health_deep():
+    """深度健康检查（读取后台探测快照；down 返回 503，供负载均衡摘除实例）
+
+    匿名请求只返回总体状态；组件详情（Team 名称、错误信息、主节点等）需登录管理后台或携带 HEALTH_TOKEN。
+    """
+    snapshot = health_prober.snapshot()
+    status_code = 503 if snapshot.get("status") == "down" else 200
+    if not (session.get("admin_logged_in") or _bearer_token_ok("HEALTH_TOKEN")):
+        return jsonify({"status": snapshot.get("status")}), status_code
+    return jsonify(snapshot), status_code
+
+
+def _internal_direct_request() -> bool:
+    """是否为本机 / 内网直连的请求（经反向代理转发、带转发头的请求一律视为外部请求）"""
+    if any(request.headers.get(h) for h in ("Forwarded", "X-Forwarded-For", "X-Real-IP")):
+        return False
+    try:
+        addr = ipaddress.ip_address(request.remote_addr or "")
+    except ValueError:
+        return False
+    return addr.is_loopback or addr.is_private
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus 指标（合并所有 worker 进程）
+
+    设置 METRICS_TOKEN 后需携带 Bearer Token；未设置时只允许本机 / 内网直连抓取（不经反向代理）。
+    """
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "接口不存在"}), 404
+    if (os.getenv("METRICS_TOKEN") or "").strip():
+        if not _bearer_token_ok("METRICS_TOKEN"):
+            return Response("Unauthorized", status=401, headers={"WWW-Authenticate": "Bearer"})
+    elif not _internal_direct_request():
+        return Response("Forbidden: set METRICS_TOKEN to scrape from outside", status=403)
+    response = Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
 # ==================== 监控和告警 API ====================
 
 @app.route("/api/admin/monitor/dashboard")
@@ -0,0 +1,78 @@
+"""
+后台任务进程
+独立于 Web 进程运行所有定时后台任务（自动转移、监控告警、Team 状态检测、异常转移检测、延迟任务队列）:
+
+    python -m worker
+
+配合 Web 进程设置 RUN_BACKGROUND_JOBS=false 使用（Web 只处理请求）。
+可以运行多个实例：通过数据库租约锁选出一个主节点执行定时任务，其余实例待命接替。
+"""
+
+from __future__ import annotations
+
+import os
+import signal
+import threading
+
+from config import env_bool
+from config_watcher import start_config_watcher
+from delay_queue import start_delay_queue
+from leader_election import background_leader
+from logger import log
+from monitor import run_monitor_loop
+from team_status_checker import start_team_status_checker
+from abnormal_transfer_checker import start_abnormal_transfer_checker
+from transfer_scheduler import start_transfer_worker
+
+
+def start_background_jobs():
+    """启动主节点选举和全部定时后台任务（任务只在主节点上执行）"""
+    background_leader.start_worker(lease_seconds=int(os.getenv("BACKGROUND_LEADER_LEASE_SECONDS", "60") or 60))
+
+    # 按月到期自动转移（默认关闭，通过 AUTO_TRANSFER_ENABLED=true 开启）
+    start_transfer_worker()
+
+    # 延迟任务队列（多进程通过数据库领取任务，不依赖主节点）
+    start_delay_queue()
+
+    # 监控和告警（默认开启，通过 MONITOR_ENABLED=false 关闭）
+    if env_bool("MONITOR_ENABLED", True):
+        monitor_interval = int(os.getenv("MONITOR_INTERVAL", "300"))  # 默认 5 分钟
+        run_monitor_loop(interval=monitor_interval)
+
+    # Team 状态检测（默认开启，通过 TEAM_STATUS_CHECK_ENABLED=false 关闭）
+    if env_bool("TEAM_STATUS_CHECK_ENABLED", True):
+        # 默认 3 小时检测一次，可通过环境变量配置
+        check_interval = int(os.getenv("TEAM_STATUS_CHECK_INTERVAL", "10800"))  # 10800 秒 = 3 小时
+        start_team_status_checker(interval=check_interval)
+
+    # 异常转移检测（默认开启，通过 ABNORMAL_TRANSFER_CHECK_ENABLED=false 关闭）
+    if env_bool("ABNORMAL_TRANSFER_CHECK_ENABLED", True):
+        # 默认 30 分钟检测一次，可通过环境变量配置
+        abnormal_check_interval = int(os.getenv("ABNORMAL_TRANSFER_CHECK_INTERVAL", "1800"))  # 1800 秒 = 30 分钟
+        start_abnormal_transfer_checker(interval=abnormal_check_interval)
+
+
+def main():
+    log.info("后台任务进程启动", icon="start")
+    start_config_watcher()
+    start_background_jobs()
+
+    stop = threading.Event()
+
+    def _handle_signal(signum, frame):
+        log.info(f"收到信号 {signum}，后台任务进程退出")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+    while not stop.wait(timeout=1):
+        pass
+
+    # 让出主节点，其他实例无需等待租约过期即可接替
+    background_leader.resign()
+
+
+if __name__ == "__main__":
+    main()